@@ -1,17 +1,71 @@
 import pandas as pd
 import numpy as np
-from sqlalchemy import create_engine, text, inspect
-import matplotlib.pyplot as plt
+from sqlalchemy import create_engine, text
 import streamlit as st
 import tempfile
 import os
 import ollama
+import httpx
+import re
 import json
+import asyncio
+import time
+import sqlite3
+import hashlib
+import functools
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import closing, contextmanager
 from datetime import datetime
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Iterator, Iterable, Callable, Tuple
 
 # --- Configuração ---
 from config import DB_CONFIG, OLLAMA_CONFIG
+try:
+    from config import CACHE_CONFIG
+except ImportError:  # config.py antigo, sem a seção de cache
+    CACHE_CONFIG = {}
+try:
+    from config import ANALISE_CONFIG
+except ImportError:  # config.py antigo, sem a seção de análise
+    ANALISE_CONFIG = {}
+try:
+    from config import RASTREIO_CONFIG
+except ImportError:  # config.py antigo, sem a seção de rastreio
+    RASTREIO_CONFIG = {}
+try:
+    from config import DW_CONFIG
+except ImportError:  # config.py antigo, sem a seção do DW
+    DW_CONFIG = {}
+
+from intencao_bi import classificar_intencao_local, classificar_por_palavras_chave
+from contexto_bi import montar_contexto_compacto
+from desenho_fisico_bi import (comandos_atualizar_visoes, comandos_plano, comandos_remover_visoes, formatar_desenho,
+                               inspecionar_estrela, medir_consultas, planejar_desenho, tabelas_criadas,
+                               visoes_registradas)
+from perfil_bi import perfilar_csv
+from workspace_bi import (amostra_colunar, caminho_colunar, conversao_falhou, despejar_workspace,
+                          estatisticas_workspace, ler_colunar, obter_colunar, perfilar_colunar, perfilar_convertendo,
+                          registrar_conversao, workspace_disponivel)
+from tipos_bi import aplicar_tipos, inferir_tipos, ler_csv_compacto, memoria_bytes
+from graficos_bi import escolher_grafico, colunas_do_grafico, preparar_dados, desenhar_png
+from motor_sql_bi import lotes_embutidos, motor_disponivel
+from roteador_bi import (chamada_em_andamento, escolher_modelo, modelos_em_uso, preferencia_modelo, prazo_tarefa,
+                          registrar_latencia)
+from modelos_bi import keep_alive_modelo, registrar_uso_modelo
+from rastreio_bi import configurar_rastreio, contexto_atual, metricas_ollama, rastreio, span
+from jobs_bi import limite_recurso
+from uploads_bi import (abrir_binario, dados_upload, digest_upload, eh_upload, estatisticas_uploads, fonte_csv,
+                        registrar_upload, tamanho_fonte)
+
+configurar_rastreio(
+    ativo=RASTREIO_CONFIG.get("ativo", True),
+    arquivo=RASTREIO_CONFIG.get("arquivo", ".cache_bi/rastreio.jsonl"),
+    max_resumos=RASTREIO_CONFIG.get("max_resumos", 20),
+)
 
 # ⭐⭐ VERIFICAÇÃO DOS MODELOS ⭐⭐
 MODELO_ATUAL = OLLAMA_CONFIG["modelo_padrao"]
@@ -22,29 +76,225 @@ MODELO_COMPLETO = OLLAMA_CONFIG["modelo_completo"]
 print(f"🎯 MODELO CONFIGURADO: {MODELO_ATUAL}")
 
 # --- Conexão com Banco ---
-def get_engine():
-    """Cria conexão com PostgreSQL local"""
+# Engine único por processo: todas as sessões do Streamlit compartilham o mesmo pool
+_ENGINE = None
+_ENGINE_LOCK = threading.Lock()
+_ESTATISTICAS_POOL = {"aquisicoes": 0, "espera_total_s": 0.0, "espera_max_s": 0.0}
+
+def _montar_connection_string() -> str:
+    """Monta a URL de conexão a partir do DB_CONFIG (driver psycopg2)"""
     if DB_CONFIG["password"]:
-        connection_string = f"postgresql://{DB_CONFIG['username']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}"
-    else:
-        connection_string = f"postgresql://{DB_CONFIG['username']}@{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}"
-    return create_engine(connection_string)
+        return f"postgresql+psycopg2://{DB_CONFIG['username']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}"
+    return f"postgresql+psycopg2://{DB_CONFIG['username']}@{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}"
 
-# --- Função Principal de Consulta ---
-def consultar_ollama_local(prompt: str, contexto: Dict = None, modelo_especifico: str = None) -> str:
-    """Consulta o modelo Ollama configurado - VERSÃO CORRIGIDA"""
-    
-    # ⭐⭐ SEMPRE usa o modelo especificado ou o padrão do config.py ⭐⭐
-    modelo_usar = modelo_especifico if modelo_especifico else MODELO_ATUAL
-    
-    # Força phi3:mini se ainda estiver usando outro
-    if modelo_usar != "phi3:mini":
-        modelo_usar = "phi3:mini"
-    
+def get_engine():
+    """Retorna o engine compartilhado (com pool de conexões) do PostgreSQL local"""
+    global _ENGINE
+    if _ENGINE is None:
+        with _ENGINE_LOCK:
+            if _ENGINE is None:
+                _ENGINE = create_engine(
+                    _montar_connection_string(),
+                    pool_size=DB_CONFIG.get("pool_size", 5),
+                    max_overflow=DB_CONFIG.get("max_overflow", 10),
+                    pool_timeout=DB_CONFIG.get("pool_timeout", 30),
+                    pool_pre_ping=DB_CONFIG.get("pool_pre_ping", True),
+                    pool_recycle=DB_CONFIG.get("pool_recycle", 1800),
+                )
+    return _ENGINE
+
+@contextmanager
+def conexao_banco():
+    """Empresta uma conexão do pool, medindo o tempo de espera pela conexão"""
+    with limite_recurso("banco"):
+        inicio = time.perf_counter()
+        conn = get_engine().connect()
+        espera = time.perf_counter() - inicio
+        with _ENGINE_LOCK:
+            _ESTATISTICAS_POOL["aquisicoes"] += 1
+            _ESTATISTICAS_POOL["espera_total_s"] += espera
+            _ESTATISTICAS_POOL["espera_max_s"] = max(_ESTATISTICAS_POOL["espera_max_s"], espera)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+def obter_estatisticas_pool() -> Dict:
+    """Retorna estatísticas do pool de conexões para dimensionamento"""
+    if _ENGINE is None:
+        return {"status": "engine ainda não criado"}
+    pool = _ENGINE.pool
+    with _ENGINE_LOCK:
+        aquisicoes = _ESTATISTICAS_POOL["aquisicoes"]
+        espera_total = _ESTATISTICAS_POOL["espera_total_s"]
+        espera_max = _ESTATISTICAS_POOL["espera_max_s"]
+    return {
+        "tamanho_pool": pool.size(),
+        "conexoes_em_uso": pool.checkedout(),
+        "conexoes_livres": pool.checkedin(),
+        "overflow_atual": pool.overflow(),
+        "max_overflow": DB_CONFIG.get("max_overflow", 10),
+        "aquisicoes": aquisicoes,
+        "espera_media_ms": round(espera_total / aquisicoes * 1000, 2) if aquisicoes else 0.0,
+        "espera_max_ms": round(espera_max * 1000, 2),
+    }
+
+def descartar_engine():
+    """Fecha todas as conexões do pool (ex.: após alterar o DB_CONFIG)"""
+    global _ENGINE
+    with _ENGINE_LOCK:
+        if _ENGINE is not None:
+            _ENGINE.dispose()
+            _ENGINE = None
+
+# --- Cache Persistente de Respostas do LLM ---
+# Chave: modelo + prompt final + opções de geração. Guardado em SQLite local.
+_ESTATISTICAS_CACHE_LLM = {"acertos": 0, "faltas": 0}
+_CACHE_LLM_LOCK = threading.Lock()
+
+def _caminho_cache_llm() -> str:
+    return CACHE_CONFIG.get("llm_arquivo", os.path.join(".cache_bi", "llm_cache.sqlite"))
+
+def _conexao_cache_llm() -> sqlite3.Connection:
+    caminho = _caminho_cache_llm()
+    os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+    conn = sqlite3.connect(caminho, timeout=10)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS respostas (
+            chave TEXT PRIMARY KEY,
+            modelo TEXT,
+            resposta TEXT,
+            tamanho INTEGER,
+            criado_em REAL,
+            acessado_em REAL
+        )
+    """)
+    return conn
+
+def _chave_cache_llm(modelo: str, prompt: str, opcoes: Dict) -> str:
+    conteudo = json.dumps([modelo, prompt, opcoes], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(conteudo.encode("utf-8")).hexdigest()
+
+def cache_llm_ativo(opcoes: Dict) -> bool:
+    """O cache vale para chamadas determinísticas (temperatura baixa)"""
+    if not CACHE_CONFIG.get("llm_ativo", True):
+        return False
+    return opcoes.get("temperature", 1.0) <= CACHE_CONFIG.get("llm_temperatura_max", 0.1)
+
+def buscar_cache_llm(modelo: str, prompt: str, opcoes: Dict) -> Optional[str]:
+    """Busca uma resposta em cache ainda dentro do TTL"""
+    chave = _chave_cache_llm(modelo, prompt, opcoes)
+    limite = time.time() - CACHE_CONFIG.get("llm_ttl_horas", 24 * 7) * 3600
+    try:
+        with closing(_conexao_cache_llm()) as conn, conn:
+            linha = conn.execute(
+                "SELECT resposta FROM respostas WHERE chave = ? AND criado_em >= ?", (chave, limite)
+            ).fetchone()
+            if linha:
+                conn.execute("UPDATE respostas SET acessado_em = ? WHERE chave = ?", (time.time(), chave))
+    except sqlite3.Error:
+        linha = None
+
+    with _CACHE_LLM_LOCK:
+        _ESTATISTICAS_CACHE_LLM["acertos" if linha else "faltas"] += 1
+    return linha[0] if linha else None
+
+def guardar_cache_llm(modelo: str, prompt: str, opcoes: Dict, resposta: str):
+    """Guarda a resposta e aplica a expiração por TTL e por tamanho total"""
+    agora = time.time()
+    limite_ttl = agora - CACHE_CONFIG.get("llm_ttl_horas", 24 * 7) * 3600
+    limite_bytes = CACHE_CONFIG.get("llm_tamanho_max_mb", 100) * 1024 * 1024
+    try:
+        with closing(_conexao_cache_llm()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO respostas VALUES (?, ?, ?, ?, ?, ?)",
+                (_chave_cache_llm(modelo, prompt, opcoes), modelo, resposta,
+                 len(resposta.encode("utf-8")), agora, agora),
+            )
+            conn.execute("DELETE FROM respostas WHERE criado_em < ?", (limite_ttl,))
+            total = conn.execute("SELECT COALESCE(SUM(tamanho), 0) FROM respostas").fetchone()[0]
+            if total > limite_bytes:
+                # Remove as menos acessadas até voltar ao limite
+                excedente = total - limite_bytes
+                for chave, tamanho in conn.execute(
+                    "SELECT chave, tamanho FROM respostas ORDER BY acessado_em"
+                ).fetchall():
+                    if excedente <= 0:
+                        break
+                    conn.execute("DELETE FROM respostas WHERE chave = ?", (chave,))
+                    excedente -= tamanho
+    except sqlite3.Error:
+        pass
+
+def obter_estatisticas_cache_llm() -> Dict:
+    """Acertos/faltas da sessão e ocupação do cache em disco"""
+    with _CACHE_LLM_LOCK:
+        estatisticas = dict(_ESTATISTICAS_CACHE_LLM)
     try:
-        # Prompt otimizado
-        if contexto:
-            prompt_completo = f"""
+        with closing(_conexao_cache_llm()) as conn:
+            entradas, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(tamanho), 0) FROM respostas").fetchone()
+    except sqlite3.Error:
+        entradas, total = 0, 0
+    consultas = estatisticas["acertos"] + estatisticas["faltas"]
+    estatisticas["taxa_acerto"] = round(estatisticas["acertos"] / consultas, 3) if consultas else 0.0
+    estatisticas["entradas"] = entradas
+    estatisticas["tamanho_mb"] = round(total / 1024 / 1024, 3)
+    return estatisticas
+
+def limpar_cache_llm():
+    """Apaga todas as respostas em cache"""
+    with closing(_conexao_cache_llm()) as conn, conn:
+        conn.execute("DELETE FROM respostas")
+
+# --- Função Principal de Consulta ---
+def _rotear_modelo(tarefa: str = "padrao", modelo_especifico: str = None):
+    """(modelo, motivo): o modelo pedido explicitamente ou o escolhido pelo roteador para a tarefa"""
+    if modelo_especifico:
+        return modelo_especifico, "modelo fixado"
+    return escolher_modelo(tarefa, OLLAMA_CONFIG)
+
+def _resolver_modelo(modelo_especifico: str = None, tarefa: str = "padrao") -> str:
+    """Modelo a ser usado na chamada ao Ollama"""
+    return _rotear_modelo(tarefa, modelo_especifico)[0]
+
+_CLIENTES_OLLAMA = {}
+_CLIENTES_OLLAMA_LOCK = threading.Lock()
+
+def _cliente_ollama(prazo_s: float):
+    """Cliente Ollama com timeout igual ao prazo da chamada (um por prazo, reaproveitado)"""
+    with _CLIENTES_OLLAMA_LOCK:
+        if prazo_s not in _CLIENTES_OLLAMA:
+            _CLIENTES_OLLAMA[prazo_s] = ollama.Client(timeout=prazo_s)
+        return _CLIENTES_OLLAMA[prazo_s]
+
+def _timeout_ou_sobrecarga(erro: Exception) -> bool:
+    """Falhas em que vale tentar de novo com o modelo rápido"""
+    if isinstance(erro, (httpx.TimeoutException, TimeoutError, asyncio.TimeoutError)):
+        return True
+    # 429/503: fila do servidor cheia (OLLAMA_MAX_QUEUE) ou modelo sem memória para carregar
+    return isinstance(erro, ollama.ResponseError) and erro.status_code in (429, 503)
+
+def _modelos_tentativa(modelo: str) -> List[str]:
+    """O modelo roteado e, se for outro, o modelo rápido como reserva"""
+    return [modelo] if modelo == MODELO_RAPIDO else [modelo, MODELO_RAPIDO]
+
+def _keep_alive(modelo: str):
+    """keep_alive da chamada: longo para os modelos que o roteador está usando"""
+    return keep_alive_modelo(modelo, OLLAMA_CONFIG, modelos_em_uso(OLLAMA_CONFIG.get("roteamento_janela_s", 600)))
+
+def _registrar_metricas(atributos: Dict, modelo: str, resposta):
+    """Métricas de tokens/tempos no span e carga x inferência do modelo"""
+    metricas = metricas_ollama(resposta)
+    atributos.update(metricas)
+    registrar_uso_modelo(modelo, metricas)
+
+def _status_falha(erro: Exception) -> str:
+    return "timeout" if _timeout_ou_sobrecarga(erro) else "erro"
+
+def _montar_prompt_completo(prompt: str, contexto: Dict = None) -> str:
+    """Prompt otimizado, com o contexto dos dados quando houver"""
+    if contexto:
+        return f"""
             CONTEXTO DOS DADOS:
             {json.dumps(contexto, indent=2, ensure_ascii=False)}
             
@@ -53,20 +303,174 @@ def consultar_ollama_local(prompt: str, contexto: Dict = None, modelo_especifico
             
             RESPOSTA: Seja conciso e direto ao ponto.
             """
-        else:
-            prompt_completo = prompt
+    return prompt
+
+def orcamento_contexto_modelo(modelo: str) -> int:
+    """Orçamento de tokens do contexto de dados para o modelo"""
+    orcamentos = OLLAMA_CONFIG.get("orcamento_contexto_tokens", {})
+    return orcamentos.get(modelo, orcamentos.get("padrao", 2000))
+
+def contexto_para_prompt(pergunta: str, contexto_csv: Dict = None, tabelas=None, modelo: str = None,
+                         tarefa: str = "padrao") -> str:
+    """Contexto compacto de arquivos/tabelas dentro do orçamento de tokens do modelo"""
+    modelo = modelo or _resolver_modelo(tarefa=tarefa)
+    texto, info = montar_contexto_compacto(pergunta, contexto_csv, tabelas, orcamento_contexto_modelo(modelo))
+    st.caption(
+        f"🧮 Contexto: {info['tokens_antes']} → {info['tokens_depois']} tokens estimados "
+        f"({info['colunas_incluidas']}/{info['colunas_total']} colunas, "
+        f"{info['tabelas_incluidas']}/{info['tabelas_total']} tabelas)"
+    )
+    return texto
+
+def consultar_ollama_local(prompt: str, contexto: Dict = None, modelo_especifico: str = None,
+                           usar_cache: bool = True, tarefa: str = "padrao") -> str:
+    """Consulta o modelo roteado para a tarefa, com prazo e reserva no modelo rápido"""
+    
+    modelo_usar, motivo = _rotear_modelo(tarefa, modelo_especifico)
+    prazo = prazo_tarefa(tarefa, OLLAMA_CONFIG)
+    
+    try:
+        prompt_completo = _montar_prompt_completo(prompt, contexto)
             
-        st.info(f"🤖 Consultando {modelo_usar}...")
+        opcoes = {'num_predict': 500, 'temperature': 0.1}
+        usar_cache = usar_cache and cache_llm_ativo(opcoes)
+        if usar_cache:
+            resposta_cache = buscar_cache_llm(modelo_usar, prompt_completo, opcoes)
+            if resposta_cache is not None:
+                st.info(f"♻️ Resposta de {modelo_usar} reaproveitada do cache")
+                with span("llm", modelo=modelo_usar, tarefa=tarefa, cache=True):
+                    return resposta_cache
+
+        st.info(f"🤖 Consultando {modelo_usar} ({motivo})...")
         
-        resposta = ollama.chat(
-            model=modelo_usar,  # ⬅️ AGORA usa phi3:mini
-            messages=[{"role": "user", "content": prompt_completo}],
-            options={'num_predict': 500, 'temperature': 0.1}
-        )
-        return resposta["message"]["content"]
+        modelos = _modelos_tentativa(modelo_usar)
+        for modelo_usar in modelos:
+            inicio = time.perf_counter()
+            try:
+                with span("llm", modelo=modelo_usar, tarefa=tarefa, cache=False) as atributos, \
+                        chamada_em_andamento(modelo_usar), limite_recurso("llm"):
+                    resposta = _cliente_ollama(prazo).chat(
+                        model=modelo_usar,
+                        messages=[{"role": "user", "content": prompt_completo}],
+                        options=opcoes,
+                        keep_alive=_keep_alive(modelo_usar)
+                    )
+                    _registrar_metricas(atributos, modelo_usar, resposta)
+                registrar_latencia(modelo_usar, tarefa, time.perf_counter() - inicio)
+                break
+            except Exception as e:
+                registrar_latencia(modelo_usar, tarefa, time.perf_counter() - inicio, _status_falha(e))
+                if not _timeout_ou_sobrecarga(e) or modelo_usar == modelos[-1]:
+                    raise
+                st.warning(f"⏱️ {modelo_usar} não respondeu em {prazo:g}s; usando {modelos[-1]}")
+        conteudo = resposta["message"]["content"]
+        if usar_cache:
+            guardar_cache_llm(modelo_usar, prompt_completo, opcoes, conteudo)
+        return conteudo
     except Exception as e:
         return f"❌ Erro ao consultar {modelo_usar}: {str(e)}"
 
+def consultar_ollama_stream(prompt: str, contexto: Dict = None, modelo_especifico: str = None,
+                            usar_cache: bool = True, tarefa: str = "padrao") -> Iterator[str]:
+    """Versão em streaming de consultar_ollama_local: gera os trechos da resposta à medida que chegam"""
+    
+    if not OLLAMA_CONFIG.get("streaming", True):
+        yield consultar_ollama_local(prompt, contexto, modelo_especifico, usar_cache, tarefa)
+        return
+
+    modelo_usar, motivo = _rotear_modelo(tarefa, modelo_especifico)
+    prazo = prazo_tarefa(tarefa, OLLAMA_CONFIG)
+    prompt_completo = _montar_prompt_completo(prompt, contexto)
+    opcoes = {'num_predict': 500, 'temperature': 0.1}
+    usar_cache = usar_cache and cache_llm_ativo(opcoes)
+
+    if usar_cache:
+        resposta_cache = buscar_cache_llm(modelo_usar, prompt_completo, opcoes)
+        if resposta_cache is not None:
+            st.info(f"♻️ Resposta de {modelo_usar} reaproveitada do cache")
+            with span("llm", modelo=modelo_usar, tarefa=tarefa, cache=True, streaming=True):
+                pass
+            yield resposta_cache
+            return
+
+    st.info(f"🤖 Consultando {modelo_usar} ({motivo}, streaming)...")
+    partes = []
+    modelos = _modelos_tentativa(modelo_usar)
+    for modelo_usar in modelos:
+        with span("llm", modelo=modelo_usar, tarefa=tarefa, cache=False, streaming=True) as atributos, \
+                chamada_em_andamento(modelo_usar), limite_recurso("llm"):
+            inicio = time.perf_counter()
+            try:
+                for pedaco in _cliente_ollama(prazo).chat(
+                    model=modelo_usar,
+                    messages=[{"role": "user", "content": prompt_completo}],
+                    options=opcoes,
+                    stream=True,
+                    keep_alive=_keep_alive(modelo_usar)
+                ):
+                    trecho = pedaco["message"]["content"]
+                    decorrido = time.perf_counter() - inicio
+                    if not partes:
+                        atributos["primeiro_trecho_ms"] = round(decorrido * 1000, 2)
+                    if pedaco.get("done"):
+                        # O último pedaço traz as contagens de tokens e os tempos de prefill/geração
+                        _registrar_metricas(atributos, modelo_usar, pedaco)
+                    partes.append(trecho)
+                    yield trecho
+                    if decorrido > prazo and not pedaco.get("done"):
+                        # O timeout do cliente vale por leitura; o prazo total é conferido aqui
+                        registrar_latencia(modelo_usar, tarefa, decorrido, "timeout")
+                        atributos["interrompida"] = True
+                        yield f"\n⚠️ Resposta interrompida: prazo de {prazo:g}s esgotado"
+                        return
+            except Exception as e:
+                registrar_latencia(modelo_usar, tarefa, time.perf_counter() - inicio, _status_falha(e))
+                atributos["erro"] = str(e)
+                # Só troca de modelo se nada foi mostrado ainda
+                if partes or not _timeout_ou_sobrecarga(e) or modelo_usar == modelos[-1]:
+                    yield f"\n❌ Erro ao consultar {modelo_usar}: {str(e)}"
+                    return
+                st.warning(f"⏱️ {modelo_usar} não respondeu em {prazo:g}s; usando {modelos[-1]}")
+                continue
+        registrar_latencia(modelo_usar, tarefa, time.perf_counter() - inicio)
+        break
+
+    if usar_cache:
+        guardar_cache_llm(modelo_usar, prompt_completo, opcoes, "".join(partes))
+
+def exibir_resposta_streaming(trechos: Iterable[str], ao_fechar_sql: Callable[[str], None] = None) -> str:
+    """Mostra a resposta no Streamlit enquanto é gerada e dispara ao_fechar_sql a cada bloco ```sql concluído"""
+    
+    area = st.empty()
+    texto = ""
+    cercas = 0
+    scripts_enviados = 0
+    ultima_atualizacao = 0.0
+
+    for trecho in trechos:
+        texto += trecho
+
+        if ao_fechar_sql and texto.count("```") != cercas:
+            cercas = texto.count("```")
+            scripts = extrair_scripts_sql(texto, apenas_completos=True)
+            for script in scripts[scripts_enviados:]:
+                ao_fechar_sql(script)
+            scripts_enviados = len(scripts)
+
+        agora = time.perf_counter()
+        if agora - ultima_atualizacao > 0.1:
+            area.markdown(texto + "▌")
+            ultima_atualizacao = agora
+
+    if ao_fechar_sql:
+        # Inclui um último bloco que ficou aberto (resposta cortada pelo num_predict)
+        for script in extrair_scripts_sql(texto)[scripts_enviados:]:
+            ao_fechar_sql(script)
+
+    # O relatório final (montado pelo handler) substitui a prévia
+    area.empty()
+    return texto
+
 # ============================================================================
 # 1. 🎯 ORQUESTRADOR PRINCIPAL
 # ============================================================================
@@ -74,48 +478,73 @@ def consultar_ollama_local(prompt: str, contexto: Dict = None, modelo_especifico
 def orquestrar_acao(pergunta_usuario: str, caminhos_csv: List[str]) -> str:
     """Orquestra a ação baseada na pergunta do usuário"""
     
-    pergunta = pergunta_usuario.lower()
-    contexto_csv = obter_contexto_csv(caminhos_csv)
-    
-    # Análise da intenção usando LLM
-    intencao = analisar_intencao(pergunta_usuario, contexto_csv)
-    
-    st.info(f"🎯 Ação detectada: {intencao['acao_principal']}")
-    
-    # Executa a ação correspondente
-    if intencao['acao_principal'] == 'analise_exploratoria':
+    with rastreio("pergunta", pergunta=pergunta_usuario, arquivos=len(caminhos_csv)) as atributos:
+        with span("contexto_csv"):
+            contexto_csv = obter_contexto_csv(caminhos_csv)
+        
+        # Análise da intenção usando LLM
+        with span("intencao"):
+            intencao = analisar_intencao(pergunta_usuario, contexto_csv)
+        atributos["acao"] = intencao['acao_principal']
+        
+        st.info(f"🎯 Ação detectada: {intencao['acao_principal']}")
+        
+        # Executa a ação correspondente
+        return despachar_acao(intencao['acao_principal'], caminhos_csv, pergunta_usuario)
+
+def despachar_acao(acao: str, caminhos_csv: List[str], pergunta_usuario: str) -> str:
+    """Executa o handler da ação (processo padrão se a ação for desconhecida)"""
+    with span(f"acao:{acao}"):
+        return _executar_handler(acao, caminhos_csv, pergunta_usuario)
+
+def _executar_handler(acao: str, caminhos_csv: List[str], pergunta_usuario: str) -> str:
+    if acao == 'analise_exploratoria':
         return executar_analise_exploratoria(caminhos_csv, pergunta_usuario)
     
-    elif intencao['acao_principal'] == 'criar_dw':
+    elif acao == 'criar_dw':
         return executar_criacao_dw(caminhos_csv, pergunta_usuario)
     
-    elif intencao['acao_principal'] == 'consultas_sql':
+    elif acao == 'consultas_sql':
         return executar_consultas_sql(caminhos_csv, pergunta_usuario)
     
-    elif intencao['acao_principal'] == 'ddl_operations':
+    elif acao == 'ddl_operations':
         return executar_operacoes_ddl(pergunta_usuario)
     
-    elif intencao['acao_principal'] == 'dml_operations':
+    elif acao == 'dml_operations':
         return executar_operacoes_dml(caminhos_csv, pergunta_usuario)
     
-    elif intencao['acao_principal'] == 'visualizacao':
+    elif acao == 'visualizacao':
         return executar_visualizacao(caminhos_csv, pergunta_usuario)
     
-    elif intencao['acao_principal'] == 'relatorios':
+    elif acao == 'relatorios':
         return executar_relatorios(caminhos_csv, pergunta_usuario)
     
     else:
         return processo_padrao_bi(caminhos_csv, pergunta_usuario)
 
 def analisar_intencao(pergunta: str, contexto_csv: Dict) -> Dict:
-    """Usa LLM para analisar a intenção do usuário"""
+    """Classifica a intenção localmente e só usa o LLM quando a confiança é baixa"""
     
-    prompt_intencao = f"""
+    intencao_local = classificar_intencao_local(pergunta)
+    if intencao_local["confianca"] >= OLLAMA_CONFIG.get("intencao_confianca_minima", 0.6):
+        return intencao_local
+    
+    try:
+        # Modelo rápido (o contexto já está no prompt, não repete)
+        resposta = consultar_ollama_local(_prompt_intencao(pergunta, contexto_csv), None, tarefa="intencao")
+        return json.loads(resposta)
+    except:
+        return analisar_intencao_fallback(pergunta)
+
+def _prompt_intencao(pergunta: str, contexto_csv: Dict) -> str:
+    """Prompt de classificação de intenção pelo LLM"""
+    return f"""
     Analise a pergunta do usuário e classifique a intenção principal.
 
     PERGUNTA: "{pergunta}"
     
-    CONTEXTO DOS DADOS: {json.dumps(contexto_csv, indent=2)}
+    CONTEXTO DOS DADOS:
+    {contexto_para_prompt(pergunta, contexto_csv, tarefa="intencao")}
     
     CLASSIFIQUE em uma destas categorias:
     
@@ -134,41 +563,10 @@ def analisar_intencao(pergunta: str, contexto_csv: Dict) -> Dict:
         "detalhes": "explicacao"
     }}
     """
-    
-    try:
-        # ✅ FORÇA usar phi3:mini
-        resposta = consultar_ollama_local(prompt_intencao, contexto_csv, "phi3:mini")
-        return json.loads(resposta)
-    except:
-        return analisar_intencao_fallback(pergunta)
 
 def analisar_intencao_fallback(pergunta: str) -> Dict:
     """Fallback para análise de intenção baseada em palavras-chave"""
-    pergunta = pergunta.lower()
-    
-    if any(palavra in pergunta for palavra in ['coluna', 'estrutura', 'amostra', 'analise', 'exploratória']):
-        return {"acao_principal": "analise_exploratoria", "confianca": 0.8, "detalhes": "Análise exploratória detectada"}
-    
-    elif any(palavra in pergunta for palavra in ['dw', 'data warehouse', 'modelo', 'etl', 'carregar']):
-        return {"acao_principal": "criar_dw", "confianca": 0.9, "detalhes": "Criação de DW detectada"}
-    
-    elif any(palavra in pergunta for palavra in ['select', 'query', 'consultar', 'filtrar', 'agrupar']):
-        return {"acao_principal": "consultas_sql", "confianca": 0.85, "detalhes": "Consulta SQL detectada"}
-    
-    elif any(palavra in pergunta for palavra in ['create', 'alter', 'drop', 'tabela', 'índice']):
-        return {"acao_principal": "ddl_operations", "confianca": 0.9, "detalhes": "Operação DDL detectada"}
-    
-    elif any(palavra in pergunta for palavra in ['insert', 'update', 'delete', 'atualizar', 'incluir']):
-        return {"acao_principal": "dml_operations", "confianca": 0.9, "detalhes": "Operação DML detectada"}
-    
-    elif any(palavra in pergunta for palavra in ['gráfico', 'grafico', 'visualizar', 'dashboard', 'chart']):
-        return {"acao_principal": "visualizacao", "confianca": 0.8, "detalhes": "Visualização detectada"}
-    
-    elif any(palavra in pergunta for palavra in ['relatório', 'relatorio', 'report', 'análise', 'analise']):
-        return {"acao_principal": "relatorios", "confianca": 0.8, "detalhes": "Relatório detectado"}
-    
-    else:
-        return {"acao_principal": "processo_padrao", "confianca": 0.6, "detalhes": "Intenção não clara, usando processo padrão"}
+    return classificar_por_palavras_chave(pergunta)
 
 # ============================================================================
 # 2. 📊 ANÁLISE EXPLORATÓRIA
@@ -177,25 +575,14 @@ def analisar_intencao_fallback(pergunta: str) -> Dict:
 def executar_analise_exploratoria(caminhos_csv: List[str], pergunta: str) -> str:
     """Executa análise exploratória completa dos dados"""
     
-    resultados = []
-    for caminho in caminhos_csv:
-        try:
-            df = pd.read_csv(caminho)
-            nome_arquivo = os.path.basename(caminho)
-            
-            analise = {
-                "arquivo": nome_arquivo,
-                "colunas": list(df.columns),
-                "tipos_dados": df.dtypes.astype(str).to_dict(),
-                "total_linhas": len(df),
-                "total_colunas": len(df.columns),
-                "valores_nulos": df.isnull().sum().to_dict(),
-                "amostra_dados": df.head(3).to_dict('records')
-            }
-            resultados.append(analise)
-            
-        except Exception as e:
-            resultados.append({"arquivo": os.path.basename(caminho), "erro": str(e)})
+    # Perfil em uma passada com memória fixa, um processo por arquivo (erros isolados por arquivo)
+    resultados = obter_perfis_csv(caminhos_csv)
+    for caminho, analise in zip(caminhos_csv, resultados):
+        if "erro" not in analise:
+            try:
+                analise["memoria"] = memoria_csv(caminho, analise["total_linhas"])
+            except Exception:
+                pass  # memória é informativa: o relatório sai sem ela
     
     return gerar_relatorio_analise_exploratoria(resultados, pergunta)
 
@@ -213,12 +600,27 @@ def gerar_relatorio_analise_exploratoria(resultados: List[Dict], pergunta: str)
             
         relatorio += f"### 📁 {analise['arquivo']}\n"
         relatorio += f"**📈 Dimensões:** {analise['total_linhas']} linhas × {analise['total_colunas']} colunas\n\n"
+        if "memoria" in analise:
+            memoria = analise["memoria"]
+            relatorio += (f"**💾 Memória (pandas):** {memoria['antes_mb']} MB com tipos padrão → "
+                          f"{memoria['depois_mb']} MB com tipos compactos ({memoria['reducao']}x menor"
+                          f"{', estimado pela amostra' if memoria['estimado'] else ''})\n\n")
         
         # Colunas e tipos
         relatorio += "**📋 Estrutura das Colunas:**\n"
         for coluna, tipo in analise['tipos_dados'].items():
             nulos = analise['valores_nulos'][coluna]
-            relatorio += f"- `{coluna}`: {tipo} | Nulos: {nulos}\n"
+            relatorio += f"- `{coluna}`: {tipo} | Nulos: {nulos}"
+            estatisticas = analise.get('estatisticas', {}).get(coluna, {})
+            if 'distintos_aprox' in estatisticas:
+                relatorio += f" | Distintos: ~{estatisticas['distintos_aprox']}"
+            if 'media' in estatisticas:
+                relatorio += (
+                    f" | Mín: {estatisticas['min']:.6g} | Máx: {estatisticas['max']:.6g}"
+                    f" | Média: {estatisticas['media']:.6g} | Desvio: {estatisticas['desvio']:.6g}"
+                    f" | Quartis (aprox.): {estatisticas['p25']:.6g} / {estatisticas['p50']:.6g} / {estatisticas['p75']:.6g}"
+                )
+            relatorio += "\n"
         
         # Amostra de dados
         relatorio += f"\n**👀 Amostra de Dados (3 primeiras linhas):**\n"
@@ -238,18 +640,14 @@ def executar_criacao_dw(caminhos_csv: List[str], pergunta: str) -> str:
     
     contexto_csv = obter_contexto_csv(caminhos_csv)
     
-    # Carrega dados para staging
-    tabelas_carregadas = []
-    for i, caminho in enumerate(caminhos_csv):
-        df = pd.read_csv(caminho)
-        nome_tabela = f"stg_{os.path.basename(caminho).replace('.csv', '').lower()}"
-        df.to_sql(nome_tabela, get_engine(), if_exists='replace', index=False)
-        tabelas_carregadas.append(nome_tabela)
+    # Carrega dados para staging (COPY em blocos, arquivos em paralelo)
+    cargas = carregar_csvs_paralelo(caminhos_csv, "stg")
+    tabelas_carregadas = [carga["tabela"] for carga in cargas if "erro" not in carga]
     
     # Gera modelo DW com LLM
     prompt_dw = f"""
     CONTEXTO DOS DADOS:
-    {json.dumps(contexto_csv, indent=2)}
+    {contexto_para_prompt(pergunta, contexto_csv, {carga["tabela"]: carga["schema"] for carga in cargas if "erro" not in carga}, tarefa="dw")}
     
     PERGUNTA: {pergunta}
     
@@ -261,17 +659,30 @@ def executar_criacao_dw(caminhos_csv: List[str], pergunta: str) -> str:
     TABELAS CARREGADAS: {tabelas_carregadas}
     """
     
-    resposta_llm = consultar_ollama_local(prompt_dw, {})
+    # Visões de um desenho físico anterior dependem dos fatos: o DROP TABLE do novo DDL falharia por causa delas
+    def remover_visoes(lote: Dict):
+        for comando in comandos_remover_visoes(visoes_registradas(lote["cursor"])):
+            executar_no_lote(lote, comando)
+
+    resposta_llm, lote = executar_resposta_sql(consultar_ollama_stream(prompt_dw, {}, tarefa="dw"),
+                                               preparar=remover_visoes)
+    resultados_execucao = formatar_lote(lote)
     
-    # Extrai e executa SQL
-    scripts_sql = extrair_scripts_sql(resposta_llm)
-    resultados_execucao = executar_scripts_sql(scripts_sql)
+    # Desenho físico só sobre o que foi gravado: com a transação desfeita não há tabelas novas
+    desenho = None
+    if DW_CONFIG.get("otimizar", True) and lote["status"].startswith("✅"):
+        criadas = tabelas_criadas([c["sql"] for c in lote["comandos"] if "erro" not in c])
+        if criadas:
+            desenho = otimizar_dw(criadas)
     
     relatorio = f"## 🗄️ DATA WAREHOUSE CRIADO\n\n"
     relatorio += f"**Pergunta:** {pergunta}\n\n"
     relatorio += f"**Tabelas Carregadas:** {', '.join(tabelas_carregadas)}\n\n"
+    relatorio += f"**Carga (COPY):**\n{formatar_cargas(cargas)}\n\n"
     relatorio += f"**Modelo Proposto:**\n{resposta_llm}\n\n"
     relatorio += f"**Resultados da Execução:**\n{resultados_execucao}\n"
+    if desenho is not None:
+        relatorio += f"\n**Desenho Físico:**\n{formatar_desenho(desenho)}\n"
     
     return relatorio
 
@@ -282,33 +693,67 @@ def executar_criacao_dw(caminhos_csv: List[str], pergunta: str) -> str:
 def executar_consultas_sql(caminhos_csv: List[str], pergunta: str) -> str:
     """Executa consultas SQL baseadas na pergunta"""
     
-    # Primeiro carrega os CSVs se necessário
-    if caminhos_csv:
-        for caminho in caminhos_csv:
-            df = pd.read_csv(caminho)
-            nome_tabela = f"consulta_{os.path.basename(caminho).replace('.csv', '').lower()}"
-            df.to_sql(nome_tabela, get_engine(), if_exists='replace', index=False)
+    # Perguntas ad-hoc rodam no motor embutido direto sobre os CSVs;
+    # o PostgreSQL só é usado quando o usuário pede para persistir
+    usar_postgres = DB_CONFIG.get("motor_consultas", "embutido") == "postgres" or pediu_persistencia(pergunta)
+    if usar_postgres or not caminhos_csv:
+        cargas = carregar_csvs_paralelo(caminhos_csv, "consulta")
+        arquivos = None
+        dialeto = "PostgreSQL"
+        tabelas = obter_tabelas_com_colunas()
+    else:
+        cargas = []
+        arquivos = arquivos_consulta(caminhos_csv)
+        motor = motor_disponivel(DB_CONFIG.get("motor_embutido", "auto"))
+        dialeto = "DuckDB" if motor == "duckdb" else "SQLite"
+        tabelas = {
+            tabela: ler_amostra_csv_cache(caminho, 3).dtypes.astype(str).to_dict()
+            for tabela, caminho in arquivos.items()
+        }
     
     # Gera consulta SQL com LLM
     prompt_consulta = f"""
     Baseado na pergunta: "{pergunta}"
     
-    Gere uma consulta SQL otimizada para PostgreSQL.
+    Gere uma consulta SQL otimizada para {dialeto}.
     Inclua comentários explicativos.
     
-    TABELAS DISPONÍVEIS: {obter_tabelas_banco()}
+    TABELAS DISPONÍVEIS:
+    {contexto_para_prompt(pergunta, tabelas=tabelas, tarefa="consulta_sql")}
     """
     
-    resposta_llm = consultar_ollama_local(prompt_consulta, {})
-    consulta_sql = extrair_script_sql_unico(resposta_llm)
+    # A primeira consulta roda assim que o bloco ```sql fecha, sem esperar a explicação
+    executadas = []
+    def executar_primeira(script: str):
+        if not executadas:
+            executadas.append((script, executar_sql(script, arquivos)))
+
+    resposta_llm = exibir_resposta_streaming(consultar_ollama_stream(prompt_consulta, {}, tarefa="consulta_sql"), ao_fechar_sql=executar_primeira)
     
-    if consulta_sql:
-        resultado = executar_sql(consulta_sql)
+    if executadas:
+        consulta_sql, resultado = executadas[0]
+        if isinstance(resultado, pd.DataFrame):
+            st.dataframe(resultado.head(DB_CONFIG.get("sql_linhas_pagina", 50)))
         
         relatorio = f"## 🔍 CONSULTA SQL EXECUTADA\n\n"
         relatorio += f"**Pergunta:** {pergunta}\n\n"
+        if cargas:
+            relatorio += f"**Carga (COPY):**\n{formatar_cargas(cargas)}\n\n"
+        else:
+            relatorio += f"**Motor:** {dialeto} embutido, direto sobre os CSVs (sem carga no PostgreSQL)\n\n"
         relatorio += f"**Consulta SQL:**\n```sql\n{consulta_sql}\n```\n\n"
-        relatorio += f"**Resultado:**\n```\n{resultado}\n```\n\n"
+        relatorio += f"**Resultado:**\n```\n{formatar_resultado_sql(resultado)}\n```\n\n"
+        if pediu_exportacao(pergunta) and isinstance(resultado, pd.DataFrame):
+            destino = os.path.join(
+                DB_CONFIG.get("pasta_exportacao", "exportacoes"),
+                f"consulta_{datetime.now():%Y%m%d_%H%M%S}.{'csv' if 'csv' in pergunta.lower() else 'parquet'}",
+            )
+            exportacao = exportar_resultado_sql(consulta_sql, destino, arquivos)
+            if "erro" in exportacao:
+                relatorio += f"**Exportação:** ❌ {exportacao['erro']}\n\n"
+            else:
+                relatorio += (f"**Exportação:** {exportacao['linhas']} linhas gravadas em "
+                              f"`{exportacao['arquivo']}` ({exportacao['segundos']}s)\n\n")
         relatorio += f"**Explicação do LLM:**\n{resposta_llm}\n"
         
         return relatorio
@@ -325,15 +770,15 @@ def executar_operacoes_ddl(pergunta: str) -> str:
     prompt_ddl = f"""
     PERGUNTA: "{pergunta}"
     
-    TABELAS EXISTENTES: {obter_tabelas_banco()}
+    TABELAS EXISTENTES:
+    {contexto_para_prompt(pergunta, tabelas=obter_tabelas_com_colunas(), tarefa="ddl")}
     
     Gere comandos DDL (CREATE, ALTER, DROP) para PostgreSQL.
     Inclua apenas os comandos SQL necessários.
     """
     
-    resposta_llm = consultar_ollama_local(prompt_ddl, {})
-    scripts_sql = extrair_scripts_sql(resposta_llm)
-    resultados_execucao = executar_scripts_sql(scripts_sql)
+    resposta_llm, lote = executar_resposta_sql(consultar_ollama_stream(prompt_ddl, {}, tarefa="ddl"))
+    resultados_execucao = formatar_lote(lote)
     
     relatorio = f"## ⚙️ OPERAÇÕES DDL EXECUTADAS\n\n"
     relatorio += f"**Pergunta:** {pergunta}\n\n"
@@ -354,16 +799,15 @@ def executar_operacoes_dml(caminhos_csv: List[str], pergunta: str) -> str:
     prompt_dml = f"""
     PERGUNTA: "{pergunta}"
     
-    CONTEXTO: {json.dumps(contexto_csv, indent=2)}
-    TABELAS EXISTENTES: {obter_tabelas_banco()}
+    CONTEXTO E TABELAS EXISTENTES:
+    {contexto_para_prompt(pergunta, contexto_csv, obter_tabelas_com_colunas(), tarefa="dml")}
     
     Gere comandos DML (INSERT, UPDATE, DELETE) para PostgreSQL.
     Inclua apenas os comandos SQL necessários.
     """
     
-    resposta_llm = consultar_ollama_local(prompt_dml, {})
-    scripts_sql = extrair_scripts_sql(resposta_llm)
-    resultados_execucao = executar_scripts_sql(scripts_sql)
+    resposta_llm, lote = executar_resposta_sql(consultar_ollama_stream(prompt_dml, {}, tarefa="dml"))
+    resultados_execucao = formatar_lote(lote)
     
     relatorio = f"## 🔄 OPERAÇÕES DML EXECUTADAS\n\n"
     relatorio += f"**Pergunta:** {pergunta}\n\n"
@@ -382,46 +826,22 @@ def executar_visualizacao(caminhos_csv: List[str], pergunta: str) -> str:
     if not caminhos_csv:
         return "❌ É necessário fazer upload de CSV para visualizações"
     
-    df = pd.read_csv(caminhos_csv[0])
-    nome_arquivo = os.path.basename(caminhos_csv[0])
+    caminho = caminhos_csv[0]
+    nome_arquivo = os.path.basename(caminho)
     
-    # Tenta gerar gráfico básico
+    # Gráfico escolhido pelo perfil (tipos, linhas, ordenação) e desenhado só com dados agregados
     try:
-        fig, ax = plt.subplots(figsize=(8, 4))
-        
-        if len(df.select_dtypes(include=[np.number]).columns) >= 2:
-            # Gráfico de dispersão se tiver colunas numéricas
-            x_col = df.select_dtypes(include=[np.number]).columns[0]
-            y_col = df.select_dtypes(include=[np.number]).columns[1]
-            ax.scatter(df[x_col], df[y_col])
-            ax.set_xlabel(x_col)
-            ax.set_ylabel(y_col)
-            ax.set_title(f'{x_col} vs {y_col}')
-        
-        elif len(df.select_dtypes(include=[np.number]).columns) == 1:
-            # Histograma se tiver uma coluna numérica
-            col_num = df.select_dtypes(include=[np.number]).columns[0]
-            ax.hist(df[col_num].dropna(), bins=10)
-            ax.set_xlabel(col_num)
-            ax.set_ylabel('Frequência')
-            ax.set_title(f'Distribuição de {col_num}')
-        
-        else:
-            # Gráfico de barras para categóricas
-            col_cat = df.columns[0]
-            contagem = df[col_cat].value_counts().head(8)
-            ax.bar(contagem.index, contagem.values)
-            ax.set_xlabel(col_cat)
-            ax.set_ylabel('Contagem')
-            ax.set_title(f'Top - {col_cat}')
-            plt.xticks(rotation=45)
-        
-        st.pyplot(fig)
-        plt.close()
+        perfil = obter_perfil_csv(caminho)
+        spec = especificar_grafico(perfil)
+        with span("grafico", tipo=spec["tipo"]) as atributos:
+            png, origem = gerar_grafico_cache(caminho, perfil, spec)
+            atributos["origem"] = origem
+        st.image(png)
         
         relatorio = f"## 📈 VISUALIZAÇÃO GERADA\n\n"
         relatorio += f"**Arquivo:** {nome_arquivo}\n\n"
         relatorio += f"**Pergunta:** {pergunta}\n\n"
+        relatorio += f"**Gráfico:** {spec['tipo']} ({perfil['total_linhas']} linhas, dados via {origem})\n\n"
         relatorio += "✅ Gráfico exibido acima"
         
     except Exception as e:
@@ -441,7 +861,8 @@ def executar_relatorios(caminhos_csv: List[str], pergunta: str) -> str:
     prompt_relatorio = f"""
     PERGUNTA: "{pergunta}"
     
-    CONTEXTO: {json.dumps(contexto_csv, indent=2)}
+    CONTEXTO:
+    {contexto_para_prompt(pergunta, contexto_csv, tarefa="relatorio")}
     
     Gere um relatório analítico completo incluindo:
     1. Análise descritiva
@@ -449,7 +870,7 @@ def executar_relatorios(caminhos_csv: List[str], pergunta: str) -> str:
     3. Recomendações
     """
     
-    resposta_llm = consultar_ollama_local(prompt_relatorio, {})
+    resposta_llm = exibir_resposta_streaming(consultar_ollama_stream(prompt_relatorio, {}, tarefa="relatorio"))
     
     relatorio = f"## 📋 RELATÓRIO ANALÍTICO\n\n"
     relatorio += f"**Pergunta:** {pergunta}\n\n"
@@ -462,48 +883,929 @@ def executar_relatorios(caminhos_csv: List[str], pergunta: str) -> str:
 # 9. 🛠️ FUNÇÕES AUXILIARES
 # ============================================================================
 
+# --- Cache de Datasets (cada upload é lido uma única vez) ---
+# Chave: (hash do conteúdo, tipo de leitura). Os DataFrames devolvidos são
+# compartilhados entre as etapas: não altere-os in-place.
+_CACHE_DATASETS = OrderedDict()
+_CACHE_DATASETS_LOCK = threading.Lock()
+_HASHES_ARQUIVOS = {}
+_ESTATISTICAS_CACHE_DATASETS = {"acertos": 0, "faltas": 0, "despejos": 0, "bytes": 0}
+
+def hash_arquivo(caminho: str) -> str:
+    """Hash do conteúdo do arquivo (memorizado por caminho, tamanho e mtime; uploads trazem no caminho)"""
+    if eh_upload(caminho):
+        return digest_upload(caminho)
+    stat = os.stat(caminho)
+    chave = (os.path.abspath(caminho), stat.st_size, stat.st_mtime_ns)
+    with _CACHE_DATASETS_LOCK:
+        if chave in _HASHES_ARQUIVOS:
+            return _HASHES_ARQUIVOS[chave]
+
+    h = hashlib.blake2b(digest_size=16)
+    with open(caminho, "rb") as arquivo:
+        for bloco in iter(lambda: arquivo.read(1024 * 1024), b""):
+            h.update(bloco)
+    digest = h.hexdigest()
+
+    with _CACHE_DATASETS_LOCK:
+        if len(_HASHES_ARQUIVOS) > 1024:
+            _HASHES_ARQUIVOS.clear()
+        _HASHES_ARQUIVOS[chave] = digest
+    return digest
+
+def _limite_cache_datasets() -> int:
+    return int(CACHE_CONFIG.get("datasets_memoria_mb", 512) * 1024 * 1024)
+
+def _buscar_cache_datasets(chave):
+    with _CACHE_DATASETS_LOCK:
+        if chave in _CACHE_DATASETS:
+            _CACHE_DATASETS.move_to_end(chave)
+            _ESTATISTICAS_CACHE_DATASETS["acertos"] += 1
+            return _CACHE_DATASETS[chave][0]
+        _ESTATISTICAS_CACHE_DATASETS["faltas"] += 1
+        return None
+
+def _guardar_cache_datasets(chave, df: pd.DataFrame):
+    tamanho = int(df.memory_usage(deep=True).sum())
+    limite = _limite_cache_datasets()
+    if tamanho > limite:
+        return
+    with _CACHE_DATASETS_LOCK:
+        if chave in _CACHE_DATASETS:
+            return
+        while _CACHE_DATASETS and _ESTATISTICAS_CACHE_DATASETS["bytes"] + tamanho > limite:
+            _, (_, tamanho_antigo) = _CACHE_DATASETS.popitem(last=False)
+            _ESTATISTICAS_CACHE_DATASETS["bytes"] -= tamanho_antigo
+            _ESTATISTICAS_CACHE_DATASETS["despejos"] += 1
+        _CACHE_DATASETS[chave] = (df, tamanho)
+        _ESTATISTICAS_CACHE_DATASETS["bytes"] += tamanho
+
+def ler_csv_cache(caminho: str) -> pd.DataFrame:
+    """Lê o CSV completo (em tipos compactos), reaproveitando o parse de qualquer etapa anterior"""
+    chave = (hash_arquivo(caminho), "completo")
+    df = _buscar_cache_datasets(chave)
+    if df is None:
+        colunar = colunar_csv(caminho)
+        tipos = tipos_csv(caminho) if ANALISE_CONFIG.get("tipos_compactos", True) else None
+        if colunar:
+            categorias = [c for c, t in tipos.items() if t["tipo"] == "categoria"] if tipos else None
+            df = ler_colunar(colunar, categorias=categorias)
+            df = aplicar_tipos(df, tipos) if tipos else df
+        elif tipos:
+            df = ler_csv_compacto(fonte_csv(caminho), tipos, ANALISE_CONFIG.get("perfil_linhas_bloco", 100_000))
+        else:
+            df = pd.read_csv(fonte_csv(caminho))
+        _guardar_cache_datasets(chave, df)
+    return df
+
+def ler_amostra_csv_cache(caminho: str, linhas: int) -> pd.DataFrame:
+    """Lê as primeiras linhas do CSV (do DataFrame completo em cache ou do Parquet do workspace, se houver)"""
+    digest = hash_arquivo(caminho)
+    with _CACHE_DATASETS_LOCK:
+        completo = _CACHE_DATASETS.get((digest, "completo"))
+        if completo is not None:
+            _CACHE_DATASETS.move_to_end((digest, "completo"))
+            _ESTATISTICAS_CACHE_DATASETS["acertos"] += 1
+    if completo is not None:
+        return completo[0].head(linhas)
+    # Amostra não justifica converter: usa o Parquet só se ele já existir
+    colunar = colunar_csv(caminho, converter=False)
+    if colunar:
+        chave = (digest, f"amostra_colunar_{linhas}")
+        df = _buscar_cache_datasets(chave)
+        if df is None:
+            df = amostra_colunar(colunar, linhas)
+            _guardar_cache_datasets(chave, df)
+        return df
+    return _ler_amostra_padrao(caminho, digest, linhas)
+
+def _ler_amostra_padrao(caminho: str, digest: str, linhas: int) -> pd.DataFrame:
+    """Primeiras linhas com os tipos padrão do pandas (base da inferência de tipos)"""
+    chave = (digest, f"amostra_{linhas}")
+    df = _buscar_cache_datasets(chave)
+    if df is None:
+        df = pd.read_csv(fonte_csv(caminho), nrows=linhas)
+        _guardar_cache_datasets(chave, df)
+    return df
+
+def obter_estatisticas_cache_datasets() -> Dict:
+    """Acertos, faltas e ocupação do cache de datasets"""
+    with _CACHE_DATASETS_LOCK:
+        return {
+            **_ESTATISTICAS_CACHE_DATASETS,
+            "entradas": len(_CACHE_DATASETS),
+            "memoria_mb": round(_ESTATISTICAS_CACHE_DATASETS["bytes"] / 1024 / 1024, 2),
+            "limite_mb": round(_limite_cache_datasets() / 1024 / 1024, 2),
+            "uploads": estatisticas_uploads(),
+            "workspace": estatisticas_workspace(_pasta_workspace()),
+        }
+
+def limpar_cache_datasets():
+    """Esvazia o cache de datasets"""
+    with _CACHE_DATASETS_LOCK:
+        _CACHE_DATASETS.clear()
+        _HASHES_ARQUIVOS.clear()
+        _ESTATISTICAS_CACHE_DATASETS["bytes"] = 0
+
+# --- Workspace Colunar (cada CSV convertido uma vez para Parquet, workspace_bi) ---
+def _pasta_workspace() -> str:
+    return CACHE_CONFIG.get("workspace_pasta", os.path.join(".cache_bi", "workspace"))
+
+def colunar_csv(caminho: str, converter: bool = True) -> Optional[str]:
+    """Parquet do CSV no workspace (None se desligado, sem pyarrow ou se a conversão falhar)
+
+    converter=False devolve o arquivo só se ele já existir.
+    """
+    if not CACHE_CONFIG.get("workspace_ativo", True) or not workspace_disponivel():
+        return None
+    digest = hash_arquivo(caminho)
+    pasta = _pasta_workspace()
+    novo = converter and not os.path.exists(caminho_colunar(pasta, digest))
+    fonte = (lambda: dados_upload(caminho)) if eh_upload(caminho) else caminho
+    colunar = obter_colunar(pasta, digest, fonte, CACHE_CONFIG.get("workspace_linhas_grupo", 100_000), converter)
+    if novo and colunar:
+        _despejar_workspace(colunar)
+    return colunar
+
+def _despejar_workspace(manter: str):
+    despejar_workspace(_pasta_workspace(), CACHE_CONFIG.get("workspace_max_mb", 2048),
+                       CACHE_CONFIG.get("workspace_max_idade_horas", 168), manter=manter)
+
+def colunares_csv(caminhos_csv: Iterable[str]) -> Dict[str, str]:
+    """{caminho do CSV: Parquet do workspace} dos arquivos que puderam ser convertidos"""
+    colunares = {caminho: colunar_csv(caminho) for caminho in caminhos_csv}
+    return {caminho: colunar for caminho, colunar in colunares.items() if colunar}
+
+# --- Cache de Perfis (análise exploratória por hash do arquivo) ---
+_CACHE_PERFIS = OrderedDict()
+
+def _buscar_perfil(digest: str) -> Optional[Dict]:
+    with _CACHE_DATASETS_LOCK:
+        perfil = _CACHE_PERFIS.get(digest)
+        if perfil is not None:
+            _CACHE_PERFIS.move_to_end(digest)
+        return perfil
+
+def _guardar_perfil(digest: str, perfil: Dict):
+    with _CACHE_DATASETS_LOCK:
+        _CACHE_PERFIS[digest] = perfil
+        while len(_CACHE_PERFIS) > ANALISE_CONFIG.get("perfil_max_cache", 256):
+            _CACHE_PERFIS.popitem(last=False)
+
+def _opcoes_perfil() -> Dict:
+    return {
+        "linhas_bloco": ANALISE_CONFIG.get("perfil_linhas_bloco", 100_000),
+        "tamanho_amostra": ANALISE_CONFIG.get("perfil_amostra_quantis", 10_000),
+    }
+
+def obter_perfil_csv(caminho: str) -> Dict:
+    """Perfil do CSV em uma passada (perfil_bi), calculado uma vez por conteúdo"""
+    digest = hash_arquivo(caminho)
+    perfil = _buscar_perfil(digest)
+    if perfil is None:
+        perfil = _perfilar(caminho)(**_opcoes_perfil())
+        _guardar_perfil(digest, perfil)
+    return {**perfil, "arquivo": os.path.basename(caminho)}
+
+def _perfilar(caminho: str) -> functools.partial:
+    """Chamada do perfil: sobre o Parquet do workspace ou, sem ele, sobre o CSV (serializável para o pool)"""
+    colunar = colunar_csv(caminho)
+    if colunar:
+        return functools.partial(perfilar_colunar, colunar)
+    return functools.partial(perfilar_csv, fonte_csv(caminho))
+
+def _perfilar_no_pool(caminho: str, digest: str) -> Tuple[functools.partial, Optional[str]]:
+    """Chamada do perfil para o pool e o Parquet que ela vai gerar (None se não converte)
+
+    Arquivo ainda sem Parquet: a conversão também roda no processo filho, não aqui antes do submit.
+    """
+    if (not CACHE_CONFIG.get("workspace_ativo", True) or not workspace_disponivel()
+            or conversao_falhou(digest) or colunar_csv(caminho, converter=False)):
+        return _perfilar(caminho), None
+    destino = caminho_colunar(_pasta_workspace(), digest)
+    fonte = dados_upload(caminho) if eh_upload(caminho) else caminho
+    return functools.partial(perfilar_convertendo, fonte, destino,
+                             CACHE_CONFIG.get("workspace_linhas_grupo", 100_000)), destino
+
+# --- Tipos Compactos (inferência na amostra, confirmada pelo perfil do arquivo inteiro) ---
+def _linhas_amostra_tipos() -> int:
+    return DB_CONFIG.get("copy_linhas_amostra", 10000)
+
+def tipos_csv(caminho: str, perfil: Dict = None, linhas_amostra: int = None) -> Dict[str, Dict]:
+    """Tipo compacto e tipo PostgreSQL de cada coluna (perfil: o informado ou o que já estiver em cache)"""
+    digest = hash_arquivo(caminho)
+    amostra = ler_amostra_csv_cache(caminho, linhas_amostra or _linhas_amostra_tipos())
+    return inferir_tipos(amostra, perfil or _buscar_perfil(digest), ANALISE_CONFIG.get("tipos_fracao_categoria", 0.5))
+
+def memoria_csv(caminho: str, total_linhas: int) -> Dict:
+    """Memória do CSV no pandas com os tipos padrão x compactos (estimada pela amostra se não foi lido inteiro)"""
+    digest = hash_arquivo(caminho)
+    amostra = _ler_amostra_padrao(caminho, digest, _linhas_amostra_tipos())
+    if amostra.empty:
+        return {"antes_mb": 0.0, "depois_mb": 0.0, "reducao": 1.0, "estimado": False}
+    escala = total_linhas / len(amostra)
+    antes = memoria_bytes(amostra) * escala
+    with _CACHE_DATASETS_LOCK:
+        completo = _CACHE_DATASETS.get((digest, "completo"))
+    if completo is not None:
+        depois, estimado = memoria_bytes(completo[0]), False
+    else:
+        depois, estimado = memoria_bytes(aplicar_tipos(amostra, tipos_csv(caminho))) * escala, True
+    return {
+        "antes_mb": round(antes / 1024 / 1024, 2),
+        "depois_mb": round(depois / 1024 / 1024, 2),
+        "reducao": round(antes / depois, 1) if depois else 1.0,
+        "estimado": estimado or len(amostra) < total_linhas,
+    }
+
+# --- Ingestão Paralela (perfis em processos, cargas no banco em threads) ---
+_POOL_PROCESSOS = None
+_POOL_PROCESSOS_LOCK = threading.Lock()
+
+def _obter_pool_processos() -> ProcessPoolExecutor:
+    """Pool de processos único por processo do Streamlit (spawn: seguro com as threads do servidor)"""
+    global _POOL_PROCESSOS
+    with _POOL_PROCESSOS_LOCK:
+        if _POOL_PROCESSOS is None:
+            _POOL_PROCESSOS = ProcessPoolExecutor(
+                max_workers=ANALISE_CONFIG.get("processos_max") or os.cpu_count(),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _POOL_PROCESSOS
+
+def descartar_pool_processos():
+    """Encerra o pool de processos (é recriado no próximo uso)"""
+    global _POOL_PROCESSOS
+    with _POOL_PROCESSOS_LOCK:
+        if _POOL_PROCESSOS is not None:
+            _POOL_PROCESSOS.shutdown(cancel_futures=True)
+            _POOL_PROCESSOS = None
+
+def _erro_arquivo(caminho: str, erro: Exception) -> Dict:
+    return {"arquivo": os.path.basename(caminho), "erro": str(erro)}
+
+def obter_perfis_csv(caminhos_csv: List[str]) -> List[Dict]:
+    """Perfis de vários CSVs em paralelo (um processo por arquivo), na ordem dos arquivos"""
+    with span("perfil_csv", arquivos=len(caminhos_csv)) as atributos:
+        resultados = _perfis_csv(caminhos_csv)
+        atributos["erros"] = sum(1 for r in resultados if "erro" in r)
+        return resultados
+
+def _perfis_csv(caminhos_csv: List[str]) -> List[Dict]:
+    resultados = [None] * len(caminhos_csv)
+    pendentes = {}
+    for i, caminho in enumerate(caminhos_csv):
+        try:
+            digest = hash_arquivo(caminho)
+            perfil = _buscar_perfil(digest)
+            if perfil is None:
+                pendentes[i] = digest
+            else:
+                resultados[i] = {**perfil, "arquivo": os.path.basename(caminho)}
+        except Exception as e:
+            resultados[i] = _erro_arquivo(caminho, e)
+
+    if len(pendentes) == 1:
+        # Um arquivo só: no próprio processo, sem o custo de enviar o resultado entre processos
+        i = next(iter(pendentes))
+        try:
+            resultados[i] = obter_perfil_csv(caminhos_csv[i])
+        except Exception as e:
+            resultados[i] = _erro_arquivo(caminhos_csv[i], e)
+    elif pendentes:
+        pool = _obter_pool_processos()
+        futuros, destinos = {}, {}
+        for i in pendentes:
+            try:
+                chamada, destinos[i] = _perfilar_no_pool(caminhos_csv[i], pendentes[i])
+                futuros[i] = pool.submit(chamada, **_opcoes_perfil())
+            except Exception as e:
+                resultados[i] = _erro_arquivo(caminhos_csv[i], e)
+        for i, futuro in futuros.items():
+            try:
+                perfil = futuro.result()
+                if destinos[i]:
+                    registrar_conversao(pendentes[i], perfil["convertido"])
+                    if perfil["convertido"]:
+                        _despejar_workspace(destinos[i])
+                    perfil = perfil["perfil"]
+                _guardar_perfil(pendentes[i], perfil)
+                resultados[i] = {**perfil, "arquivo": os.path.basename(caminhos_csv[i])}
+            except BrokenProcessPool as e:
+                descartar_pool_processos()
+                resultados[i] = _erro_arquivo(caminhos_csv[i], e)
+            except Exception as e:
+                resultados[i] = _erro_arquivo(caminhos_csv[i], e)
+    return resultados
+
+def carregar_csvs_paralelo(caminhos_csv: List[str], prefixo: str) -> List[Dict]:
+    """Cargas incrementais em threads (no máximo pool_size conexões), na ordem dos arquivos"""
+    if not caminhos_csv:
+        return []
+    obter_registro_staging()  # cria o registro antes das threads
+
+    def carregar(caminho: str) -> Dict:
+        nome_tabela = nome_tabela_csv(prefixo, caminho)
+        with span("carga_csv", tabela=nome_tabela) as atributos:
+            try:
+                carga = carregar_csv_incremental(caminho, nome_tabela)
+                atributos.update(acao=carga["acao"], linhas=carga["linhas_carregadas"])
+                return carga
+            except Exception as e:
+                atributos["erro"] = str(e)
+                return {**_erro_arquivo(caminho, e), "tabela": nome_tabela}
+
+    def carregar_grupo(caminhos: List[str]) -> List[Dict]:
+        return [carregar(caminho) for caminho in caminhos]
+
+    # Arquivos com o mesmo nome vão para a mesma tabela: carregados em sequência na mesma thread
+    # (o último sobrescreve os anteriores), nunca com DROP/COPY simultâneos na tabela
+    grupos = {}
+    for i, caminho in enumerate(caminhos_csv):
+        grupos.setdefault(nome_tabela_csv(prefixo, caminho), []).append(i)
+
+    # Cada thread recebe uma cópia do contexto para os spans entrarem no rastreio da pergunta
+    resultados = [None] * len(caminhos_csv)
+    with ThreadPoolExecutor(max_workers=min(len(grupos), DB_CONFIG.get("pool_size", 5))) as executor:
+        futuros = {tuple(indices): executor.submit(contexto_atual().run, carregar_grupo,
+                                                   [caminhos_csv[i] for i in indices])
+                   for indices in grupos.values()}
+        for indices, futuro in futuros.items():
+            for i, carga in zip(indices, futuro.result()):
+                resultados[i] = carga
+    return resultados
+
+# --- Gráficos (agregação primeiro, cache por hash dos dados + especificação) ---
+_CACHE_GRAFICOS = OrderedDict()
+# Tabelas de staging carregadas neste processo, por hash do conteúdo do CSV (uma tabela, um conteúdo)
+_TABELAS_POR_HASH = {}
+
+def _associar_tabela(digest: str, tabela: str):
+    """Registra a tabela de staging do conteúdo; o conteúdo carregado antes nela deixa de apontar para ela"""
+    with _CACHE_DATASETS_LOCK:
+        for antigo in [d for d, t in _TABELAS_POR_HASH.items() if t == tabela]:
+            del _TABELAS_POR_HASH[antigo]
+        _TABELAS_POR_HASH[digest] = tabela
+
+def _desassociar_tabelas(tabelas: set):
+    """Tabelas alteradas por DML/DDL não refletem mais o CSV: o gráfico volta a ler o arquivo"""
+    if not tabelas:
+        return
+    with _CACHE_DATASETS_LOCK:
+        for digest in [d for d, t in _TABELAS_POR_HASH.items() if t in tabelas]:
+            del _TABELAS_POR_HASH[digest]
+
+def especificar_grafico(perfil: Dict) -> Dict:
+    """Especificação do gráfico a partir do perfil do CSV"""
+    numericas = [c for c in perfil["colunas"] if perfil["tipos_dados"][c] in ("int64", "float64")]
+    x_ordenado = bool(numericas) and perfil["estatisticas"][numericas[0]].get("ordenada", False)
+    return escolher_grafico(
+        numericas,
+        perfil["colunas"][0],
+        perfil["total_linhas"],
+        x_ordenado=x_ordenado,
+        limite_pontos=ANALISE_CONFIG.get("grafico_limite_pontos", 20000),
+        bins=ANALISE_CONFIG.get("grafico_bins", 10),
+        grade=ANALISE_CONFIG.get("grafico_grade_densidade", 60),
+        pontos_saida=ANALISE_CONFIG.get("grafico_pontos_lttb", 2000),
+    )
+
+def _expressao_balde(coluna: str, minimo: float, maximo: float, baldes: int) -> str:
+    """Índice do balde (0..baldes-1) de uma coluna numérica, como no np.histogram"""
+    if maximo <= minimo:
+        return "0"
+    balde = f"width_bucket({_quote_ident(coluna)}, {minimo!r}, {maximo!r}, {baldes})"
+    return f"GREATEST(LEAST({balde}, {baldes}), 1) - 1"
+
+def _bordas(minimo: float, maximo: float, baldes: int) -> np.ndarray:
+    if maximo <= minimo:
+        minimo, maximo = minimo - 0.5, maximo + 0.5
+    return np.linspace(minimo, maximo, baldes + 1)
+
+def agregar_grafico_postgres(tabela: str, perfil: Dict, spec: Dict) -> Optional[Dict]:
+    """Agrega no PostgreSQL (histograma, densidade ou contagens); None se o tipo exige pontos"""
+    tipo = spec["tipo"]
+    estatisticas = perfil["estatisticas"]
+    tabela_sql = _quote_ident(tabela)
+
+    if tipo == "barras":
+        x = _quote_ident(spec["x"])
+        sql = (f"SELECT {x}, COUNT(*) FROM {tabela_sql} WHERE {x} IS NOT NULL "
+               f"GROUP BY {x} ORDER BY 2 DESC LIMIT {int(spec['top'])}")
+        with conexao_banco() as conn:
+            linhas = conn.execute(text(sql)).fetchall()
+        return {"rotulos": [str(r[0]) for r in linhas], "valores": np.array([r[1] for r in linhas])}
+
+    if tipo == "histograma":
+        x, bins = spec["x"], spec["bins"]
+        mn, mx = estatisticas[x]["min"], estatisticas[x]["max"]
+        sql = (f"SELECT {_expressao_balde(x, mn, mx, bins)} AS b, COUNT(*) FROM {tabela_sql} "
+               f"WHERE {_quote_ident(x)} IS NOT NULL GROUP BY b")
+        contagens = np.zeros(bins, dtype=np.int64)
+        with conexao_banco() as conn:
+            for balde, n in conn.execute(text(sql)):
+                contagens[balde] = n
+        return {"contagens": contagens, "bordas": _bordas(mn, mx, bins)}
+
+    if tipo == "densidade":
+        x, y, grade = spec["x"], spec["y"], spec["grade"]
+        ex, ey = estatisticas[x], estatisticas[y]
+        sql = (f"SELECT {_expressao_balde(x, ex['min'], ex['max'], grade)} AS bx, "
+               f"{_expressao_balde(y, ey['min'], ey['max'], grade)} AS by, COUNT(*) FROM {tabela_sql} "
+               f"WHERE {_quote_ident(x)} IS NOT NULL AND {_quote_ident(y)} IS NOT NULL GROUP BY bx, by")
+        contagens = np.zeros((grade, grade), dtype=np.int64)
+        with conexao_banco() as conn:
+            for bx, by, n in conn.execute(text(sql)):
+                contagens[bx, by] = n
+        return {"contagens": contagens, "bordas_x": _bordas(ex["min"], ex["max"], grade),
+                "bordas_y": _bordas(ey["min"], ey["max"], grade), "pontos": int(contagens.sum())}
+
+    return None
+
+def _dados_grafico(caminho: str, digest: str, perfil: Dict, spec: Dict):
+    """Dados agregados do gráfico e a origem usada (postgres, cache ou csv)"""
+    tabela = _TABELAS_POR_HASH.get(digest)
+    if tabela and tabela in obter_catalogo_banco():
+        try:
+            dados = agregar_grafico_postgres(tabela, perfil, spec)
+            if dados is not None:
+                return dados, "postgres"
+        except Exception:
+            pass  # tabela alterada ou tipos como TEXT: agrega no pandas
+
+    with _CACHE_DATASETS_LOCK:
+        completo = _CACHE_DATASETS.get((digest, "completo"))
+    if completo is not None:
+        return preparar_dados(completo[0], spec), "cache"
+    # Lê só as colunas do gráfico
+    colunar = colunar_csv(caminho)
+    if colunar:
+        return preparar_dados(ler_colunar(colunar, colunas_do_grafico(spec)), spec), "parquet"
+    df = pd.read_csv(fonte_csv(caminho), usecols=colunas_do_grafico(spec))
+    return preparar_dados(df, spec), "csv"
+
+def gerar_grafico_cache(caminho: str, perfil: Dict, spec: Dict):
+    """PNG do gráfico, reaproveitado enquanto os dados e a especificação forem os mesmos"""
+    digest = hash_arquivo(caminho)
+    chave = (digest, json.dumps(spec, sort_keys=True))
+    with _CACHE_DATASETS_LOCK:
+        png = _CACHE_GRAFICOS.get(chave)
+        if png is not None:
+            _CACHE_GRAFICOS.move_to_end(chave)
+            return png, "cache de gráficos"
+
+    dados, origem = _dados_grafico(caminho, digest, perfil, spec)
+    png = desenhar_png(spec, dados)
+    with _CACHE_DATASETS_LOCK:
+        _CACHE_GRAFICOS[chave] = png
+        while len(_CACHE_GRAFICOS) > ANALISE_CONFIG.get("grafico_max_cache", 64):
+            _CACHE_GRAFICOS.popitem(last=False)
+    return png, origem
+
 def obter_contexto_csv(caminhos_csv: List[str]) -> Dict:
     """Obtém contexto básico dos CSVs"""
-    contexto = {}
-    for caminho in caminhos_csv:
+    def ler(caminho: str) -> Dict:
         try:
-            df = pd.read_csv(caminho, nrows=3)
-            contexto[os.path.basename(caminho)] = {
+            df = ler_amostra_csv_cache(caminho, 3)
+            return {
                 "colunas": list(df.columns),
                 "tipos": df.dtypes.astype(str).to_dict(),
                 "amostra": df.head(2).to_dict('records')
             }
         except Exception as e:
-            contexto[os.path.basename(caminho)] = {"erro": str(e)}
-    return contexto
+            return {"erro": str(e)}
+
+    # Só algumas linhas por arquivo: threads bastam (processos custariam mais que a leitura)
+    with ThreadPoolExecutor(max_workers=max(1, min(len(caminhos_csv), 8))) as executor:
+        amostras = list(executor.map(ler, caminhos_csv))
+    return {os.path.basename(caminho): amostra for caminho, amostra in zip(caminhos_csv, amostras)}
+
+def _lotes_select(conn, sql: str, tamanho_lote: int):
+    """Lê o SELECT com cursor do lado do servidor, um lote de linhas por vez"""
+    result = conn.execution_options(stream_results=True, max_row_buffer=tamanho_lote).execute(text(sql))
+    colunas = list(result.keys())
+    vazio = True
+    try:
+        for lote in result.partitions(tamanho_lote):
+            vazio = False
+            yield pd.DataFrame.from_records(lote, columns=colunas)
+        if vazio:
+            yield pd.DataFrame(columns=colunas)
+    finally:
+        result.close()
 
-def executar_sql(sql: str):
-    """Executa SQL no PostgreSQL"""
+def _ler_colunas_cache(caminho: str, colunas: List[str]) -> pd.DataFrame:
+    """Colunas do CSV, do DataFrame completo em cache ou do Parquet do workspace quando disponíveis"""
+    digest = hash_arquivo(caminho)
+    with _CACHE_DATASETS_LOCK:
+        completo = _CACHE_DATASETS.get((digest, "completo"))
+    if completo is not None:
+        return completo[0][colunas]
+    colunar = colunar_csv(caminho)
+    if colunar:
+        return ler_colunar(colunar, colunas)
+    return pd.read_csv(fonte_csv(caminho), usecols=colunas)
+
+def arquivos_consulta(caminhos_csv: List[str]) -> Dict[str, str]:
+    """Tabelas do motor embutido: {nome da tabela: caminho do CSV}"""
+    return {nome_tabela_csv("consulta", caminho): caminho for caminho in caminhos_csv}
+
+def _lotes_consulta(sql: str, tamanho_lote: int, arquivos: Dict[str, str] = None):
+    """Lotes do SELECT no motor embutido (arquivos={tabela: csv}) ou no PostgreSQL"""
+    if arquivos:
+        yield from lotes_embutidos(sql, arquivos, tamanho_lote, DB_CONFIG.get("motor_embutido", "auto"),
+                                   _ler_colunas_cache, DB_CONFIG.get("motor_max_tabelas", 8),
+                                   colunares_csv(arquivos.values()))
+        return
+    with conexao_banco() as conn:
+        yield from _lotes_select(conn, sql, tamanho_lote)
+
+def executar_select_limitado(sql: str, max_linhas: int = None, tamanho_lote: int = None,
+                             arquivos: Dict[str, str] = None) -> pd.DataFrame:
+    """SELECT em lotes com limite de linhas; df.attrs["truncado"] indica se havia mais linhas"""
+    max_linhas = max_linhas or DB_CONFIG.get("sql_max_linhas", 10000)
+    tamanho_lote = tamanho_lote or DB_CONFIG.get("sql_lote_linhas", 5000)
+    partes = []
+    lidas = 0
+    truncado = False
+    with span("sql", motor="embutido" if arquivos else "postgres", sql=sql[:200]) as atributos:
+        lotes = _lotes_consulta(sql, min(tamanho_lote, max_linhas + 1), arquivos)
+        for lote in lotes:
+            if lidas + len(lote) > max_linhas:
+                partes.append(lote.iloc[:max_linhas - lidas])
+                truncado = True
+                break
+            partes.append(lote)
+            lidas += len(lote)
+        lotes.close()
+
+        df = pd.concat(partes, ignore_index=True)
+        df.attrs["truncado"] = truncado
+        atributos.update(linhas=len(df), truncado=truncado)
+    return df
+
+def _lotes_exportacao(sql: str, tamanho_lote: int, arquivos: Dict[str, str] = None) -> Iterator[pd.DataFrame]:
+    """_lotes_consulta dentro de um span "sql" (o tempo inclui a gravação dos lotes)"""
+    with span("sql", motor="embutido" if arquivos else "postgres", sql=sql[:200], exportacao=True) as atributos:
+        atributos["linhas"] = 0
+        for lote in _lotes_consulta(sql, tamanho_lote, arquivos):
+            atributos["linhas"] += len(lote)
+            yield lote
+
+def _tipo_exportacao(atual, novo):
+    """Tipo Arrow que comporta os dois lotes: nulo cede ao outro, números viram float64, o resto vira texto"""
+    import pyarrow as pa
+
+    if atual.equals(novo) or pa.types.is_null(novo):
+        return atual
+    if pa.types.is_null(atual):
+        return novo
+    if pa.types.is_decimal(atual) and pa.types.is_decimal(novo):
+        return pa.decimal128(38, max(atual.scale, novo.scale))
+    numerico = lambda tipo: pa.types.is_integer(tipo) or pa.types.is_floating(tipo)  # noqa: E731
+    if numerico(atual) and numerico(novo):
+        return pa.float64()
+    return pa.string()
+
+def _promover_parquet(origem: str, destino: str, schema):
+    """Copia o Parquet parcial para destino no schema promovido, lote a lote; devolve o escritor aberto"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    escritor = pq.ParquetWriter(destino, schema)
+    try:
+        for lote in pq.ParquetFile(origem).iter_batches():
+            escritor.write_table(pa.Table.from_batches([lote]).cast(schema))
+    except Exception:
+        escritor.close()
+        raise
+    os.remove(origem)
+    return escritor
+
+def exportar_resultado_sql(sql: str, caminho_destino: str, arquivos: Dict[str, str] = None) -> Dict:
+    """Grava o resultado completo em Parquet ou CSV, lote a lote, sem carregá-lo na memória"""
+    tamanho_lote = DB_CONFIG.get("sql_lote_linhas", 5000)
+    parquet = caminho_destino.lower().endswith(".parquet")
+    if parquet:
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            return {"erro": "pyarrow não instalado: use um destino .csv ou instale com 'pip install pyarrow'"}
+
+    os.makedirs(os.path.dirname(caminho_destino) or ".", exist_ok=True)
+    inicio = time.perf_counter()
+    linhas = 0
+    escritor = None
+    promocoes = 0
+    parcial = f"{caminho_destino}.parcial0"
     try:
-        with get_engine().connect() as conn:
-            if sql.strip().lower().startswith('select'):
-                result = conn.execute(text(sql))
-                return result.fetchall()
+        for lote in _lotes_exportacao(sql, tamanho_lote, arquivos):
+            if parquet:
+                tabela = pa.Table.from_pandas(lote, preserve_index=False)
+                if escritor is None:
+                    schema = tabela.schema.remove_metadata()
+                    escritor = pq.ParquetWriter(parcial, schema)
+                promovido = pa.schema([campo.with_type(_tipo_exportacao(campo.type, novo.type))
+                                       for campo, novo in zip(schema, tabela.schema)])
+                if not promovido.equals(schema):
+                    # O tipo vem dos valores de cada lote (coluna só com nulos no começo, inteiros que ganham
+                    # decimais): o que já foi gravado é copiado para o schema promovido
+                    escritor.close()
+                    escritor = None
+                    promocoes += 1
+                    destino = f"{caminho_destino}.parcial{promocoes}"
+                    escritor = _promover_parquet(parcial, destino, promovido)
+                    parcial, schema = destino, promovido
+                escritor.write_table(tabela.cast(schema))
             else:
-                conn.execute(text(sql))
-                conn.commit()
-                return "Comando executado com sucesso"
+                lote.to_csv(caminho_destino, mode="w" if linhas == 0 else "a", header=linhas == 0, index=False)
+            linhas += len(lote)
+        if escritor is not None:
+            escritor.close()
+            escritor = None
+            os.replace(parcial, caminho_destino)
+    except Exception as e:
+        return {"erro": str(e)}
+    finally:
+        if escritor is not None:
+            escritor.close()
+        if parquet and os.path.exists(parcial):
+            os.remove(parcial)
+
+    return {"arquivo": caminho_destino, "linhas": linhas, "segundos": round(time.perf_counter() - inicio, 3)}
+
+def pediu_persistencia(pergunta: str) -> bool:
+    """Indica se a pergunta pede para gravar os dados no PostgreSQL"""
+    pergunta = pergunta.lower()
+    return any(palavra in pergunta for palavra in ['persistir', 'persista', 'salvar no banco', 'gravar no banco',
+                                                  'carregar no banco', 'postgres'])
+
+def pediu_exportacao(pergunta: str) -> bool:
+    """Indica se a pergunta pede o resultado completo em arquivo"""
+    pergunta = pergunta.lower()
+    return any(palavra in pergunta for palavra in ['exportar', 'exporte', 'export', 'parquet', 'salvar em arquivo', 'baixar'])
+
+def formatar_resultado_sql(resultado) -> str:
+    """Primeira página do resultado (com aviso de truncamento) ou a mensagem do comando"""
+    if not isinstance(resultado, pd.DataFrame):
+        return str(resultado)
+    pagina = DB_CONFIG.get("sql_linhas_pagina", 50)
+    texto = resultado.head(pagina).to_string(index=False) if len(resultado.columns) else "(sem colunas)"
+    if len(resultado) > pagina:
+        texto += f"\n... exibindo {pagina} de {len(resultado)} linhas"
+    if resultado.attrs.get("truncado"):
+        texto += f"\n⚠️ Resultado truncado em {len(resultado)} linhas (limite sql_max_linhas)"
+    return texto
+
+_REGEX_LEITURA = re.compile(r"^\(*\s*(select|with|values|table)\b", re.IGNORECASE)
+_REGEX_ESCRITA = re.compile(r"\b(insert|update|delete|merge)\b", re.IGNORECASE)
+
+def eh_leitura(sql: str) -> bool:
+    """SELECT, VALUES, TABLE ou WITH ... SELECT (um WITH com INSERT/UPDATE/DELETE altera dados)"""
+    # Comentários antes do comando (o prompt pede SQL comentado) não mudam o tipo do comando
+    comando = _remover_comentarios_sql(sql).strip()
+    if not _REGEX_LEITURA.match(comando):
+        return False
+    sem_textos = re.sub(r"'(?:[^']|'')*'", "''", comando)
+    return not (_REGEX_LEITURA.match(comando).group(1).lower() == "with" and _REGEX_ESCRITA.search(sem_textos))
+
+def executar_sql(sql: str, arquivos: Dict[str, str] = None):
+    """Executa SQL no PostgreSQL ou, com arquivos={tabela: csv}, no motor embutido (só leituras)"""
+    try:
+        if eh_leitura(sql):
+            return executar_select_limitado(sql, arquivos=arquivos)
+        if arquivos:
+            return "Erro SQL: o motor embutido só executa consultas (SELECT/WITH); peça para persistir no banco"
+        with span("sql", motor="postgres", sql=sql[:200]) as atributos, conexao_banco() as conn:
+            resultado = conn.execute(text(sql))
+            conn.commit()
+            atributos["linhas"] = resultado.rowcount if resultado.rowcount >= 0 else None
+        if eh_ddl(sql):
+            invalidar_catalogo()
+        _desassociar_tabelas({t for comando in dividir_comandos_sql(sql) for t in tabelas_alteradas(comando)})
+        return "Comando executado com sucesso"
     except Exception as e:
         return f"Erro SQL: {str(e)}"
 
+def executar_script_formatado(script: str) -> str:
+    """Executa um script SQL e formata o resultado para o relatório"""
+    return f"---\n{script}\nResultado: {formatar_resultado_sql(executar_sql(script))}"
+
+# --- Execução em Lote (uma conexão, uma transação, savepoint por comando) ---
+_REGEX_DOLAR = re.compile(r"\$[A-Za-z_]*\$")
+_REGEX_DML = re.compile(r"^(insert|update|delete|merge|truncate|copy)\b", re.IGNORECASE)
+_REGEX_CONTROLE_TRANSACAO = re.compile(r"^(begin|start\s+transaction|commit|end|rollback)\b(?!\s+to\b)", re.IGNORECASE)
+
+def dividir_comandos_sql(script: str) -> List[str]:
+    """Separa os comandos por ';', ignorando os que estão em strings, identificadores, comentários e $$"""
+    comandos = []
+    inicio = i = 0
+    n = len(script)
+    while i < n:
+        c = script[i]
+        if c == "'" or c == '"':
+            # E'...' aceita \' como escape; nos demais, só aspas dobradas
+            escape = c == "'" and i > 0 and script[i - 1] in "eE" and (i < 2 or not script[i - 2].isalnum())
+            i += 1
+            while i < n:
+                if escape and script[i] == "\\":
+                    i += 2
+                    continue
+                if script[i] == c:
+                    if i + 1 < n and script[i + 1] == c:
+                        i += 2
+                        continue
+                    break
+                i += 1
+        elif script.startswith("--", i):
+            fim = script.find("\n", i)
+            i = n if fim < 0 else fim
+        elif script.startswith("/*", i):
+            profundidade = 0
+            while i < n:
+                if script.startswith("/*", i):
+                    profundidade += 1
+                    i += 2
+                elif script.startswith("*/", i):
+                    profundidade -= 1
+                    i += 2
+                    if profundidade == 0:
+                        break
+                else:
+                    i += 1
+            continue
+        elif c == "$" and (m := _REGEX_DOLAR.match(script, i)):
+            fim = script.find(m.group(), m.end())
+            i = n if fim < 0 else fim + len(m.group())
+            continue
+        elif c == ";":
+            comandos.append(script[inicio:i])
+            inicio = i + 1
+        i += 1
+    comandos.append(script[inicio:])
+    return [c.strip() for c in comandos if _remover_comentarios_sql(c).strip()]
+
+@contextmanager
+def lote_sql(atomico: bool = None):
+    """Uma conexão e uma transação para vários scripts; commit no fim (atomico: desfaz tudo se algo falhar)"""
+    atomico = DB_CONFIG.get("scripts_atomicos", True) if atomico is None else atomico
+    inicio = time.perf_counter()
+    with conexao_banco() as conn:
+        dbapi_conn = conn.connection
+        lote = {"cursor": dbapi_conn.cursor(), "conexao": dbapi_conn, "comandos": [], "savepoint_aberto": None,
+                "status": None}
+        try:
+            yield lote
+            falhas = sum(1 for c in lote["comandos"] if "erro" in c)
+            if not (falhas and atomico):
+                _atualizar_visoes_desenho(lote)
+                falhas = sum(1 for c in lote["comandos"] if "erro" in c)
+            if falhas and atomico:
+                dbapi_conn.rollback()
+                lote["status"] = f"❌ desfeita: {falhas} comando(s) falharam, nenhuma alteração gravada"
+            else:
+                dbapi_conn.commit()
+                lote["status"] = "✅ confirmada" + (f" ({falhas} comando(s) com erro ignorados)" if falhas else "")
+        except Exception:
+            dbapi_conn.rollback()
+            raise
+        finally:
+            lote["cursor"].close()
+            lote["segundos"] = round(time.perf_counter() - inicio, 3)
+    if any(eh_ddl(c["sql"]) for c in lote["comandos"] if "erro" not in c):
+        invalidar_catalogo()
+    if lote["status"].startswith("✅"):
+        _desassociar_tabelas({t for c in lote["comandos"] if "erro" not in c for t in tabelas_alteradas(c["sql"])})
+
+def confirmar_parcial(lote: Dict):
+    """Commit do que o lote já executou (lotes não atômicos): libera os locks sem esperar o fim do lote"""
+    lote["conexao"].commit()
+    lote["savepoint_aberto"] = None  # o commit encerra os savepoints
+
+def executar_resposta_sql(trechos: Iterable[str], preparar: Callable[[Dict], None] = None) -> Tuple[str, Dict]:
+    """Mostra a resposta do LLM e executa os blocos ```sql em um lote; devolve o texto e o lote
+
+    A transação não fica aberta enquanto o LLM gera (os locks do DROP/CREATE TABLE bloqueariam as leituras).
+    Atômico: os scripts são guardados durante a geração e executados juntos no fim, em uma transação.
+    Não atômico: cada script é executado e confirmado assim que o bloco ```sql fecha.
+    preparar: comandos do lote antes dos scripts.
+    """
+    if DB_CONFIG.get("scripts_atomicos", True):
+        scripts = []
+        resposta = exibir_resposta_streaming(trechos, ao_fechar_sql=scripts.append)
+        with lote_sql() as lote:
+            if preparar:
+                preparar(lote)
+            for script in scripts:
+                executar_no_lote(lote, script)
+        return resposta, lote
+
+    def executar(script: str):
+        executar_no_lote(lote, script)
+        confirmar_parcial(lote)
+
+    with lote_sql() as lote:
+        if preparar:
+            preparar(lote)
+            confirmar_parcial(lote)
+        resposta = exibir_resposta_streaming(trechos, ao_fechar_sql=executar)
+    return resposta, lote
+
+_NOME_SQL = r'(?:"(?:[^"]|"")+"|\w+)(?:\s*\.\s*(?:"(?:[^"]|"")+"|\w+))*'
+_REGEX_ALVO_ESCRITA = re.compile(
+    r"^(?:insert\s+into|update|delete\s+from|merge\s+into|copy|truncate(?:\s+table)?|alter\s+table|drop\s+table)"
+    rf"(?:\s+if\s+exists)?(?:\s+only)?\s+({_NOME_SQL}(?:\s*,\s*{_NOME_SQL})*)",
+    re.IGNORECASE,
+)
+
+def tabelas_alteradas(sql: str) -> set:
+    """Tabelas que o comando altera (INSERT/UPDATE/DELETE/MERGE/COPY/TRUNCATE/ALTER/DROP), sem o schema"""
+    alvo = _REGEX_ALVO_ESCRITA.match(_remover_comentarios_sql(sql).strip())
+    if not alvo:
+        return set()
+    tabelas = set()
+    for nome in re.findall(_NOME_SQL, alvo.group(1)):
+        nome = re.findall(r'"(?:[^"]|"")+"|\w+', nome)[-1]
+        tabelas.add(nome[1:-1].replace('""', '"') if nome.startswith('"') else nome.lower())
+    return tabelas
+
+def _atualizar_visoes_desenho(lote: Dict):
+    """REFRESH das visões do desenho físico cujos fatos foram alterados por DML no lote"""
+    alteradas = set()
+    for comando in lote["comandos"]:
+        if "erro" not in comando and _REGEX_DML.match(_remover_comentarios_sql(comando["sql"]).strip()):
+            alteradas |= tabelas_alteradas(comando["sql"])
+    if alteradas:
+        for comando in comandos_atualizar_visoes(visoes_registradas(lote["cursor"]), alteradas):
+            executar_no_lote(lote, comando)
+
+def executar_no_lote(lote: Dict, script: str) -> List[Dict]:
+    """Executa os comandos do script no lote, cada um protegido por um savepoint"""
+    cursor = lote["cursor"]
+    max_linhas = DB_CONFIG.get("sql_max_linhas", 10000)
+    executados = []
+    for comando in dividir_comandos_sql(script):
+        if _REGEX_CONTROLE_TRANSACAO.match(_remover_comentarios_sql(comando).strip()):
+            continue  # a transação é controlada pelo lote
+        numero = len(lote["comandos"]) + 1
+        # O RELEASE do savepoint anterior e o novo SAVEPOINT vão na mesma ida ao servidor do comando
+        prefixo = f"RELEASE SAVEPOINT s{lote['savepoint_aberto']}; " if lote["savepoint_aberto"] else ""
+        with span("sql", motor="postgres", sql=comando[:200], lote=True) as atributos:
+            inicio = time.perf_counter()
+            try:
+                cursor.execute(f"{prefixo}SAVEPOINT s{numero}; {comando}")
+                lote["savepoint_aberto"] = numero
+                registro = {"sql": comando, "linhas": cursor.rowcount if cursor.rowcount >= 0 else None}
+                if cursor.description is not None:
+                    linhas = cursor.fetchmany(max_linhas + 1)
+                    df = pd.DataFrame.from_records(linhas[:max_linhas], columns=[d[0] for d in cursor.description])
+                    df.attrs["truncado"] = len(linhas) > max_linhas
+                    registro["resultado"] = df
+            except Exception as e:
+                cursor.execute(f"ROLLBACK TO SAVEPOINT s{numero}")
+                lote["savepoint_aberto"] = numero
+                # Só a mensagem: o contexto "LINE 1:" mostraria o prefixo de savepoints
+                registro = {"sql": comando, "erro": str(e).strip().splitlines()[0]}
+            registro["ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+            atributos["linhas"] = registro.get("linhas")
+            if "erro" in registro:
+                atributos["erro"] = registro["erro"]
+        lote["comandos"].append(registro)
+        executados.append(registro)
+    return executados
+
+def formatar_lote(lote: Dict) -> str:
+    """Relatório por comando (tempo e linhas) e o desfecho da transação"""
+    partes = []
+    for comando in lote["comandos"]:
+        if "erro" in comando:
+            resultado = f"Erro SQL: {comando['erro']}"
+        elif "resultado" in comando:
+            resultado = formatar_resultado_sql(comando["resultado"])
+        else:
+            resultado = "Comando executado com sucesso"
+        detalhes = f"{comando['ms']} ms" + (f", {comando['linhas']} linhas" if comando.get("linhas") is not None else "")
+        partes.append(f"---\n{comando['sql']}\nResultado: {resultado} ({detalhes})")
+    if lote["comandos"]:
+        partes.append(f"---\nTransação: {lote['status']} — {len(lote['comandos'])} comandos em {lote['segundos']}s")
+    return "\n".join(partes)
+
 def executar_scripts_sql(scripts: List[str]) -> str:
-    """Executa múltiplos scripts SQL"""
-    resultados = []
-    for script in scripts:
-        resultados.append(f"---\n{script}\nResultado: {executar_sql(script)}")
-    return "\n".join(resultados)
-
-def extrair_scripts_sql(texto: str) -> List[str]:
-    """Extrai scripts SQL do texto do LLM"""
+    """Executa múltiplos scripts SQL em uma única transação"""
+    with lote_sql() as lote:
+        for script in scripts:
+            executar_no_lote(lote, script)
+    return formatar_lote(lote)
+
+def extrair_scripts_sql(texto: str, apenas_completos: bool = False) -> List[str]:
+    """Extrai scripts SQL do texto do LLM (apenas_completos ignora um bloco ainda aberto)"""
     scripts = []
     if "```sql" in texto:
         partes = texto.split("```sql")[1:]
         for parte in partes:
+            if apenas_completos and "```" not in parte:
+                continue
             script = parte.split("```")[0].strip()
             if script:
                 scripts.append(script)
@@ -514,13 +1816,417 @@ def extrair_script_sql_unico(texto: str) -> Optional[str]:
     scripts = extrair_scripts_sql(texto)
     return scripts[0] if scripts else None
 
+def _quote_ident(nome: str) -> str:
+    """Coloca um identificador entre aspas duplas para o PostgreSQL"""
+    return '"' + str(nome).replace('"', '""') + '"'
+
+def nome_tabela_csv(prefixo: str, caminho: str) -> str:
+    """Nome da tabela de staging/consulta gerada para um CSV"""
+    return f"{prefixo}_{os.path.basename(caminho).replace('.csv', '').lower()}"
+
+def inferir_schema_csv(caminho: str, linhas_amostra: int = None) -> Dict[str, str]:
+    """Schema PostgreSQL compacto: tipos da amostra, larguras dos inteiros pelo perfil do arquivo inteiro"""
+    perfil = obter_perfil_csv(caminho) if ANALISE_CONFIG.get("tipos_compactos_banco", True) else None
+    tipos = tipos_csv(caminho, perfil, linhas_amostra)
+    return {coluna: tipo["postgres"] for coluna, tipo in tipos.items()}
+
+def _copiar_arquivo(cursor, nome_tabela: str, schema: Dict[str, str], caminho: str):
+    """Recria a tabela e envia o arquivo em blocos via COPY ... FROM STDIN"""
+    colunas_sql = ", ".join(f"{_quote_ident(c)} {t}" for c, t in schema.items())
+    cursor.execute(f"DROP TABLE IF EXISTS {_quote_ident(nome_tabela)}")
+    cursor.execute(f"CREATE TABLE {_quote_ident(nome_tabela)} ({colunas_sql})")
+    arquivo = abrir_binario(caminho) if eh_upload(caminho) else open(caminho, "r", encoding="utf-8", newline="")
+    with arquivo:
+        cursor.copy_expert(
+            f"COPY {_quote_ident(nome_tabela)} FROM STDIN WITH (FORMAT csv, HEADER true)",
+            arquivo,
+            size=DB_CONFIG.get("copy_bloco_bytes", 1024 * 1024),
+        )
+    return cursor.rowcount
+
+def carregar_csv_copy(caminho: str, nome_tabela: str) -> Dict:
+    """Carrega um CSV no PostgreSQL via COPY, com memória limitada ao tamanho do bloco"""
+    inicio = time.perf_counter()
+    schema = inferir_schema_csv(caminho)
+    tipos_fallback = False
+
+    with conexao_banco() as conn:
+        dbapi_conn = conn.connection
+        cursor = dbapi_conn.cursor()
+        try:
+            linhas = _copiar_arquivo(cursor, nome_tabela, schema, caminho)
+            dbapi_conn.commit()
+        except Exception:
+            # A amostra não representou o arquivo todo: recarrega tudo como TEXT
+            dbapi_conn.rollback()
+            schema = {coluna: "TEXT" for coluna in schema}
+            tipos_fallback = True
+            linhas = _copiar_arquivo(cursor, nome_tabela, schema, caminho)
+            dbapi_conn.commit()
+        finally:
+            cursor.close()
+
+    invalidar_catalogo()
+    _associar_tabela(hash_arquivo(caminho), nome_tabela)
+    segundos = time.perf_counter() - inicio
+    return {
+        "tabela": nome_tabela,
+        "linhas": linhas,
+        "segundos": round(segundos, 3),
+        "linhas_por_segundo": round(linhas / segundos) if segundos > 0 else linhas,
+        "schema": schema,
+        "tipos_fallback": tipos_fallback,
+    }
+
+# --- Registro de Staging (cargas incrementais por impressão digital do arquivo) ---
+# Guardado no próprio banco, junto das tabelas de staging que descreve
+_TABELA_REGISTRO = "_bi_registro_staging"
+
+_ACOES_CARGA = {
+    "ignorada": "⏭️ ignorada (arquivo idêntico)",
+    "anexada": "➕ anexada (só as linhas novas)",
+    "mesclada": "🔀 mesclada pela chave",
+    "recriada": "🔁 recriada",
+}
+
+_GATILHO_STAGING = "_bi_staging_alterada"
+
+def _garantir_registro(cursor):
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {_TABELA_REGISTRO} (
+            tabela TEXT PRIMARY KEY,
+            impressao TEXT NOT NULL,
+            bytes BIGINT NOT NULL,
+            linhas BIGINT NOT NULL,
+            schema_json TEXT NOT NULL,
+            tipos_fallback BOOLEAN NOT NULL,
+            chave TEXT,
+            alterada BOOLEAN NOT NULL DEFAULT false,
+            atualizado_em TIMESTAMP NOT NULL DEFAULT now()
+        )
+    """)
+    # Registro de versões anteriores e função do gatilho: criados só quando faltam (sem lock a cada leitura)
+    cursor.execute(f"""
+        DO $$ BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_attribute WHERE attrelid = '{_TABELA_REGISTRO}'::regclass
+                           AND attname = 'alterada') THEN
+                ALTER TABLE {_TABELA_REGISTRO} ADD COLUMN alterada BOOLEAN NOT NULL DEFAULT false;
+            END IF;
+            IF NOT EXISTS (SELECT 1 FROM pg_proc WHERE proname = '{_GATILHO_STAGING}') THEN
+                CREATE FUNCTION {_GATILHO_STAGING}() RETURNS trigger LANGUAGE plpgsql AS $f$
+                BEGIN
+                    UPDATE {_TABELA_REGISTRO} SET alterada = true WHERE tabela = TG_TABLE_NAME AND NOT alterada;
+                    RETURN NULL;
+                END $f$;
+            END IF;
+        END $$
+    """)
+
+def _instalar_gatilho(cursor, tabela: str):
+    """Gatilho por comando que marca o registro da tabela como alterado (INSERT/UPDATE/DELETE/TRUNCATE)"""
+    cursor.execute("SELECT 1 FROM pg_trigger WHERE tgrelid = to_regclass(%s) AND tgname = %s",
+                   (_quote_ident(tabela), _GATILHO_STAGING))
+    if cursor.fetchone() is None:
+        cursor.execute(f"CREATE TRIGGER {_GATILHO_STAGING} AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE "
+                       f"ON {_quote_ident(tabela)} FOR EACH STATEMENT EXECUTE FUNCTION {_GATILHO_STAGING}()")
+
+def _tabela_inalterada(tabela: str, registro: Dict) -> bool:
+    """A tabela de staging ainda é a que o registro descreve (ninguém a alterou depois da carga)
+
+    Só consulta o catálogo, sem ler os dados: DML marca o registro pelo gatilho; tabela recriada fica
+    sem o gatilho; ALTER TABLE muda as colunas.
+    """
+    if registro["alterada"]:
+        return False
+    try:
+        with conexao_banco() as conn:
+            with closing(conn.connection.cursor()) as cursor:
+                cursor.execute("""
+                    SELECT EXISTS (SELECT 1 FROM pg_trigger WHERE tgrelid = to_regclass(%(t)s) AND tgname = %(g)s),
+                           ARRAY(SELECT attname::text FROM pg_attribute WHERE attrelid = to_regclass(%(t)s)
+                                 AND attnum > 0 AND NOT attisdropped ORDER BY attnum)
+                """, {"t": _quote_ident(tabela), "g": _GATILHO_STAGING})
+                com_gatilho, colunas = cursor.fetchone()
+    except Exception:
+        return False
+    return com_gatilho and colunas == list(registro["schema"])
+
+def obter_registro_staging() -> Dict[str, Dict]:
+    """Impressão digital, tamanho, linhas e schema de cada tabela de staging registrada"""
+    with conexao_banco() as conn:
+        dbapi_conn = conn.connection
+        with closing(dbapi_conn.cursor()) as cursor:
+            _garantir_registro(cursor)
+            cursor.execute(f"SELECT tabela, impressao, bytes, linhas, schema_json, tipos_fallback, chave, "
+                           f"alterada FROM {_TABELA_REGISTRO}")
+            linhas = cursor.fetchall()
+        dbapi_conn.commit()
+    return {
+        tabela: {"impressao": impressao, "bytes": tamanho, "linhas": n, "schema": json.loads(schema),
+                 "tipos_fallback": fallback, "chave": json.loads(chave) if chave else None,
+                 "alterada": alterada}
+        for tabela, impressao, tamanho, n, schema, fallback, chave, alterada in linhas
+    }
+
+def _gravar_registro(cursor, tabela: str, caminho: str, linhas: int, schema: Dict[str, str],
+                     tipos_fallback: bool, chave: Optional[List[str]]):
+    """Grava o registro depois da carga (a própria carga disparou o gatilho: alterada volta a false)"""
+    _instalar_gatilho(cursor, tabela)
+    cursor.execute(f"""
+        INSERT INTO {_TABELA_REGISTRO} (tabela, impressao, bytes, linhas, schema_json, tipos_fallback, chave)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (tabela) DO UPDATE SET
+            impressao = EXCLUDED.impressao, bytes = EXCLUDED.bytes, linhas = EXCLUDED.linhas,
+            schema_json = EXCLUDED.schema_json, tipos_fallback = EXCLUDED.tipos_fallback,
+            chave = EXCLUDED.chave, alterada = false, atualizado_em = now()
+    """, (tabela, hash_arquivo(caminho), tamanho_fonte(caminho), linhas, json.dumps(schema),
+          tipos_fallback, json.dumps(chave) if chave else None))
+
+def _hash_prefixo(caminho: str, n_bytes: int):
+    """Hash dos primeiros n_bytes (mesmo algoritmo de hash_arquivo) e se terminam em quebra de linha"""
+    h = hashlib.blake2b(digest_size=16)
+    ultimo = b""
+    with abrir_binario(caminho) as arquivo:
+        restante = n_bytes
+        while restante > 0:
+            bloco = arquivo.read(min(1024 * 1024, restante))
+            if not bloco:
+                break
+            h.update(bloco)
+            ultimo = bloco[-1:]
+            restante -= len(bloco)
+    return h.hexdigest(), ultimo == b"\n"
+
+def _copiar_trecho(cursor, nome_tabela: str, caminho: str, inicio_bytes: int) -> int:
+    """COPY a partir de um deslocamento do arquivo (0 = arquivo inteiro, com cabeçalho)"""
+    with abrir_binario(caminho) as arquivo:
+        arquivo.seek(inicio_bytes)
+        cursor.copy_expert(
+            f"COPY {_quote_ident(nome_tabela)} FROM STDIN WITH (FORMAT csv, HEADER {'true' if inicio_bytes == 0 else 'false'})",
+            arquivo,
+            size=DB_CONFIG.get("copy_bloco_bytes", 1024 * 1024),
+        )
+    return cursor.rowcount
+
+def _garantir_indice_chave(cursor, nome_tabela: str, chave: List[str]):
+    """Índice único na chave declarada (exigido pelo ON CONFLICT do upsert)"""
+    colunas = ", ".join(_quote_ident(c) for c in chave)
+    cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {_quote_ident(nome_tabela + '_chave')} "
+                   f"ON {_quote_ident(nome_tabela)} ({colunas})")
+
+def _mesclar_trecho(cursor, nome_tabela: str, schema: Dict[str, str], chave: List[str],
+                    caminho: str, inicio_bytes: int) -> int:
+    """Upsert das linhas do arquivo (a partir de inicio_bytes) pela chave declarada"""
+    temporaria = f"_mescla_{nome_tabela}"
+    colunas = [_quote_ident(c) for c in schema]
+    colunas_chave = ", ".join(_quote_ident(c) for c in chave)
+    atualizacoes = ", ".join(f"{c} = EXCLUDED.{c}" for c in colunas if c not in
+                             {_quote_ident(k) for k in chave})
+    _garantir_indice_chave(cursor, nome_tabela, chave)
+    cursor.execute(f"CREATE TEMP TABLE {_quote_ident(temporaria)} "
+                   f"(LIKE {_quote_ident(nome_tabela)}) ON COMMIT DROP")
+    _copiar_trecho(cursor, temporaria, caminho, inicio_bytes)
+    # Chave repetida no próprio arquivo: vale a última ocorrência
+    cursor.execute(f"""
+        INSERT INTO {_quote_ident(nome_tabela)} ({", ".join(colunas)})
+        SELECT DISTINCT ON ({colunas_chave}) {", ".join(colunas)}
+        FROM {_quote_ident(temporaria)} ORDER BY {colunas_chave}, ctid DESC
+        ON CONFLICT ({colunas_chave}) DO {f"UPDATE SET {atualizacoes}" if atualizacoes else "NOTHING"}
+    """)
+    return cursor.rowcount
+
+def carregar_csv_incremental(caminho: str, nome_tabela: str, chave: List[str] = None) -> Dict:
+    """Carga de staging pelo registro: ignora, anexa, mescla pela chave ou recria"""
+    inicio = time.perf_counter()
+    chave = chave or DB_CONFIG.get("staging_chaves", {}).get(nome_tabela)
+    if isinstance(chave, str):
+        chave = [chave]
+    registro = obter_registro_staging().get(nome_tabela)
+    tamanho = tamanho_fonte(caminho)
+    acao, linhas, linhas_carregadas = None, 0, 0
+
+    # Tabela alterada fora da carga (DML/DDL do usuário): o registro não vale mais, recria
+    if (registro and nome_tabela in obter_catalogo_banco() and registro["chave"] == chave
+            and _tabela_inalterada(nome_tabela, registro)):
+        schema, tipos_fallback = registro["schema"], registro["tipos_fallback"]
+        if registro["impressao"] == hash_arquivo(caminho):
+            acao, linhas = "ignorada", registro["linhas"]
+        elif tamanho > registro["bytes"] or chave:
+            impressao_prefixo, termina_em_quebra = _hash_prefixo(caminho, registro["bytes"])
+            anexar = impressao_prefixo == registro["impressao"] and termina_em_quebra
+            if anexar or chave:
+                # Anexo: só o trecho novo; com chave e arquivo alterado, mescla o arquivo todo
+                deslocamento = registro["bytes"] if anexar else 0
+                try:
+                    with conexao_banco() as conn:
+                        dbapi_conn = conn.connection
+                        with closing(dbapi_conn.cursor()) as cursor:
+                            if chave:
+                                linhas_carregadas = _mesclar_trecho(cursor, nome_tabela, schema, chave,
+                                                                    caminho, deslocamento)
+                                cursor.execute(f"SELECT COUNT(*) FROM {_quote_ident(nome_tabela)}")
+                                linhas = cursor.fetchone()[0]
+                            else:
+                                linhas_carregadas = _copiar_trecho(cursor, nome_tabela, caminho, deslocamento)
+                                linhas = registro["linhas"] + linhas_carregadas
+                            _gravar_registro(cursor, nome_tabela, caminho, linhas, schema, tipos_fallback, chave)
+                        dbapi_conn.commit()
+                    acao = "mesclada" if chave else "anexada"
+                except Exception:
+                    acao = None  # linhas novas fora do schema ou chave inválida: recria a tabela
+
+    if acao is None:
+        carga = carregar_csv_copy(caminho, nome_tabela)
+        schema, tipos_fallback = carga["schema"], carga["tipos_fallback"]
+        acao, linhas = "recriada", carga["linhas"]
+        linhas_carregadas = linhas
+        with conexao_banco() as conn:
+            dbapi_conn = conn.connection
+            with closing(dbapi_conn.cursor()) as cursor:
+                _garantir_registro(cursor)
+                if chave:
+                    try:
+                        _garantir_indice_chave(cursor, nome_tabela, chave)
+                    except Exception:
+                        # Chave repetida no arquivo: fica sem índice e sem modo de mescla
+                        dbapi_conn.rollback()
+                        chave = None
+                _gravar_registro(cursor, nome_tabela, caminho, linhas, schema, tipos_fallback, chave)
+            dbapi_conn.commit()
+    else:
+        _associar_tabela(hash_arquivo(caminho), nome_tabela)
+
+    segundos = time.perf_counter() - inicio
+    return {
+        "tabela": nome_tabela,
+        "acao": acao,
+        "linhas": linhas,
+        "linhas_carregadas": linhas_carregadas,
+        "segundos": round(segundos, 3),
+        "linhas_por_segundo": round(linhas_carregadas / segundos) if segundos > 0 else linhas_carregadas,
+        "schema": schema,
+        "tipos_fallback": tipos_fallback,
+    }
+
+def formatar_cargas(cargas: List[Dict]) -> str:
+    """Resumo em Markdown das cargas realizadas"""
+    linhas = []
+    for carga in cargas:
+        if "erro" in carga:
+            linhas.append(f"- `{carga['tabela']}`: ❌ {carga['erro']}")
+            continue
+        aviso = " (tipos como TEXT)" if carga["tipos_fallback"] else ""
+        if "acao" not in carga:
+            linhas.append(
+                f"- `{carga['tabela']}`: {carga['linhas']} linhas em {carga['segundos']}s "
+                f"({carga['linhas_por_segundo']} linhas/s){aviso}"
+            )
+            continue
+        detalhe = f"{carga['linhas']} linhas"
+        if carga["acao"] in ("anexada", "mesclada"):
+            detalhe += f" ({carga['linhas_carregadas']} inseridas/atualizadas)"
+        linhas.append(f"- `{carga['tabela']}`: {_ACOES_CARGA[carga['acao']]} — {detalhe} em {carga['segundos']}s{aviso}")
+    return "\n".join(linhas)
+
+# --- Desenho Físico do DW (índices, ANALYZE, partições e visões materializadas) ---
+def otimizar_dw(tabelas: List[str]) -> Dict:
+    """Aplica o desenho físico às tabelas do DW, medindo as consultas de amostra antes e depois"""
+    inicio = time.perf_counter()
+    repeticoes = DW_CONFIG.get("medicao_repeticoes", 3)
+    with span("desenho_fisico", tabelas=len(tabelas)) as atributos:
+        try:
+            # Não atômico: um índice ou visão que falhe não desfaz os demais
+            with lote_sql(atomico=False) as lote:
+                cursor = lote["cursor"]
+                estrela = inspecionar_estrela(cursor, tabelas)
+                plano = planejar_desenho(cursor, estrela, DW_CONFIG)
+                antes = medir_consultas(cursor, plano["consultas"], repeticoes)
+                for comando in comandos_plano(plano):
+                    executar_no_lote(lote, comando)
+                falhas = {c["sql"]: c["erro"] for c in lote["comandos"] if "erro" in c}
+                sem_visao = {v["nome"] for v in plano["visoes"] if v["sql"] in falhas}
+                consultas = [{k: v for k, v in c.items() if k != "otimizada"} if c.get("visao") in sem_visao else c
+                             for c in plano["consultas"]]
+                depois = medir_consultas(cursor, consultas, repeticoes, otimizada=True)
+        except Exception as e:
+            atributos["erro"] = str(e)
+            return {"erro": str(e)}
+        atributos.update(indices=len(plano["indices"]), visoes=len(plano["visoes"]), falhas=len(falhas))
+    return {
+        "estrela": estrela,
+        "plano": plano,
+        "falhas": falhas,
+        "medicoes": list(zip(antes, depois)),
+        "segundos": round(time.perf_counter() - inicio, 3),
+    }
+
+# --- Catálogo do Banco (cache com invalidação em DDL) ---
+_CATALOGO = {"tabelas": None, "carregado_em": 0.0}
+_CATALOGO_LOCK = threading.Lock()
+_REGEX_DDL = re.compile(r"(^|;)\s*(create|alter|drop|truncate|rename|comment)\b", re.IGNORECASE)
+
+def _carregar_catalogo() -> Dict[str, Dict]:
+    """Lê tabelas, colunas, tipos, linhas estimadas e índices em três consultas ao catálogo"""
+    catalogo = {}
+    with conexao_banco() as conn:
+        for tabela, coluna, tipo in conn.execute(text(f"""
+            SELECT table_name, column_name, data_type
+            FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name <> '{_TABELA_REGISTRO}'
+            ORDER BY table_name, ordinal_position
+        """)):
+            catalogo.setdefault(tabela, {"colunas": {}, "linhas_estimadas": None, "indices": []})
+            catalogo[tabela]["colunas"][coluna] = tipo
+
+        for tabela, linhas in conn.execute(text("""
+            SELECT c.relname, c.reltuples::bigint
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = current_schema() AND c.relkind IN ('r', 'p')
+        """)):
+            if tabela in catalogo:
+                # reltuples = -1 quando a tabela nunca passou por ANALYZE/VACUUM
+                catalogo[tabela]["linhas_estimadas"] = linhas if linhas >= 0 else None
+
+        for tabela, indice in conn.execute(text("""
+            SELECT tablename, indexdef FROM pg_indexes WHERE schemaname = current_schema()
+        """)):
+            if tabela in catalogo:
+                catalogo[tabela]["indices"].append(indice)
+    return catalogo
+
+def obter_catalogo_banco(forcar: bool = False) -> Dict[str, Dict]:
+    """Catálogo em cache: recarrega só quando invalidado ou após o TTL"""
+    with _CATALOGO_LOCK:
+        expirado = time.time() - _CATALOGO["carregado_em"] > DB_CONFIG.get("catalogo_ttl_s", 300)
+        if forcar or _CATALOGO["tabelas"] is None or expirado:
+            try:
+                _CATALOGO["tabelas"] = _carregar_catalogo()
+                _CATALOGO["carregado_em"] = time.time()
+            except Exception:
+                return {}
+        return _CATALOGO["tabelas"]
+
+def invalidar_catalogo():
+    """Marca o catálogo para ser relido na próxima consulta"""
+    with _CATALOGO_LOCK:
+        _CATALOGO["tabelas"] = None
+
+def _remover_comentarios_sql(sql: str) -> str:
+    sql = re.sub(r"/\*.*?\*/", " ", sql, flags=re.DOTALL)
+    return re.sub(r"--[^\n]*", " ", sql)
+
+def eh_ddl(sql: str) -> bool:
+    """Indica se o script contém algum comando DDL"""
+    return bool(_REGEX_DDL.search(_remover_comentarios_sql(sql).strip()))
+
 def obter_tabelas_banco() -> List[str]:
     """Obtém lista de tabelas do banco"""
-    try:
-        inspector = inspect(get_engine())
-        return inspector.get_table_names()
-    except:
-        return []
+    return list(obter_catalogo_banco())
+
+def obter_tabelas_com_colunas() -> Dict[str, Dict[str, str]]:
+    """Tabelas do banco com colunas e tipos (para os prompts)"""
+    return {tabela: info["colunas"] for tabela, info in obter_catalogo_banco().items()}
 
 def processo_padrao_bi(caminhos_csv: List[str], pergunta: str) -> str:
     """Processo padrão para perguntas não classificadas"""
@@ -529,18 +2235,206 @@ def processo_padrao_bi(caminhos_csv: List[str], pergunta: str) -> str:
     prompt_padrao = f"""
     PERGUNTA: "{pergunta}"
     
-    CONTEXTO: {json.dumps(contexto_csv, indent=2)}
-    TABELAS EXISTENTES: {obter_tabelas_banco()}
+    CONTEXTO E TABELAS EXISTENTES:
+    {contexto_para_prompt(pergunta, contexto_csv, obter_tabelas_com_colunas())}
     
     Forneça uma resposta útil e sugira próximos passos.
     """
     
-    return consultar_ollama_local(prompt_padrao, contexto_csv)
+    # O contexto já está no prompt: não passa de novo para consultar_ollama_stream
+    return exibir_resposta_streaming(consultar_ollama_stream(prompt_padrao, {}))
+
+# ============================================================================
+# ⚡ ORQUESTRADOR ASSÍNCRONO
+# ============================================================================
+# Etapas independentes (contexto dos CSVs, catálogo do banco, intenção, resumos
+# por arquivo) rodam ao mesmo tempo. LLM via ollama.AsyncClient; banco e
+# arquivos em threads (psycopg2/pandas), cada recurso com seu limite.
+
+def _criar_recursos() -> Dict[str, Any]:
+    """Semáforos por recurso e cliente assíncrono do Ollama (pertencem ao event loop atual)"""
+    return {
+        "llm": asyncio.Semaphore(OLLAMA_CONFIG.get("concorrencia_max", 2)),
+        "banco": asyncio.Semaphore(DB_CONFIG.get("pool_size", 5)),
+        "arquivos": asyncio.Semaphore(ANALISE_CONFIG.get("processos_max") or os.cpu_count() or 1),
+        "cliente_llm": ollama.AsyncClient(),
+    }
+
+async def _em_thread(limite: asyncio.Semaphore, funcao: Callable, *args):
+    """Executa uma função bloqueante em thread, respeitando o limite do recurso (sem chamadas ao st)"""
+    async with limite:
+        return await asyncio.to_thread(funcao, *args)
+
+async def _em_etapa(nome: str, limite: asyncio.Semaphore, funcao: Callable, *args):
+    """_em_thread dentro de um span (o tempo inclui a espera pelo limite)"""
+    with span(nome):
+        return await _em_thread(limite, funcao, *args)
+
+async def consultar_ollama_async(prompt: str, recursos: Dict, modelo_especifico: str = None,
+                                 usar_cache: bool = True, tarefa: str = "padrao") -> str:
+    """Versão assíncrona de consultar_ollama_local (mesmo cache, roteamento e prazos)"""
+    modelo_usar, _ = _rotear_modelo(tarefa, modelo_especifico)
+    prazo = prazo_tarefa(tarefa, OLLAMA_CONFIG)
+    opcoes = {'num_predict': 500, 'temperature': 0.1}
+    usar_cache = usar_cache and cache_llm_ativo(opcoes)
+    if usar_cache:
+        resposta_cache = buscar_cache_llm(modelo_usar, prompt, opcoes)
+        if resposta_cache is not None:
+            with span("llm", modelo=modelo_usar, tarefa=tarefa, cache=True):
+                return resposta_cache
+
+    try:
+        modelos = _modelos_tentativa(modelo_usar)
+        for modelo_usar in modelos:
+            async with recursos["llm"]:
+                inicio = time.perf_counter()
+                try:
+                    with span("llm", modelo=modelo_usar, tarefa=tarefa, cache=False) as atributos, \
+                            chamada_em_andamento(modelo_usar):
+                        resposta = await asyncio.wait_for(recursos["cliente_llm"].chat(
+                            model=modelo_usar,
+                            messages=[{"role": "user", "content": prompt}],
+                            options=opcoes,
+                            keep_alive=_keep_alive(modelo_usar),
+                        ), prazo)
+                        _registrar_metricas(atributos, modelo_usar, resposta)
+                    registrar_latencia(modelo_usar, tarefa, time.perf_counter() - inicio)
+                    break
+                except Exception as e:
+                    registrar_latencia(modelo_usar, tarefa, time.perf_counter() - inicio, _status_falha(e))
+                    if not _timeout_ou_sobrecarga(e) or modelo_usar == modelos[-1]:
+                        raise
+        conteudo = resposta["message"]["content"]
+        if usar_cache:
+            guardar_cache_llm(modelo_usar, prompt, opcoes, conteudo)
+        return conteudo
+    except Exception as e:
+        return f"❌ Erro ao consultar {modelo_usar}: {str(e) or type(e).__name__}"
+
+async def analisar_intencao_async(pergunta: str, tarefa_contexto: asyncio.Task, recursos: Dict) -> Dict:
+    """Classificador local primeiro; só espera o contexto dos CSVs se precisar do LLM"""
+    intencao_local = classificar_intencao_local(pergunta)
+    if intencao_local["confianca"] >= OLLAMA_CONFIG.get("intencao_confianca_minima", 0.6):
+        return intencao_local
+
+    st.info(f"🤖 Classificando a intenção com {_resolver_modelo(tarefa='intencao')}...")
+    try:
+        prompt = _prompt_intencao(pergunta, await tarefa_contexto)
+        return json.loads(await consultar_ollama_async(prompt, recursos, tarefa="intencao"))
+    except Exception:
+        return analisar_intencao_fallback(pergunta)
+
+def _resumo_perfil(perfil: Dict) -> str:
+    """Linhas, nulos e estatísticas numéricas do perfil em poucas linhas de texto"""
+    if "erro" in perfil:
+        return f"ARQUIVO {perfil['arquivo']}: erro ao ler ({perfil['erro']})"
+    linhas = [f"ARQUIVO {perfil['arquivo']}: {perfil['total_linhas']} linhas, {perfil['total_colunas']} colunas"]
+    for coluna in perfil["colunas"]:
+        info = perfil["estatisticas"].get(coluna, {})
+        nulos = perfil["valores_nulos"].get(coluna, 0)
+        if "media" in info:
+            linhas.append(f"  {coluna}: min {info['min']:.6g}, máx {info['max']:.6g}, média {info['media']:.6g}, nulos {nulos}")
+        else:
+            linhas.append(f"  {coluna}: ~{info.get('distintos_aprox', '?')} distintos, nulos {nulos}")
+    return "\n".join(linhas)
+
+async def executar_relatorios_async(caminhos_csv: List[str], pergunta: str, recursos: Dict) -> str:
+    """Relatório com um resumo por arquivo gerado em paralelo e a síntese final em streaming"""
+    if len(caminhos_csv) < 2:
+        return executar_relatorios(caminhos_csv, pergunta)
+
+    perfis = await _em_thread(recursos["arquivos"], obter_perfis_csv, caminhos_csv)
+    st.info(f"🤖 Resumindo {len(perfis)} arquivos em paralelo...")
+    resumos = await asyncio.gather(*[
+        consultar_ollama_async(
+            f"""
+    PERGUNTA: "{pergunta}"
+    
+    PERFIL DO ARQUIVO:
+    {_resumo_perfil(perfil)}
+    
+    Resuma em até 5 tópicos o que este arquivo mostra de relevante para a pergunta.
+    """, recursos, tarefa="resumo_arquivo")
+        for perfil in perfis
+    ])
+    resumos_texto = "\n\n".join(f"### {perfil['arquivo']}\n{resumo}" for perfil, resumo in zip(perfis, resumos))
+
+    prompt_relatorio = f"""
+    PERGUNTA: "{pergunta}"
+    
+    RESUMOS POR ARQUIVO:
+    {resumos_texto}
+    
+    Gere um relatório analítico completo incluindo:
+    1. Análise descritiva
+    2. Insights principais
+    3. Recomendações
+    """
+    resposta_llm = exibir_resposta_streaming(consultar_ollama_stream(prompt_relatorio, {}, tarefa="relatorio"))
+    
+    relatorio = f"## 📋 RELATÓRIO ANALÍTICO\n\n"
+    relatorio += f"**Pergunta:** {pergunta}\n\n"
+    relatorio += f"**Arquivos Analisados:** {', '.join([os.path.basename(c) for c in caminhos_csv])}\n\n"
+    relatorio += f"**Resumos por Arquivo:**\n{resumos_texto}\n\n"
+    relatorio += f"**Análise:**\n{resposta_llm}\n"
+    return relatorio
+
+# Ações que consultam o catálogo do PostgreSQL (pré-carregado em paralelo com o contexto dos CSVs)
+_ACOES_COM_BANCO = {"consultas_sql", "criar_dw", "ddl_operations", "dml_operations", "visualizacao"}
+
+async def orquestrar_acao_async(pergunta_usuario: str, caminhos_csv: List[str]) -> str:
+    """Versão assíncrona de orquestrar_acao: contexto e intenção ao mesmo tempo, catálogo só se a ação usa o banco"""
+    with rastreio("pergunta", pergunta=pergunta_usuario, arquivos=len(caminhos_csv), assincrono=True) as atributos:
+        recursos = _criar_recursos()
+        tarefa_contexto = asyncio.create_task(
+            _em_etapa("contexto_csv", recursos["arquivos"], obter_contexto_csv, caminhos_csv))
+        tarefas = [tarefa_contexto]
+        try:
+            with span("intencao"):
+                intencao = await analisar_intencao_async(pergunta_usuario, tarefa_contexto, recursos)
+            acao = intencao['acao_principal']
+            atributos["acao"] = acao
+            st.info(f"🎯 Ação detectada: {acao}")
+
+            if acao == 'analise_exploratoria':
+                with span(f"acao:{acao}"):
+                    resultados = await _em_thread(recursos["arquivos"], obter_perfis_csv, caminhos_csv)
+                    return gerar_relatorio_analise_exploratoria(resultados, pergunta_usuario)
+            if acao == 'relatorios':
+                with span(f"acao:{acao}"):
+                    return await executar_relatorios_async(caminhos_csv, pergunta_usuario, recursos)
+
+            # Demais ações: streaming do LLM na tela e SQL em sequência, com contexto e catálogo prontos.
+            # O catálogo só é carregado aqui: análise e relatórios não podem esperar por uma conexão ao banco
+            if acao in _ACOES_COM_BANCO:
+                tarefas.append(asyncio.create_task(_em_etapa("catalogo", recursos["banco"], obter_catalogo_banco)))
+            await asyncio.gather(*tarefas, return_exceptions=True)
+            return despachar_acao(acao, caminhos_csv, pergunta_usuario)
+        finally:
+            await asyncio.gather(*tarefas, return_exceptions=True)
 
 # ============================================================================
 # 🎯 FUNÇÃO PRINCIPAL (MANTIDA PARA COMPATIBILIDADE)
 # ============================================================================
 
-def agente_bi_local(caminhos_csv, pergunta_usuario):
-    """Função principal mantida para compatibilidade com app.py"""
-    return orquestrar_acao(pergunta_usuario, caminhos_csv)
\ No newline at end of file
+def preparar_fontes(fontes: Iterable) -> List[str]:
+    """Caminhos para o agente: caminhos ficam como estão, buffers viram uploads em memória"""
+    caminhos = []
+    for i, fonte in enumerate(fontes, start=1):
+        if isinstance(fonte, (str, os.PathLike)):
+            caminhos.append(os.fspath(fonte))
+        else:
+            nome = getattr(fonte, "name", None) or f"upload_{i}.csv"
+            caminhos.append(registrar_upload(fonte, nome, CACHE_CONFIG.get("uploads_memoria_mb", 1024)))
+    return caminhos
+
+def agente_bi_local(caminhos_csv, pergunta_usuario, modelo=None):
+    """Função principal usada pelo app.py (caminhos ou buffers dos CSVs; modelo: escolha da interface ou None)"""
+    caminhos_csv = preparar_fontes(caminhos_csv)
+    with preferencia_modelo(modelo):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(orquestrar_acao_async(pergunta_usuario, caminhos_csv))
+        # Já dentro de um event loop (ex.: notebook): usa o orquestrador síncrono
+        return orquestrar_acao(pergunta_usuario, caminhos_csv)
\ No newline at end of file
@@ -1,9 +1,23 @@
 ## 🌐 **3. INTERFACE STREAMLIT**
 ### 📄 **app.py**
 import streamlit as st
-import tempfile
-import os
-from agent_bi import agente_bi_local
+from agent_bi import (
+    agente_bi_local,
+    preparar_fontes,
+    obter_estatisticas_pool,
+    obter_estatisticas_cache_datasets,
+    obter_estatisticas_cache_llm,
+)
+from rastreio_bi import ultimos_rastreios
+from roteador_bi import estatisticas_modelos
+from modelos_bi import estado_aquecimento, estatisticas_carga, iniciar_aquecimento, modelos_residentes
+from jobs_bi import cancelar_job, configurar_fila, consultar_job, job_terminado, listar_jobs, submeter_analise
+from uploads_bi import upload_registrado
+from config import OLLAMA_CONFIG
+try:
+    from config import JOBS_CONFIG
+except ImportError:  # config.py antigo, sem a seção de jobs
+    JOBS_CONFIG = {}
 
 # Configuração da página
 st.set_page_config(
@@ -12,6 +26,10 @@ st.set_page_config(
     layout="wide"
 )
 
+# Carrega os modelos no Ollama em segundo plano (uma vez por processo do servidor)
+iniciar_aquecimento(OLLAMA_CONFIG)
+configurar_fila(JOBS_CONFIG)
+
 # CSS personalizado
 st.markdown("""
 <style>
@@ -54,10 +72,79 @@ with st.sidebar:
     st.write("3. ⚡ Execute e veja resultados")
     modelo_selecionado = st.sidebar.selectbox(
     "🤖 Escolha o Modelo:",
-    ["llama3.2:3b", "phi3:mini", "llama3.1:8b"],
-    index=0
+    ["automático", "llama3.2:3b", "phi3:mini", "llama3.1:8b"],
+    index=0,
+    help="Usado nas tarefas pesadas (DW, relatórios); tarefas leves vão sempre para o modelo rápido"
 )
 
+    with st.expander("🗄️ Pool de Conexões"):
+        st.json(obter_estatisticas_pool())
+    with st.expander("🧠 Cache de Datasets"):
+        st.json(obter_estatisticas_cache_datasets())
+    with st.expander("♻️ Cache do LLM"):
+        st.json(obter_estatisticas_cache_llm())
+    with st.expander("📶 Latência dos Modelos"):
+        st.json(estatisticas_modelos())
+    with st.expander("🧠 Modelos Residentes"):
+        st.json({
+            "aquecimento": estado_aquecimento(),
+            "residentes": modelos_residentes(),
+            "carga_x_inferencia": estatisticas_carga(),
+        })
+    with st.expander("⏱️ Rastreio por Etapa"):
+        rastreios = ultimos_rastreios()
+        if rastreios:
+            ultimo = rastreios[0]
+            st.write(f"**Última pergunta:** {ultimo['acao']} em {ultimo['total_ms']:.0f} ms")
+            st.bar_chart(ultimo["etapas_ms"])
+            st.write(f"• 🤖 LLM: {ultimo['llm']['chamadas']} chamadas, "
+                     f"{ultimo['llm'].get('tokens_por_s', 0)} tokens/s, prefill {ultimo['llm']['prefill_ms']:.0f} ms")
+            st.write(f"• 🗄️ SQL: {ultimo['sql']['comandos']} comandos, {ultimo['sql']['linhas']} linhas, "
+                     f"{ultimo['sql']['ms']:.0f} ms")
+            st.json(rastreios)
+        else:
+            st.write("Nenhuma pergunta rastreada ainda.")
+    with st.expander("🕒 Análises em Segundo Plano"):
+        for job in listar_jobs(10):
+            rotulo = f"{job['estado']} · {job['pergunta'][:40]}"
+            if st.button(rotulo, key=f"abrir_{job['id']}", use_container_width=True):
+                st.query_params["job"] = job["id"]
+
+def caminhos_uploads(arquivos) -> list:
+    """Caminhos em memória dos uploads, registrados uma vez por sessão e reaproveitados entre reruns"""
+    anteriores = st.session_state.get("uploads_bi", {})
+    registrados = {}
+    for arquivo in arquivos:
+        chave = getattr(arquivo, "file_id", None) or (arquivo.name, arquivo.size)
+        caminho = anteriores.get(chave)
+        if caminho is None or not upload_registrado(caminho):
+            caminho = preparar_fontes([arquivo])[0]
+        registrados[chave] = caminho
+    # Só os arquivos ainda no uploader ficam na sessão
+    st.session_state["uploads_bi"] = registrados
+    return list(registrados.values())
+
+@st.fragment(run_every=2)
+def painel_job(job_id: str):
+    """Progresso e resultado de uma análise em segundo plano (atualizado a cada 2 s)"""
+    job = consultar_job(job_id)
+    if "estado" not in job:
+        st.warning(f"⚠️ Análise {job_id} não encontrada (pode ter expirado)")
+        return
+    st.subheader(f"🕒 Análise em segundo plano: {job['estado']}")
+    st.caption(f"{job['pergunta']} · {', '.join(job['arquivos'])}"
+               + (f" · {job['duracao_s']} s" if job["duracao_s"] is not None else ""))
+    for evento in job["eventos"][-8:]:
+        st.write(f"• {evento['mensagem']}")
+    if not job_terminado(job):
+        if st.button("🛑 Cancelar análise", key=f"cancelar_{job_id}"):
+            cancelar_job(job_id)
+    elif job["resultado"]:
+        st.subheader("📋 Resultado da Análise")
+        st.markdown(job["resultado"])
+    elif job["erro"]:
+        st.error(f"❌ {job['erro']}")
+
 # Área principal
 col1, col2 = st.columns([1, 2])
 
@@ -78,25 +165,24 @@ with col2:
         height=100
     )
 
+    em_segundo_plano = st.checkbox(
+        "🕒 Executar em segundo plano",
+        help="Para DW e cargas grandes: a análise segue mesmo se a página recarregar e pode ser cancelada "
+             "(gráficos e tabelas intermediárias não são exibidos, só o relatório final)"
+    )
+
     if st.button("🚀 Executar Análise", type="primary", use_container_width=True):
-        if arquivos and pergunta:
+        if arquivos and pergunta and em_segundo_plano:
+            modelo = None if modelo_selecionado == "automático" else modelo_selecionado
+            st.query_params["job"] = submeter_analise(pergunta, caminhos_uploads(arquivos), modelo)
+        elif arquivos and pergunta:
             with st.spinner("Processando localmente (pode levar alguns segundos)..."):
-                # Salvar arquivos temporariamente
-                caminhos_temp = []
-                for arquivo in arquivos:
-                    with tempfile.NamedTemporaryFile(delete=False, suffix='.csv') as tmp:
-                        tmp.write(arquivo.getvalue())
-                        caminhos_temp.append(tmp.name)
+                # Uploads direto da memória: sem arquivos temporários, e o mesmo upload não é relido
+                caminhos = caminhos_uploads(arquivos)
                 
                 # Executar agente BI
-                resultado = agente_bi_local(caminhos_temp, pergunta)
-                
-                # Limpar arquivos temporários
-                for caminho in caminhos_temp:
-                    try:
-                        os.unlink(caminho)
-                    except:
-                        pass
+                modelo = None if modelo_selecionado == "automático" else modelo_selecionado
+                resultado = agente_bi_local(caminhos, pergunta, modelo)
                 
                 # Mostrar resultados
                 st.subheader("📋 Resultado da Análise")
@@ -104,6 +190,10 @@ with col2:
         else:
             st.warning("⚠️ Por favor, faça upload de pelo menos 1 CSV e escreva uma pergunta.")
 
+    # O id fica na URL: depois de um rerun ou de reconectar, o painel reencontra a análise
+    if st.query_params.get("job"):
+        painel_job(st.query_params["job"])
+
 # Rodapé
 st.markdown("---")
 st.caption("Sistema 100% Local - Desenvolvido para BI Offline | Llama 3.1 + PostgreSQL + Streamlit")
\ No newline at end of file
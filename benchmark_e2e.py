@@ -0,0 +1,397 @@
+"""Benchmark de ponta a ponta das ações do agente, 100% offline.
+
+Gera CSVs sintéticos (vendas, clientes, produtos) do tamanho pedido, troca o
+ollama.chat por um dublê determinístico (latência e velocidade de geração
+configuráveis, SQL pronto para cada tipo de prompt) e usa um banco
+descartável, criado no servidor PostgreSQL do config.py e apagado ao final.
+
+Cada ação de orquestrar_acao roda em um processo novo (caches frios): mede o
+tempo de parede de cada repetição (a primeira é a fria), o pico de RSS, as
+idas ao banco (execute/COPY/FETCH nos cursores do psycopg2) e o tempo por
+etapa do rastreio. O resultado vai para um JSON que pode ser comparado entre
+commits com --comparar. Sem servidor PostgreSQL, as ações que dependem do
+banco são marcadas como puladas.
+
+Uso:
+    python benchmark_e2e.py
+    python benchmark_e2e.py --tamanhos 1 100 2000 --acoes consultas_sql criar_dw
+    python benchmark_e2e.py --saida depois.json --comparar antes.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import tempfile
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+ACOES = ["analise_exploratoria", "criar_dw", "consultas_sql", "ddl_operations",
+         "dml_operations", "visualizacao", "relatorios"]
+ACOES_COM_BANCO = {"criar_dw", "ddl_operations", "dml_operations"}
+PERGUNTAS = {
+    "analise_exploratoria": "faça uma análise exploratória dos dados",
+    "criar_dw": "crie um data warehouse estrela com as vendas",
+    "consultas_sql": "qual o total de vendas por categoria?",
+    "ddl_operations": "crie a tabela de metas com um índice",
+    "dml_operations": "insira as metas e atualize os valores",
+    "visualizacao": "mostre um gráfico das vendas",
+    "relatorios": "gere um relatório das vendas",
+}
+
+# --- Respostas prontas do dublê do Ollama (por tipo de prompt) ---
+SQL_DW = """```sql
+DROP TABLE IF EXISTS fato_vendas;
+DROP TABLE IF EXISTS dim_cliente;
+DROP TABLE IF EXISTS dim_produto;
+CREATE TABLE dim_cliente AS SELECT DISTINCT id_cliente, regiao FROM stg_clientes;
+ALTER TABLE dim_cliente ADD PRIMARY KEY (id_cliente);
+CREATE TABLE dim_produto AS SELECT DISTINCT id_produto, categoria, preco FROM stg_produtos;
+ALTER TABLE dim_produto ADD PRIMARY KEY (id_produto);
+CREATE TABLE fato_vendas AS
+SELECT v.id_venda, v.data, v.id_cliente, v.id_produto, v.quantidade, v.valor
+FROM stg_vendas v;
+SELECT COUNT(*) AS linhas_fato FROM fato_vendas;
+```
+O modelo estrela tem uma fato de vendas e as dimensões cliente e produto."""
+
+SQL_CONSULTA = """```sql
+-- Total de vendas por categoria
+SELECT p.categoria, COUNT(*) AS vendas, SUM(v.valor) AS total
+FROM consulta_vendas v
+JOIN consulta_produtos p ON p.id_produto = v.id_produto
+GROUP BY p.categoria
+ORDER BY total DESC;
+```
+A consulta junta vendas e produtos e soma o valor por categoria."""
+
+SQL_DDL = """```sql
+DROP TABLE IF EXISTS bench_metas;
+CREATE TABLE bench_metas (id INTEGER PRIMARY KEY, regiao TEXT, meta NUMERIC(12,2));
+CREATE INDEX idx_bench_metas_regiao ON bench_metas (regiao);
+ALTER TABLE bench_metas ADD COLUMN atualizado_em TIMESTAMP DEFAULT now();
+```"""
+
+SQL_DML = """```sql
+CREATE TABLE IF NOT EXISTS bench_metas (id INTEGER PRIMARY KEY, regiao TEXT, meta NUMERIC(12,2));
+DELETE FROM bench_metas;
+INSERT INTO bench_metas (id, regiao, meta) SELECT g, 'r' || (g % 5), g * 10 FROM generate_series(1, 20000) g;
+UPDATE bench_metas SET meta = meta * 1.1 WHERE id % 2 = 0;
+DELETE FROM bench_metas WHERE id % 10 = 0;
+```"""
+
+TEXTO_RELATORIO = ("1. Análise descritiva: as vendas se concentram em poucas categorias. "
+                   "2. Insights: o ticket médio é estável ao longo do ano. "
+                   "3. Recomendações: priorizar as categorias de maior margem.")
+
+
+def resposta_canonica(prompt: str) -> str:
+    """Resposta determinística do dublê para o tipo de prompt"""
+    if "Data Warehouse" in prompt:
+        return SQL_DW
+    if "consulta SQL otimizada" in prompt:
+        return SQL_CONSULTA
+    if "comandos DDL" in prompt:
+        return SQL_DDL
+    if "comandos DML" in prompt:
+        return SQL_DML
+    return TEXTO_RELATORIO
+
+
+def criar_ollama_falso(latencia_s: float, tokens_por_s: float):
+    """Substitutos de ollama.chat, ollama.Client e ollama.AsyncClient com tempos de prefill e geração simulados"""
+    import asyncio
+
+    def metricas(prompt: str, tokens: int) -> dict:
+        return {
+            "done": True,
+            "prompt_eval_count": len(prompt) // 4,
+            "prompt_eval_duration": int(latencia_s * 1e9),
+            "eval_count": tokens,
+            "eval_duration": int(tokens / tokens_por_s * 1e9),
+        }
+
+    def chat(model, messages, options=None, stream=False, **_):
+        prompt = messages[-1]["content"]
+        texto = resposta_canonica(prompt)
+        palavras = texto.split(" ")
+        if not stream:
+            time.sleep(latencia_s + len(palavras) / tokens_por_s)
+            return {"message": {"content": texto}, **metricas(prompt, len(palavras))}
+
+        def gerar():
+            time.sleep(latencia_s)
+            for i in range(0, len(palavras), 8):
+                grupo = palavras[i:i + 8]
+                time.sleep(len(grupo) / tokens_por_s)
+                trecho = " ".join(grupo) + (" " if i + 8 < len(palavras) else "")
+                yield {"message": {"content": trecho}, "done": False}
+            yield {"message": {"content": ""}, **metricas(prompt, len(palavras))}
+        return gerar()
+
+    class ClienteFalso:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def chat(self, *args, **kwargs):
+            return chat(*args, **kwargs)
+
+    class ClienteAssincronoFalso:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        async def chat(self, model, messages, options=None, **_):
+            prompt = messages[-1]["content"]
+            texto = resposta_canonica(prompt)
+            palavras = texto.split(" ")
+            await asyncio.sleep(latencia_s + len(palavras) / tokens_por_s)
+            return {"message": {"content": texto}, **metricas(prompt, len(palavras))}
+
+    return chat, ClienteFalso, ClienteAssincronoFalso
+
+
+# --- CSVs sintéticos ---
+def gerar_csvs(pasta: str, megabytes: float) -> list:
+    """vendas.csv com ~megabytes MB (gerado em blocos) e as dimensões clientes/produtos"""
+    destino = os.path.join(pasta, f"{megabytes:g}mb")
+    arquivos = [os.path.join(destino, nome) for nome in ("vendas.csv", "clientes.csv", "produtos.csv")]
+    if os.path.exists(os.path.join(destino, ".completo")):
+        return arquivos
+    os.makedirs(destino, exist_ok=True)
+    rng = np.random.default_rng(42)
+    n_clientes, n_produtos = 10_000, 1_000
+
+    pd.DataFrame({
+        "id_cliente": np.arange(n_clientes),
+        "regiao": rng.choice(["norte", "nordeste", "sul", "sudeste", "centro-oeste"], n_clientes),
+    }).to_csv(arquivos[1], index=False)
+    pd.DataFrame({
+        "id_produto": np.arange(n_produtos),
+        "categoria": rng.choice([f"cat_{i}" for i in range(12)], n_produtos),
+        "preco": rng.gamma(2.0, 40.0, n_produtos).round(2),
+    }).to_csv(arquivos[2], index=False)
+
+    alvo = int(megabytes * 1024 * 1024)
+    linhas_bloco = 50_000
+    proximo_id = escritos = 0
+    with open(arquivos[0], "w", newline="") as f:
+        while escritos < alvo:
+            bloco = pd.DataFrame({
+                "id_venda": np.arange(proximo_id, proximo_id + linhas_bloco),
+                "data": (pd.Timestamp("2023-01-01")
+                         + pd.to_timedelta(rng.integers(0, 730, linhas_bloco), unit="D")).strftime("%Y-%m-%d"),
+                "id_cliente": rng.integers(0, n_clientes, linhas_bloco),
+                "id_produto": rng.integers(0, n_produtos, linhas_bloco),
+                "quantidade": rng.integers(1, 20, linhas_bloco),
+                "valor": rng.gamma(2.0, 50.0, linhas_bloco).round(2),
+            })
+            texto = bloco.to_csv(index=False, header=proximo_id == 0)
+            if escritos + len(texto) > alvo:
+                # Último bloco cortado em uma quebra de linha, perto do tamanho pedido
+                texto = texto[:texto.rfind("\n", 0, alvo - escritos) + 1] or texto[:texto.index("\n") + 1]
+            f.write(texto)
+            escritos += len(texto)
+            proximo_id += linhas_bloco
+    open(os.path.join(destino, ".completo"), "w").close()
+    return arquivos
+
+
+# --- Banco descartável ---
+@contextmanager
+def banco_descartavel():
+    """Cria um banco temporário no servidor do config.py e o apaga ao final (None se indisponível)"""
+    from sqlalchemy import create_engine, text
+    from config import DB_CONFIG
+
+    credenciais = DB_CONFIG["username"] + (f":{DB_CONFIG['password']}" if DB_CONFIG["password"] else "")
+    url = f"postgresql+psycopg2://{credenciais}@{DB_CONFIG['host']}:{DB_CONFIG['port']}/postgres"
+    nome = f"bi_bench_{os.getpid()}"
+    try:
+        engine = create_engine(url, isolation_level="AUTOCOMMIT")
+        with engine.connect() as conn:
+            conn.execute(text(f"CREATE DATABASE {nome}"))
+    except Exception as e:
+        print(f"⚠️ PostgreSQL indisponível ({str(e).splitlines()[0]}): ações com banco serão puladas")
+        yield None
+        return
+    try:
+        yield nome
+    finally:
+        with engine.connect() as conn:
+            conn.execute(text(f"DROP DATABASE IF EXISTS {nome} WITH (FORCE)"))
+        engine.dispose()
+
+
+# --- Execução de uma ação (em um processo novo) ---
+def _instalar_contador_idas(contador: list):
+    """Conta execute/COPY/FETCH enviados pelos cursores psycopg2 de todas as conexões do pool"""
+    import psycopg2.extensions
+    from sqlalchemy import event
+    from sqlalchemy.pool import Pool
+
+    class CursorContador(psycopg2.extensions.cursor):
+        def execute(self, *args, **kwargs):
+            contador[0] += 1
+            return super().execute(*args, **kwargs)
+
+        def executemany(self, *args, **kwargs):
+            contador[0] += 1
+            return super().executemany(*args, **kwargs)
+
+        def copy_expert(self, *args, **kwargs):
+            contador[0] += 1
+            return super().copy_expert(*args, **kwargs)
+
+        def fetchmany(self, *args, **kwargs):
+            contador[0] += 1 if self.name else 0  # cursor do servidor: cada lote é um FETCH
+            return super().fetchmany(*args, **kwargs)
+
+    @event.listens_for(Pool, "connect")
+    def _ao_conectar(dbapi_conn, _):
+        dbapi_conn.cursor_factory = CursorContador
+
+
+def medir_acao(acao: str, caminhos: list, banco: str, repeticoes: int, latencia_s: float,
+               tokens_por_s: float, assincrono: bool) -> dict:
+    """Executa a ação repeticoes vezes no processo atual e devolve as medições"""
+    import logging
+    logging.disable(logging.WARNING)  # avisos do Streamlit sem servidor
+    import ollama
+
+    ollama.chat, ollama.Client, ollama.AsyncClient = criar_ollama_falso(latencia_s, tokens_por_s)
+    import agent_bi
+    import rastreio_bi
+
+    if banco:
+        agent_bi.DB_CONFIG["database"] = banco
+    agent_bi.CACHE_CONFIG["llm_ativo"] = False  # toda repetição passa pelo dublê do LLM
+    rastreio_bi.configurar_rastreio(arquivo=None)
+    # Intenção fixada: mede o caminho da ação, não o classificador
+    agent_bi.classificar_intencao_local = lambda pergunta: {
+        "acao_principal": acao, "confianca": 1.0, "detalhes": "benchmark"}
+    idas = [0]
+    _instalar_contador_idas(idas)
+
+    rss_base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    tempos, idas_por_execucao, etapas = [], [], []
+    resposta = ""
+    for _ in range(repeticoes):
+        antes = idas[0]
+        inicio = time.perf_counter()
+        if assincrono:
+            resposta = agent_bi.agente_bi_local(caminhos, PERGUNTAS[acao])
+        else:
+            resposta = agent_bi.orquestrar_acao(PERGUNTAS[acao], caminhos)
+        tempos.append(round(time.perf_counter() - inicio, 4))
+        idas_por_execucao.append(idas[0] - antes)
+        resumo = rastreio_bi.ultimos_rastreios()[0]
+        etapas.append({"etapas_ms": resumo["etapas_ms"], "llm": resumo["llm"], "sql": resumo["sql"]})
+    agent_bi.descartar_pool_processos()
+
+    return {
+        "acao": acao,
+        "tempos_s": tempos,
+        "frio_s": tempos[0],
+        "repetido_mediana_s": statistics.median(tempos[1:]) if len(tempos) > 1 else None,
+        "rss_base_mb": round(rss_base, 1),
+        "rss_pico_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "rss_pico_filhos_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        "idas_banco": idas_por_execucao,
+        "rastreio": etapas,
+        "erro_sql": resumo["sql"]["erros"] > 0,
+        "resposta": resposta.strip().splitlines()[0][:80] if resposta.strip() else "",
+    }
+
+
+def _commit_atual() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def comparar(anterior: dict, atual: dict):
+    """Imprime a variação do tempo frio e repetido por ação e tamanho"""
+    chave = lambda r: (r["acao"], r["tamanho_mb"])
+    antigos = {chave(r): r for r in anterior["resultados"] if "frio_s" in r}
+    print(f"\n📊 Comparação com {anterior.get('commit')} ({anterior.get('data')})")
+    for r in atual["resultados"]:
+        antigo = antigos.get(chave(r))
+        if antigo is None or "frio_s" not in r:
+            continue
+        variacao = (r["frio_s"] - antigo["frio_s"]) / antigo["frio_s"] * 100 if antigo["frio_s"] else 0.0
+        print(f"{r['acao']:>22} {r['tamanho_mb']:>7g} MB: frio {antigo['frio_s']:.3f} → {r['frio_s']:.3f} s "
+              f"({variacao:+.1f}%) | RSS {antigo['rss_pico_mb']:.0f} → {r['rss_pico_mb']:.0f} MB | "
+              f"idas ao banco (frio) {antigo['idas_banco'][0]} → {r['idas_banco'][0]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline de ponta a ponta das ações do agente")
+    parser.add_argument("--tamanhos", type=float, nargs="+", default=[1, 10], help="Tamanho do vendas.csv em MB")
+    parser.add_argument("--acoes", nargs="+", default=ACOES, choices=ACOES)
+    parser.add_argument("--repeticoes", type=int, default=3, help="Execuções por ação (a primeira é a fria)")
+    parser.add_argument("--latencia-llm", type=float, default=0.2, help="Segundos até o primeiro token")
+    parser.add_argument("--tokens-por-s", type=float, default=200.0, help="Velocidade de geração simulada")
+    parser.add_argument("--assincrono", action="store_true", help="Usa agente_bi_local (orquestrador assíncrono)")
+    parser.add_argument("--pasta", default=os.path.join(tempfile.gettempdir(), "bi_benchmark"),
+                        help="Onde gerar (e reaproveitar) os CSVs sintéticos")
+    parser.add_argument("--saida", default="benchmark_e2e.json")
+    parser.add_argument("--comparar", help="JSON de uma execução anterior para comparação")
+    args = parser.parse_args()
+    if args.repeticoes < 1:
+        parser.error("--repeticoes deve ser pelo menos 1")
+
+    resultado = {
+        "commit": _commit_atual(),
+        "data": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "maquina": {"cpus": os.cpu_count(), "python": platform.python_version(), "sistema": platform.platform()},
+        "parametros": {k: v for k, v in vars(args).items() if k not in ("saida", "comparar")},
+        "resultados": [],
+    }
+    contexto = multiprocessing.get_context("spawn")
+    with banco_descartavel() as banco:
+        for megabytes in args.tamanhos:
+            inicio = time.perf_counter()
+            caminhos = gerar_csvs(args.pasta, megabytes)
+            tamanho_real = os.path.getsize(caminhos[0]) / 1024 / 1024
+            print(f"\n📄 vendas.csv {tamanho_real:.1f} MB (pronto em {time.perf_counter() - inicio:.1f}s)")
+            for acao in args.acoes:
+                base = {"acao": acao, "tamanho_mb": megabytes, "tamanho_real_mb": round(tamanho_real, 2)}
+                if acao in ACOES_COM_BANCO and banco is None:
+                    resultado["resultados"].append({**base, "pulada": "sem PostgreSQL"})
+                    print(f"{acao:>22}: ⏭️ pulada (sem PostgreSQL)")
+                    continue
+                # Processo novo por ação: caches frios e pico de RSS só desta ação
+                with ProcessPoolExecutor(max_workers=1, mp_context=contexto) as executor:
+                    try:
+                        medicao = executor.submit(medir_acao, acao, caminhos, banco, args.repeticoes,
+                                                  args.latencia_llm, args.tokens_por_s, args.assincrono).result()
+                    except Exception as e:
+                        resultado["resultados"].append({**base, "erro": str(e)})
+                        print(f"{acao:>22}: ❌ {e}")
+                        continue
+                resultado["resultados"].append({**base, **medicao})
+                repetido = f"{medicao['repetido_mediana_s']:.3f} s" if medicao["repetido_mediana_s"] is not None else "-"
+                print(f"{acao:>22}: frio {medicao['frio_s']:.3f} s | repetido {repetido} | "
+                      f"RSS {medicao['rss_pico_mb']:.0f} MB | idas ao banco {medicao['idas_banco']}"
+                      + (" | ⚠️ erro SQL" if medicao["erro_sql"] else ""))
+
+    with open(args.saida, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, indent=2, ensure_ascii=False)
+    print(f"\n💾 Resultados em {args.saida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            comparar(json.load(f), resultado)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Benchmark do classificador local de intenção.
+
+Mede acurácia e latência no conjunto rotulado dados_intencao/teste.jsonl e
+estima quanto tempo de LLM é economizado em cada limiar de confiança.
+
+Uso:
+    python benchmark_intencao.py
+    python benchmark_intencao.py --latencia-llm 4.5 --limiares 0.5 0.6 0.8
+"""
+import argparse
+import statistics
+import time
+
+from intencao_bi import carregar_exemplos, classificar_intencao_local, classificar_por_palavras_chave, obter_classificador
+
+
+def medir(funcao, exemplos):
+    """Executa a classificação em todos os exemplos, devolvendo (resultado, segundos)"""
+    medicoes = []
+    for pergunta, _ in exemplos:
+        inicio = time.perf_counter()
+        resultado = funcao(pergunta)
+        medicoes.append((resultado, time.perf_counter() - inicio))
+    return medicoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Acurácia x latência do classificador local de intenção")
+    parser.add_argument("--latencia-llm", type=float, default=3.0,
+                        help="Latência média (s) de uma chamada de intenção ao LLM")
+    parser.add_argument("--limiares", type=float, nargs="+", default=[0.4, 0.5, 0.6, 0.7, 0.8, 0.9])
+    args = parser.parse_args()
+
+    exemplos = carregar_exemplos("teste.jsonl")
+    inicio = time.perf_counter()
+    obter_classificador()
+    print(f"🧠 Treino do classificador: {(time.perf_counter() - inicio) * 1000:.1f} ms")
+    print(f"📋 Exemplos de teste: {len(exemplos)}\n")
+
+    for nome, funcao in [("palavras-chave", classificar_por_palavras_chave), ("naive bayes", classificar_intencao_local)]:
+        medicoes = medir(funcao, exemplos)
+        acertos = sum(r["acao_principal"] == acao for (r, _), (_, acao) in zip(medicoes, exemplos))
+        tempos_us = sorted(t * 1e6 for _, t in medicoes)
+        p95 = tempos_us[int(len(tempos_us) * 0.95) - 1]
+        print(f"{nome:>15}: acurácia {acertos / len(exemplos):.1%} | "
+              f"latência média {statistics.mean(tempos_us):.1f} µs | p95 {p95:.1f} µs")
+
+    print("\nlimiar | resolvidas localmente | acurácia local | tempo de LLM economizado")
+    medicoes = medir(classificar_intencao_local, exemplos)
+    for limiar in args.limiares:
+        locais = [(r, acao) for (r, _), (_, acao) in zip(medicoes, exemplos) if r["confianca"] >= limiar]
+        acertos = sum(r["acao_principal"] == acao for r, acao in locais)
+        acuracia = acertos / len(locais) if locais else 0.0
+        economia = len(locais) * args.latencia_llm
+        print(f"{limiar:>6.2f} | {len(locais):>3}/{len(exemplos)} ({len(locais) / len(exemplos):>5.1%}) | "
+              f"{acuracia:>13.1%} | {economia:.1f} s ({economia / len(exemplos):.2f} s por pergunta)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Benchmark do tempo até o primeiro resultado em consultas ad-hoc.
+
+Compara o caminho antigo (carga do CSV no PostgreSQL via COPY + SELECT) com o
+motor embutido (SELECT direto sobre o CSV). Sem --csv, gera um arquivo
+sintético com o número de linhas pedido. O caminho PostgreSQL usa o
+DB_CONFIG do config.py; se o banco não estiver acessível, só o motor embutido
+é medido.
+
+Uso:
+    python benchmark_motor_sql.py
+    python benchmark_motor_sql.py --linhas 1000000 --repeticoes 5
+    python benchmark_motor_sql.py --csv vendas.csv --sql "SELECT COUNT(*) FROM consulta_vendas"
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import agent_bi
+from motor_sql_bi import limpar_motor_embutido, motor_disponivel
+
+
+def gerar_csv(caminho: str, linhas: int):
+    """CSV sintético de vendas (id, data, categoria, quantidade, valor)"""
+    rng = np.random.default_rng(0)
+    pd.DataFrame({
+        "id": np.arange(linhas),
+        "data": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 365, linhas), unit="D"),
+        "categoria": rng.choice(["a", "b", "c", "d", "e"], linhas),
+        "quantidade": rng.integers(1, 20, linhas),
+        "valor": rng.gamma(2.0, 50.0, linhas).round(2),
+    }).to_csv(caminho, index=False)
+
+
+def medir(funcao, repeticoes: int, frio: bool = True):
+    """Executa a função repetidas vezes; devolve (último resultado, tempos em s)"""
+    tempos = []
+    resultado = None
+    for _ in range(repeticoes):
+        if frio:
+            agent_bi.limpar_cache_datasets()
+            limpar_motor_embutido()
+        inicio = time.perf_counter()
+        resultado = funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return resultado, tempos
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tempo até o primeiro resultado: PostgreSQL x motor embutido")
+    parser.add_argument("--csv", help="CSV a consultar (padrão: arquivo sintético)")
+    parser.add_argument("--linhas", type=int, default=500_000, help="Linhas do CSV sintético")
+    parser.add_argument("--sql", help="Consulta (padrão: soma de valor por categoria)")
+    parser.add_argument("--repeticoes", type=int, default=3)
+    args = parser.parse_args()
+
+    pasta = tempfile.mkdtemp()
+    caminho = args.csv or os.path.join(pasta, "vendas.csv")
+    if not args.csv:
+        gerar_csv(caminho, args.linhas)
+    tabela = agent_bi.nome_tabela_csv("consulta", caminho)
+    sql = args.sql or f"SELECT categoria, COUNT(*) AS vendas, SUM(valor) AS total FROM {tabela} GROUP BY categoria ORDER BY categoria"
+
+    print(f"📄 {os.path.basename(caminho)}: {os.path.getsize(caminho) / 1024 / 1024:.1f} MB")
+    print(f"🔍 {sql}\n")
+
+    motor = motor_disponivel(agent_bi.DB_CONFIG.get("motor_embutido", "auto"))
+    embutido = lambda: agent_bi.executar_sql(sql, agent_bi.arquivos_consulta([caminho]))
+    # (nome, função, frio): "frio" descarta os caches antes de cada repetição;
+    # "repetido" mede a próxima pergunta sobre o mesmo upload
+    caminhos = [
+        (f"embutido {motor} (frio)", embutido, True),
+        (f"embutido {motor} (repetido)", embutido, False),
+        ("postgres (COPY + SELECT)",
+         lambda: (agent_bi.carregar_csv_copy(caminho, tabela), agent_bi.executar_sql(sql))[1], True),
+    ]
+    for nome, funcao, frio in caminhos:
+        try:
+            resultado, tempos = medir(funcao, args.repeticoes, frio)
+        except Exception as e:
+            print(f"{nome:>28}: ❌ {e}")
+            continue
+        if isinstance(resultado, str):
+            print(f"{nome:>28}: ❌ {resultado}")
+            continue
+        print(f"{nome:>28}: mediana {statistics.median(tempos):.3f} s | mínimo {min(tempos):.3f} s | "
+              f"{len(resultado)} linhas no resultado")
+
+    if not args.csv:
+        os.remove(caminho)
+
+
+if __name__ == "__main__":
+    main()
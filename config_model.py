@@ -4,7 +4,32 @@ DB_CONFIG = {
     "port": nomedaporta,
     "database": "nome da base dados",  # Se não existir, crie: CREATE DATABASE bi_dw;
     "username": "nome do usuario",  # Seu usuário PostgreSQL
-    "password": ""  # SUA SENHA REAL DO POSTGRES
+    "password": "",  # SUA SENHA REAL DO POSTGRES
+    # Pool de conexões (compartilhado por todas as sessões do Streamlit)
+    "pool_size": 5,         # Conexões mantidas abertas
+    "max_overflow": 10,     # Conexões extras permitidas em picos
+    "pool_timeout": 30,     # Segundos aguardando uma conexão livre
+    "pool_pre_ping": True,  # Testa a conexão antes de usar (evita conexões mortas)
+    "pool_recycle": 1800,   # Recicla conexões após N segundos
+    # Carga de CSV via COPY
+    "copy_linhas_amostra": 10000,       # Linhas lidas para inferir o schema
+    "copy_bloco_bytes": 1024 * 1024,    # Tamanho de cada bloco enviado ao COPY
+    "catalogo_ttl_s": 300,              # Validade do catálogo de tabelas em cache (DDL invalida antes)
+    # Cargas incrementais: chave declarada por tabela de staging ativa o modo de mescla (upsert)
+    "staging_chaves": {},               # Ex.: {"stg_vendas": ["id_venda"]}
+    # Resultados de SELECT (cursor do lado do servidor)
+    "sql_max_linhas": 10000,            # Linhas máximas trazidas para a memória (o resto é truncado)
+    "sql_lote_linhas": 5000,            # Linhas buscadas por ida ao servidor
+    "sql_linhas_pagina": 50,            # Linhas exibidas na interface
+    "pasta_exportacao": "exportacoes",  # Destino das exportações completas (Parquet/CSV)
+    # Scripts do LLM em uma transação: desfaz tudo se algum comando falhar. Executados no fim da geração,
+    # em uma transação curta (DROP/CREATE TABLE pegam ACCESS EXCLUSIVE e bloqueiam as leituras das tabelas
+    # até o commit). False: cada bloco ```sql é executado e confirmado assim que o LLM o fecha
+    "scripts_atomicos": True,
+    # Consultas ad-hoc: "embutido" (direto sobre os CSVs) ou "postgres" (carga via COPY antes)
+    "motor_consultas": "embutido",
+    "motor_embutido": "auto",           # "auto" (DuckDB se instalado, senão SQLite) ou "sqlite"
+    "motor_max_tabelas": 8              # CSVs mantidos carregados no SQLite em memória
 }
 
 # ⭐⭐ NOVA CONFIGURAÇÃO DO MODELO OLLAMA ⭐⭐
@@ -12,5 +37,98 @@ OLLAMA_CONFIG = {
     "modelo_padrao": "llama3.2:3b",  # ⚡ ALTERE AQUI O MODELO!
     "modelo_rapido": "llama3.2:3b",
     "modelo_completo": "llama3.1:8b",
-    "timeout": 120
-}
\ No newline at end of file
+    "timeout": 120,
+    "streaming": True,  # Mostra a resposta enquanto o modelo gera
+    "intencao_confianca_minima": 0.6,  # Abaixo disso o classificador local pede ajuda ao LLM
+    "concorrencia_max": 2,  # Chamadas simultâneas ao Ollama no orquestrador assíncrono (OLLAMA_NUM_PARALLEL)
+    # Roteamento: nível de modelo por tarefa ("rapido", "completo" ou "padrao")
+    "tarefas_modelo": {
+        "intencao": "rapido",
+        "consulta_sql": "rapido",
+        "ddl": "rapido",
+        "dml": "rapido",
+        "resumo_arquivo": "rapido",
+        "dw": "completo",
+        "relatorio": "completo",
+        "padrao": "padrao"
+    },
+    # Prazo (s) de cada chamada por tarefa; as demais usam o timeout. Estourou: tenta o modelo rápido
+    "prazos_s": {"intencao": 20, "consulta_sql": 60, "ddl": 60, "dml": 60, "resumo_arquivo": 60},
+    "roteamento_adaptativo": True,  # Desvia para o modelo rápido se o p90 medido chegar perto do prazo
+    "roteamento_janela_s": 600,     # Idade máxima das latências consideradas pelo roteador
+    "roteamento_timeouts_max": 2,   # Timeouts recentes que desviam a tarefa para o modelo rápido
+    # Ciclo de vida dos modelos no servidor Ollama
+    "aquecer_na_subida": True,      # Carrega os modelos em segundo plano quando o app sobe
+    "aquecer_modelos": None,        # None = modelo rápido e completo
+    "keep_alive_fixado": "24h",     # Aquecidos ficam residentes; os usados pelo roteador, pelo tempo da janela
+    "keep_alive": {"padrao": "5m"}, # Demais modelos (por nome ou "padrao"); "-1" = nunca descarrega
+    # Tokens máximos do contexto de dados (colunas/tabelas) em cada prompt, por modelo
+    "orcamento_contexto_tokens": {
+        "phi3:mini": 1500,
+        "llama3.2:3b": 2500,
+        "llama3.1:8b": 4000,
+        "padrao": 2000
+    }
+}
+
+# Caches locais de desempenho
+CACHE_CONFIG = {
+    "datasets_memoria_mb": 512,  # Memória máxima para DataFrames em cache (LRU)
+    "uploads_memoria_mb": 1024,  # Memória máxima para uploads mantidos entre execuções (LRU)
+    # Workspace colunar: cada CSV convertido uma vez para Parquet (requer pyarrow)
+    "workspace_ativo": True,
+    "workspace_pasta": ".cache_bi/workspace",
+    "workspace_max_mb": 2048,         # Tamanho máximo em disco (despeja os de acesso mais antigo)
+    "workspace_max_idade_horas": 168, # Arquivos sem acesso há mais tempo que isso são removidos
+    "workspace_linhas_grupo": 100000, # Linhas por grupo de linhas do Parquet (unidade dos filtros)
+    # Cache de respostas do LLM (SQLite local)
+    "llm_ativo": True,
+    "llm_arquivo": ".cache_bi/llm_cache.sqlite",
+    "llm_temperatura_max": 0.1,  # Só guarda respostas de chamadas com temperatura até este valor
+    "llm_ttl_horas": 168,        # Validade das respostas (7 dias)
+    "llm_tamanho_max_mb": 100    # Tamanho máximo do cache em disco
+}
+
+# Processamento de dados (perfis, gráficos, tipos)
+ANALISE_CONFIG = {
+    "perfil_linhas_bloco": 100000,     # Linhas lidas por bloco no perfil exploratório
+    "perfil_amostra_quantis": 10000,   # Tamanho da amostra usada nos quantis aproximados
+    "perfil_max_cache": 256,           # Perfis guardados em memória (por hash do arquivo)
+    "processos_max": None,             # Processos para perfilar vários CSVs em paralelo (None = nº de CPUs)
+    "grafico_limite_pontos": 20000,    # Acima disso, dispersão vira densidade 2D ou linha LTTB
+    "grafico_pontos_lttb": 2000,       # Pontos mantidos pelo LTTB em séries ordenadas
+    "grafico_grade_densidade": 60,     # Células por eixo no gráfico de densidade
+    "grafico_bins": 10,                # Intervalos do histograma
+    "grafico_max_cache": 64,           # Gráficos (PNG) guardados em memória
+    "tipos_compactos": True,           # Leitura completa com inteiros reduzidos, categorias e datas já convertidas
+    "tipos_fracao_categoria": 0.5,     # Texto vira categoria se distintos/linhas da amostra ficar até este valor
+    "tipos_compactos_banco": True      # Staging com SMALLINT/INTEGER/DATE (usa o perfil do arquivo inteiro)
+}
+
+# Rastreio por etapa (tempo de cada etapa, tokens do LLM, SQL)
+RASTREIO_CONFIG = {
+    "ativo": True,
+    "arquivo": ".cache_bi/rastreio.jsonl",  # Uma linha JSON por span (None = só em memória)
+    "max_resumos": 20                       # Perguntas recentes resumidas na barra lateral
+}
+
+# Análises em segundo plano (pool de processos fora do Streamlit)
+JOBS_CONFIG = {
+    "workers": 2,                       # Análises executadas ao mesmo tempo
+    "limites": {"llm": 2, "banco": 4},  # Chamadas ao Ollama / conexões ao PostgreSQL somando todos os workers
+    "arquivo": ".cache_bi/jobs.sqlite", # Estado, progresso e resultado de cada análise
+    "cancelamento_espera_s": 10,        # Depois disso, o worker de um job cancelado é encerrado à força
+    "retencao_horas": 72                # Jobs mais antigos são apagados na subida
+}
+
+# Desenho físico do Data Warehouse, aplicado depois do DDL gerado pelo LLM
+DW_CONFIG = {
+    "otimizar": True,                   # Índices, ANALYZE e visões materializadas após criar o DW
+    "indices": True,                    # Índices nas chaves estrangeiras/colunas de junção e na data dos fatos
+    "visoes_materializadas": True,      # Agregados por chave de dimensão e por mês
+    "max_visoes": 6,                    # Visões materializadas criadas no máximo (somando os fatos)
+    "particionar": False,               # Particiona por faixa de data os fatos grandes (reescreve a tabela)
+    "particao_min_linhas": 1000000,     # Fatos menores que isso não são particionados
+    "max_particoes": 48,                # Partições mensais até este número; acima, anuais
+    "medicao_repeticoes": 3             # Execuções de cada consulta de amostra (vale o melhor tempo)
+}
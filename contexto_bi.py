@@ -0,0 +1,190 @@
+"""Montagem compacta do contexto (arquivos e tabelas) enviado nos prompts.
+
+Substitui o json.dumps(indent=2) do contexto por uma linha por arquivo/tabela,
+remove repetições (arquivos e tabelas com as mesmas colunas) e respeita um
+orçamento de tokens, priorizando as colunas e tabelas mais relevantes para a
+pergunta.
+"""
+import json
+from typing import Dict, List, Tuple, Union
+
+from intencao_bi import extrair_termos
+
+_TIPOS_CURTOS = {
+    "int": "int", "uint": "int", "float": "float", "bool": "bool",
+    "datetime": "data", "date": "data", "timestamp": "data",
+    "object": "texto", "str": "texto", "string": "texto", "text": "texto", "category": "texto",
+    "bigint": "int", "integer": "int", "smallint": "int", "double": "float", "numeric": "float",
+    "real": "float", "boolean": "bool", "character": "texto",
+}
+
+# Tamanho máximo de cada valor de exemplo e de colunas na linha de exemplo
+_MAX_VALOR_EXEMPLO = 20
+_MAX_COLUNAS_EXEMPLO = 10
+# Reserva para a linha final de tabelas omitidas
+_RESERVA_RODAPE = 16
+
+
+def estimar_tokens(texto: str) -> int:
+    """Estimativa de tokens (~4 caracteres por token, média dos tokenizadores BPE)"""
+    return (len(texto) + 3) // 4 if texto else 0
+
+
+def _tipo_curto(tipo: str) -> str:
+    tipo = str(tipo).lower()
+    for prefixo, curto in _TIPOS_CURTOS.items():
+        if tipo.startswith(prefixo):
+            return curto
+    return tipo
+
+
+def _termos_relevancia(texto: str) -> set:
+    return {t for t in extrair_termos(str(texto).replace("_", " ")) if "_" not in t and len(t) > 2}
+
+
+def _pontuar(termos_item: set, termos_pergunta: set) -> int:
+    """Quantos termos do item aparecem na pergunta (igual ou mesmo radical de 4 letras)"""
+    pontos = 0
+    for termo in termos_item:
+        if termo in termos_pergunta or any(len(t) >= 4 and t[:4] == termo[:4] for t in termos_pergunta):
+            pontos += 1
+    return pontos
+
+
+def _normalizar_tabelas(tabelas: Union[List[str], Dict, None]) -> Dict[str, List[Tuple[str, str]]]:
+    """Aceita lista de nomes ou {tabela: {coluna: tipo} | [colunas]}"""
+    if not tabelas:
+        return {}
+    if isinstance(tabelas, dict):
+        normalizadas = {}
+        for nome, colunas in tabelas.items():
+            if isinstance(colunas, dict):
+                normalizadas[nome] = [(c, _tipo_curto(t)) for c, t in colunas.items()]
+            else:
+                normalizadas[nome] = [(c, "") for c in (colunas or [])]
+        return normalizadas
+    return {nome: [] for nome in tabelas}
+
+
+def montar_contexto_compacto(pergunta: str, contexto_csv: Dict = None, tabelas=None,
+                             orcamento_tokens: int = 2000) -> Tuple[str, Dict]:
+    """Renderiza arquivos e tabelas dentro do orçamento; devolve (texto, estatísticas)"""
+    contexto_csv = contexto_csv or {}
+    tabelas = _normalizar_tabelas(tabelas)
+    termos_pergunta = _termos_relevancia(pergunta)
+    orcamento_util = max(orcamento_tokens - _RESERVA_RODAPE, 0)
+
+    # --- Itens (arquivos e tabelas) com deduplicação por conjunto de colunas ---
+    itens = []
+    assinaturas = {}
+    for nome, info in contexto_csv.items():
+        if "erro" in info:
+            itens.append({"tipo": "ARQUIVO", "nome": nome, "erro": info["erro"], "colunas": []})
+            continue
+        tipos = info.get("tipos", {})
+        colunas = [(c, _tipo_curto(tipos.get(c, ""))) for c in info.get("colunas", [])]
+        amostra = (info.get("amostra") or [{}])[0]
+        itens.append({"tipo": "ARQUIVO", "nome": nome, "colunas": colunas, "amostra": amostra})
+    for nome, colunas in tabelas.items():
+        itens.append({"tipo": "TABELA", "nome": nome, "colunas": colunas})
+
+    for item in itens:
+        assinatura = frozenset(str(c).lower() for c, _ in item["colunas"])
+        if not assinatura:
+            continue
+        if assinatura in assinaturas:
+            item["igual_a"] = assinaturas[assinatura]
+        else:
+            assinaturas[assinatura] = item["nome"]
+
+    for ordem, item in enumerate(itens):
+        item["ordem"] = ordem
+        item["pontos"] = _pontuar(_termos_relevancia(item["nome"]), termos_pergunta) * 2 + sum(
+            _pontuar(_termos_relevancia(c), termos_pergunta) for c, _ in item["colunas"]
+        )
+        item["incluidas"] = []
+
+    # --- Cabeçalhos: arquivos sempre, tabelas por relevância ---
+    def cabecalho(item):
+        if "erro" in item:
+            return f"{item['tipo']} {item['nome']}: erro ao ler ({item['erro']})"
+        if "igual_a" in item:
+            return f"{item['tipo']} {item['nome']}: mesmas colunas de {item['igual_a']}"
+        if not item["colunas"]:
+            return f"{item['tipo']} {item['nome']}"
+        return f"{item['tipo']} {item['nome']}:"
+
+    usados = 0
+    visiveis = []
+    limite_cabecalhos = None
+    for item in sorted(itens, key=lambda i: (i["tipo"] != "ARQUIVO", -i["pontos"], i["ordem"])):
+        custo = estimar_tokens(cabecalho(item)) + 1
+        if item["tipo"] == "TABELA":
+            # Cabeçalhos de tabelas ocupam no máximo metade do que sobrou após os arquivos
+            if limite_cabecalhos is None:
+                limite_cabecalhos = usados + (orcamento_util - usados) // 2
+            if usados + custo > limite_cabecalhos:
+                continue
+        visiveis.append(item)
+        usados += custo
+
+    # --- Colunas em ordem global de relevância ---
+    candidatas = []
+    for item in visiveis:
+        if "erro" in item or "igual_a" in item:
+            continue
+        for posicao, (coluna, tipo) in enumerate(item["colunas"]):
+            pontos = _pontuar(_termos_relevancia(coluna), termos_pergunta)
+            candidatas.append((-pontos, -item["pontos"], item["ordem"], posicao, item, coluna, tipo))
+    for menos_pontos, _, _, posicao, item, coluna, tipo in sorted(candidatas, key=lambda c: c[:4]):
+        custo = estimar_tokens(f" {coluna}:{tipo},")
+        if usados + custo > orcamento_util:
+            break
+        item["incluidas"].append((posicao, -menos_pontos, coluna, tipo))
+        usados += custo
+
+    # --- Exemplos de valores (se ainda couber) ---
+    for item in visiveis:
+        if not item.get("amostra") or not item["incluidas"]:
+            continue
+        # Exemplo só das colunas mais relevantes que estão na amostra
+        no_exemplo = [c for c in item["incluidas"] if c[2] in item["amostra"]][:_MAX_COLUNAS_EXEMPLO]
+        if not no_exemplo:
+            continue
+        valores = [f"{c}={str(item['amostra'][c])[:_MAX_VALOR_EXEMPLO]}" for _, _, c, _ in sorted(no_exemplo)]
+        linha = "  exemplo: " + " | ".join(valores)
+        custo = estimar_tokens(linha) + 1
+        if usados + custo <= orcamento_util:
+            item["exemplo"] = linha
+            usados += custo
+
+    # --- Renderização ---
+    linhas = []
+    for item in sorted(visiveis, key=lambda i: i["ordem"]):
+        linha = cabecalho(item)
+        if item["incluidas"]:
+            colunas = ", ".join(f"{c}:{t}" if t else c for _, _, c, t in sorted(item["incluidas"]))
+            omitidas = len(item["colunas"]) - len(item["incluidas"])
+            linha += f" {colunas}" + (f" (+{omitidas} colunas omitidas)" if omitidas else "")
+        elif item["colunas"] and "igual_a" not in item and "erro" not in item:
+            linha += f" ({len(item['colunas'])} colunas omitidas)"
+        linhas.append(linha)
+        if item.get("exemplo"):
+            linhas.append(item["exemplo"])
+
+    tabelas_omitidas = len(itens) - len(visiveis)
+    if tabelas_omitidas:
+        linhas.append(f"(+{tabelas_omitidas} tabelas omitidas por serem menos relevantes para a pergunta)")
+
+    texto = "\n".join(linhas) if linhas else "(nenhum arquivo ou tabela disponível)"
+    original = json.dumps(contexto_csv, indent=2, ensure_ascii=False, default=str) + str(list(tabelas))
+    estatisticas = {
+        "tokens_antes": estimar_tokens(original),
+        "tokens_depois": estimar_tokens(texto),
+        "orcamento_tokens": orcamento_tokens,
+        "colunas_total": sum(len(i["colunas"]) for i in itens if "igual_a" not in i),
+        "colunas_incluidas": sum(len(i["incluidas"]) for i in visiveis),
+        "tabelas_total": len(tabelas),
+        "tabelas_incluidas": sum(1 for i in visiveis if i["tipo"] == "TABELA"),
+    }
+    return texto, estatisticas
@@ -0,0 +1,370 @@
+"""Desenho físico do Data Warehouse criado pelo LLM: índices, ANALYZE, partições e agregados.
+
+Depois do DDL do modelo estrela, inspeciona o catálogo do PostgreSQL para
+achar fatos e dimensões: pelas chaves estrangeiras declaradas ou, quando o
+modelo não as declarou, por colunas de mesmo nome que são a chave primária
+de outra tabela. Planeja índices nas colunas de junção que ainda não lideram
+nenhum índice, ANALYZE em todas as tabelas, partição por faixa de datas dos
+fatos grandes (opcional: reescreve a tabela) e visões materializadas com os
+agrupamentos mais comuns (por chave de dimensão e por mês). As consultas de
+amostra são medidas antes e depois, na mesma conexão, para o relatório.
+
+As visões criadas levam um comentário com a marca MARCA_VISAO e o fato de
+origem: antes de um novo DDL do DW elas são removidas (senão o DROP TABLE
+do fato falharia por dependência) e, depois de DML nos fatos, atualizadas.
+"""
+import re
+import time
+from datetime import date
+from typing import Dict, List, Optional
+
+# Captura só o nome da tabela (sem o schema, se houver)
+_REGEX_CREATE_TABLE = re.compile(
+    r'create\s+(?:unlogged\s+)?table\s+(?:if\s+not\s+exists\s+)?(?:(?:"(?:[^"]|"")+"|\w+)\s*\.\s*)?'
+    r'("(?:[^"]|"")+"|\w+)',
+    re.IGNORECASE,
+)
+_REGEX_ID = re.compile(r"^(id|sk|fk|cod|codigo|chave)_|_(id|sk|fk|key|cod|codigo)$|^id$", re.IGNORECASE)
+_TIPOS_NUMERICOS = ("smallint", "integer", "bigint", "numeric", "real", "double precision")
+_TIPOS_DATA = ("date", "timestamp")
+_MAX_IDENTIFICADOR = 63  # NAMEDATALEN - 1 no PostgreSQL
+MARCA_VISAO = "bi_desenho_fisico"
+
+
+def _aspas(nome: str) -> str:
+    return '"' + nome.replace('"', '""') + '"'
+
+
+def _nome(*partes: str) -> str:
+    """Nome de objeto derivado (índice, visão, partição) dentro do limite de 63 bytes"""
+    nome = re.sub(r"\W+", "_", "_".join(partes)).strip("_").lower()
+    return nome.encode()[:_MAX_IDENTIFICADOR].decode(errors="ignore")
+
+
+def tabelas_criadas(comandos: List[str]) -> List[str]:
+    """Tabelas criadas pelos comandos (sem schema; nomes sem aspas em minúsculas, como o PostgreSQL guarda)"""
+    tabelas = []
+    for comando in comandos:
+        for nome in _REGEX_CREATE_TABLE.findall(comando):
+            nome = nome[1:-1].replace('""', '"') if nome.startswith('"') else nome.lower()
+            if nome not in tabelas:
+                tabelas.append(nome)
+    return tabelas
+
+
+def inspecionar_estrela(cursor, tabelas: List[str]) -> Dict:
+    """Colunas, chaves, índices e linhas das tabelas; fatos, dimensões e colunas de junção"""
+    estrela = {nome: {"colunas": {}, "pk": [], "fks": [], "referenciada_por": [], "indexadas": set(),
+                      "particionada": False, "linhas": 0} for nome in tabelas}
+    cursor.execute("""
+        SELECT c.relname, c.relkind, a.attname, format_type(a.atttypid, a.atttypmod)
+        FROM pg_attribute a
+        JOIN pg_class c ON c.oid = a.attrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = current_schema() AND c.relname = ANY(%s) AND c.relkind IN ('r', 'p')
+          AND a.attnum > 0 AND NOT a.attisdropped
+        ORDER BY c.relname, a.attnum
+    """, (tabelas,))
+    for tabela, tipo_relacao, coluna, tipo in cursor.fetchall():
+        estrela[tabela]["colunas"][coluna] = tipo
+        estrela[tabela]["particionada"] = tipo_relacao == "p"
+    estrela = {nome: info for nome, info in estrela.items() if info["colunas"]}  # removidas ou views
+
+    cursor.execute("""
+        SELECT con.contype, con.conname, c.relname, r.relname, pg_get_constraintdef(con.oid),
+               ARRAY(SELECT a.attname::text FROM unnest(con.conkey) WITH ORDINALITY k(num, ordem)
+                     JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.num ORDER BY k.ordem),
+               ARRAY(SELECT a.attname::text FROM unnest(con.confkey) WITH ORDINALITY k(num, ordem)
+                     JOIN pg_attribute a ON a.attrelid = con.confrelid AND a.attnum = k.num ORDER BY k.ordem)
+        FROM pg_constraint con
+        JOIN pg_class c ON c.oid = con.conrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        LEFT JOIN pg_class r ON r.oid = con.confrelid
+        WHERE n.nspname = current_schema() AND con.contype IN ('p', 'f')
+          AND (c.relname = ANY(%s) OR r.relname = ANY(%s))
+    """, (list(estrela), list(estrela)))
+    for tipo, nome, tabela, referenciada, definicao, colunas, colunas_ref in cursor.fetchall():
+        if tipo == "p" and tabela in estrela:
+            estrela[tabela]["pk"] = colunas
+        elif tipo == "f":
+            if tabela in estrela:
+                estrela[tabela]["fks"].append({"nome": nome, "colunas": colunas, "tabela": referenciada,
+                                               "colunas_ref": colunas_ref, "definicao": definicao})
+            if referenciada in estrela:
+                estrela[referenciada]["referenciada_por"].append(tabela)
+
+    cursor.execute("""
+        SELECT c.relname, a.attname
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+        WHERE n.nspname = current_schema() AND c.relname = ANY(%s)
+    """, (list(estrela),))
+    for tabela, coluna in cursor.fetchall():
+        estrela[tabela]["indexadas"].add(coluna)
+
+    for nome, info in estrela.items():
+        cursor.execute(f"SELECT COUNT(*) FROM {_aspas(nome)}")
+        info["linhas"] = cursor.fetchone()[0]
+
+    juncoes = _colunas_juncao(estrela)
+    fatos = sorted({j["fato"] for j in juncoes}, key=lambda t: -estrela[t]["linhas"])
+    return {
+        "tabelas": estrela,
+        "juncoes": juncoes,
+        "fatos": fatos,
+        "dimensoes": sorted({j["dimensao"] for j in juncoes} - set(fatos)),
+    }
+
+
+def _colunas_juncao(estrela: Dict) -> List[Dict]:
+    """Pares fato.coluna -> dimensão.coluna: chaves estrangeiras ou, sem elas, a chave primária de outra tabela"""
+    juncoes = []
+    for tabela, info in estrela.items():
+        for fk in info["fks"]:
+            if len(fk["colunas"]) == 1 and fk["tabela"] in estrela and fk["tabela"] != tabela:
+                juncoes.append({"fato": tabela, "coluna": fk["colunas"][0],
+                                "dimensao": fk["tabela"], "coluna_dimensao": fk["colunas_ref"][0], "declarada": True})
+    declaradas = {(j["fato"], j["coluna"]) for j in juncoes}
+    # Sem FK declarada: coluna com o nome da chave (primária ou com cara de id) de uma tabela menor
+    for tabela, info in estrela.items():
+        for coluna in info["colunas"]:
+            if (tabela, coluna) in declaradas or coluna in info["pk"] and len(info["pk"]) == 1:
+                continue
+            for outra, outra_info in estrela.items():
+                if outra == tabela or coluna not in outra_info["colunas"] or outra_info["linhas"] >= info["linhas"]:
+                    continue
+                if outra_info["pk"] == [coluna] or (not outra_info["pk"] and _REGEX_ID.search(coluna)):
+                    juncoes.append({"fato": tabela, "coluna": coluna, "dimensao": outra,
+                                    "coluna_dimensao": coluna, "declarada": False})
+                    break
+    return juncoes
+
+
+def _medidas(info: Dict, chaves: set) -> List[str]:
+    return [c for c, tipo in info["colunas"].items()
+            if tipo.startswith(_TIPOS_NUMERICOS) and c not in chaves and not _REGEX_ID.search(c)]
+
+
+def _coluna_data(info: Dict) -> Optional[str]:
+    return next((c for c, tipo in info["colunas"].items() if tipo.startswith(_TIPOS_DATA)), None)
+
+
+def _faixas_particao(minimo: date, maximo: date, max_particoes: int) -> List[tuple]:
+    """Faixas [início, fim) mensais ou, se passarem de max_particoes, anuais"""
+    meses = (maximo.year - minimo.year) * 12 + maximo.month - minimo.month + 1
+    faixas = []
+    if meses <= max_particoes:
+        ano, mes = minimo.year, minimo.month
+        for _ in range(meses):
+            proximo = (ano + mes // 12, mes % 12 + 1)
+            faixas.append((f"p{ano}{mes:02d}", date(ano, mes, 1), date(*proximo, 1)))
+            ano, mes = proximo
+    else:
+        for ano in range(minimo.year, maximo.year + 1):
+            faixas.append((f"p{ano}", date(ano, 1, 1), date(ano + 1, 1, 1)))
+    return faixas
+
+
+def _script_particao(cursor, tabela: str, info: Dict, coluna: str, max_particoes: int) -> Optional[Dict]:
+    """Bloco DO que troca o fato por uma tabela particionada por faixa da coluna de data (atômico)"""
+    cursor.execute(f"SELECT MIN({_aspas(coluna)})::date, MAX({_aspas(coluna)})::date FROM {_aspas(tabela)}")
+    minimo, maximo = cursor.fetchone()
+    if minimo is None:
+        return None
+    nova = _nome(tabela, "particionada")
+    comandos = [f"CREATE TABLE {_aspas(nova)} (LIKE {_aspas(tabela)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+                f"PARTITION BY RANGE ({_aspas(coluna)})"]
+    faixas = _faixas_particao(minimo, maximo, max_particoes)
+    for sufixo, inicio, fim in faixas:
+        comandos.append(f"CREATE TABLE {_aspas(_nome(tabela, sufixo))} PARTITION OF {_aspas(nova)} "
+                        f"FOR VALUES FROM ('{inicio.isoformat()}') TO ('{fim.isoformat()}')")
+    comandos.append(f"CREATE TABLE {_aspas(_nome(tabela, 'pdefault'))} PARTITION OF {_aspas(nova)} DEFAULT")
+    comandos.append(f"INSERT INTO {_aspas(nova)} SELECT * FROM {_aspas(tabela)}")
+    comandos.append(f"DROP TABLE {_aspas(tabela)}")
+    comandos.append(f"ALTER TABLE {_aspas(nova)} RENAME TO {_aspas(tabela)}")
+    if info["pk"]:
+        # A chave primária de uma tabela particionada precisa conter a coluna da partição
+        pk = info["pk"] + ([coluna] if coluna not in info["pk"] else [])
+        comandos.append(f"ALTER TABLE {_aspas(tabela)} ADD PRIMARY KEY ({', '.join(map(_aspas, pk))})")
+    for fk in info["fks"]:
+        comandos.append(f"ALTER TABLE {_aspas(tabela)} ADD CONSTRAINT {_aspas(fk['nome'])} {fk['definicao']}")
+    return {
+        "tabela": tabela,
+        "coluna": coluna,
+        "particoes": len(faixas) + 1,
+        "sql": "DO $particao$ BEGIN\n" + ";\n".join(comandos) + ";\nEND $particao$",
+    }
+
+
+def planejar_desenho(cursor, estrela: Dict, opcoes: Dict) -> Dict:
+    """Comandos do desenho físico (partições, índices, visões, ANALYZE) e consultas de amostra"""
+    tabelas = estrela["tabelas"]
+    plano = {"particoes": [], "indices": [], "visoes": [], "analisar": list(tabelas), "consultas": []}
+    chaves = {}
+    for juncao in estrela["juncoes"]:
+        chaves.setdefault(juncao["fato"], set()).add(juncao["coluna"])
+        chaves.setdefault(juncao["dimensao"], set()).add(juncao["coluna_dimensao"])
+
+    if opcoes.get("particionar", False):
+        for fato in estrela["fatos"]:
+            info, coluna = tabelas[fato], _coluna_data(tabelas[fato])
+            if (coluna and not info["particionada"] and not info["referenciada_por"]
+                    and info["linhas"] >= opcoes.get("particao_min_linhas", 1_000_000)):
+                particao = _script_particao(cursor, fato, info, coluna, opcoes.get("max_particoes", 48))
+                if particao:
+                    plano["particoes"].append(particao)
+    particionadas = {p["tabela"]: p["coluna"] for p in plano["particoes"]}
+
+    if opcoes.get("indices", True):
+        alvos = []
+        for juncao in estrela["juncoes"]:
+            alvos += [(juncao["fato"], juncao["coluna"]), (juncao["dimensao"], juncao["coluna_dimensao"])]
+        for fato in estrela["fatos"]:
+            coluna = _coluna_data(tabelas[fato])
+            if coluna and fato not in particionadas:
+                alvos.append((fato, coluna))  # filtros por período
+        for tabela, coluna in dict.fromkeys(alvos):
+            # O fato particionado é uma tabela nova: dos índices antigos só volta o da chave primária
+            pk = tabelas[tabela]["pk"]
+            indexadas = set(pk[:1]) if tabela in particionadas else tabelas[tabela]["indexadas"]
+            if coluna in indexadas:
+                continue
+            nome = _nome("ix", tabela, coluna)
+            plano["indices"].append({"tabela": tabela, "coluna": coluna, "nome": nome,
+                                     "sql": f"CREATE INDEX IF NOT EXISTS {_aspas(nome)} "
+                                            f"ON {_aspas(tabela)} ({_aspas(coluna)})"})
+
+    if opcoes.get("visoes_materializadas", True):
+        for fato in estrela["fatos"]:
+            info = tabelas[fato]
+            medidas = _medidas(info, chaves.get(fato, set()) | set(info["pk"]))
+            agregados = ", ".join(["COUNT(*) AS total_linhas"]
+                                  + [f"SUM({_aspas(m)}) AS {_aspas(_nome('soma', m))}" for m in medidas])
+            agrupamentos = [(j["coluna"], _aspas(j["coluna"]))
+                            for j in estrela["juncoes"] if j["fato"] == fato]
+            coluna = _coluna_data(info)
+            if coluna:
+                agrupamentos.append(("mes", f"date_trunc('month', {_aspas(coluna)})::date AS mes"))
+            for rotulo, expressao in agrupamentos:
+                if len(plano["visoes"]) >= opcoes.get("max_visoes", 6):
+                    break
+                nome = _nome("mv", fato, "por", rotulo)
+                consulta = f"SELECT {expressao}, {agregados} FROM {_aspas(fato)} GROUP BY 1"
+                plano["visoes"].append({"tabela": fato, "nome": nome, "agrupamento": rotulo, "consulta": consulta,
+                                        "remover": f"DROP MATERIALIZED VIEW IF EXISTS {_aspas(nome)}",
+                                        "sql": f"CREATE MATERIALIZED VIEW {_aspas(nome)} AS {consulta}",
+                                        "comentario": f"COMMENT ON MATERIALIZED VIEW {_aspas(nome)} "
+                                                      f"IS '{MARCA_VISAO}:{fato.replace(chr(39), chr(39) * 2)}'"})
+                plano["consultas"].append({"nome": f"{fato} agrupado por {rotulo}", "sql": consulta,
+                                           "otimizada": f"SELECT * FROM {_aspas(nome)}", "visao": nome})
+        plano["analisar"] += [v["nome"] for v in plano["visoes"]]
+
+    for indice in plano["indices"]:
+        if indice["tabela"] not in estrela["fatos"]:
+            continue
+        tabela, coluna = _aspas(indice["tabela"]), _aspas(indice["coluna"])
+        if tabelas[indice["tabela"]]["colunas"][indice["coluna"]].startswith(_TIPOS_DATA):
+            filtro = f"{coluna} >= (SELECT MAX({coluna}) FROM {tabela}) - INTERVAL '30 days'"
+        else:
+            filtro = f"{coluna} = (SELECT {coluna} FROM {tabela} WHERE {coluna} IS NOT NULL LIMIT 1)"
+        plano["consultas"].append({"nome": f"{indice['tabela']} filtrado por {indice['coluna']}",
+                                   "sql": f"SELECT COUNT(*) FROM {tabela} WHERE {filtro}"})
+    for tabela, coluna in particionadas.items():
+        coluna = _aspas(coluna)
+        plano["consultas"].append({
+            "nome": f"{tabela} no último mês (partições)",
+            "sql": f"SELECT COUNT(*) FROM {_aspas(tabela)} "
+                   f"WHERE {coluna} >= date_trunc('month', (SELECT MAX({coluna}) FROM {_aspas(tabela)}))",
+        })
+    return plano
+
+
+def comandos_plano(plano: Dict) -> List[str]:
+    """Ordem de execução: partições (reescrevem os fatos), índices, visões e, por último, ANALYZE"""
+    visoes = [comando for v in plano["visoes"] for comando in (v["remover"], v["sql"], v["comentario"])]
+    return ([p["sql"] for p in plano["particoes"]] + [i["sql"] for i in plano["indices"]]
+            + visoes + [f"ANALYZE {_aspas(t)}" for t in plano["analisar"]])
+
+
+def visoes_registradas(cursor) -> Dict[str, str]:
+    """Visões materializadas criadas pelo desenho físico: {visão: fato de origem}"""
+    cursor.execute("""
+        SELECT c.relname, obj_description(c.oid, 'pg_class')
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = current_schema() AND c.relkind = 'm'
+          AND obj_description(c.oid, 'pg_class') LIKE %s
+    """, (f"{MARCA_VISAO}:%",))
+    return {visao: comentario.split(":", 1)[1] for visao, comentario in cursor.fetchall()}
+
+
+def comandos_remover_visoes(visoes: Dict[str, str]) -> List[str]:
+    return [f"DROP MATERIALIZED VIEW IF EXISTS {_aspas(visao)}" for visao in visoes]
+
+
+def comandos_atualizar_visoes(visoes: Dict[str, str], tabelas: set) -> List[str]:
+    """REFRESH das visões cujo fato está entre as tabelas alteradas"""
+    return [f"REFRESH MATERIALIZED VIEW {_aspas(visao)}" for visao, fato in visoes.items() if fato in tabelas]
+
+
+def medir_consultas(cursor, consultas: List[Dict], repeticoes: int = 3, otimizada: bool = False) -> List[Dict]:
+    """Melhor tempo (ms) de cada consulta em repeticoes execuções; falha de uma não afeta as outras"""
+    medicoes = []
+    for consulta in consultas:
+        sql = consulta.get("otimizada", consulta["sql"]) if otimizada else consulta["sql"]
+        cursor.execute("SAVEPOINT medicao")
+        try:
+            tempos = []
+            for _ in range(max(1, repeticoes)):
+                inicio = time.perf_counter()
+                cursor.execute(sql)
+                cursor.fetchall()
+                tempos.append((time.perf_counter() - inicio) * 1000)
+            cursor.execute("RELEASE SAVEPOINT medicao")
+            medicoes.append({"nome": consulta["nome"], "ms": round(min(tempos), 2)})
+        except Exception as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT medicao")
+            medicoes.append({"nome": consulta["nome"], "erro": str(e).strip().splitlines()[0]})
+    return medicoes
+
+
+def formatar_desenho(resultado: Dict) -> str:
+    """Relatório em Markdown do que foi criado e do ganho medido nas consultas de amostra"""
+    if "erro" in resultado:
+        return f"❌ Desenho físico não aplicado: {resultado['erro']}"
+    estrela, plano = resultado["estrela"], resultado["plano"]
+    if not estrela["fatos"]:
+        return "Nenhuma tabela fato identificada (sem chaves estrangeiras nem colunas de junção): nada a otimizar."
+    falhas = resultado["falhas"]
+
+    def estado(sql: str) -> str:
+        return f" ❌ {falhas[sql]}" if sql in falhas else ""
+
+    linhas = []
+    for fato in estrela["fatos"]:
+        dimensoes = sorted({j["dimensao"] for j in estrela["juncoes"] if j["fato"] == fato})
+        linhas.append(f"- Fato `{fato}` ({estrela['tabelas'][fato]['linhas']} linhas) → "
+                      f"{', '.join(f'`{d}`' for d in dimensoes)}")
+    for particao in plano["particoes"]:
+        linhas.append(f"- Partição: `{particao['tabela']}` por faixa de `{particao['coluna']}` "
+                      f"({particao['particoes']} partições){estado(particao['sql'])}")
+    for indice in plano["indices"]:
+        linhas.append(f"- Índice `{indice['nome']}` em `{indice['tabela']}` ({indice['coluna']}){estado(indice['sql'])}")
+    for visao in plano["visoes"]:
+        linhas.append(f"- Visão materializada `{visao['nome']}` ({visao['tabela']} por {visao['agrupamento']})"
+                      f"{estado(visao['sql'])}")
+    linhas.append(f"- ANALYZE: {len(plano['analisar'])} tabelas/visões")
+
+    if resultado["medicoes"]:
+        linhas += ["", "| Consulta | Antes (ms) | Depois (ms) | Ganho |", "|---|---|---|---|"]
+        for antes, depois in resultado["medicoes"]:
+            if "erro" in antes or "erro" in depois:
+                linhas.append(f"| {antes['nome']} | {antes.get('ms', '-')} | {depois.get('ms', '-')} | "
+                              f"❌ {antes.get('erro') or depois.get('erro')} |")
+                continue
+            ganho = f"{antes['ms'] / depois['ms']:.1f}x" if depois["ms"] else "-"
+            linhas.append(f"| {antes['nome']} | {antes['ms']} | {depois['ms']} | {ganho} |")
+    linhas.append(f"\nTempo total do desenho físico: {resultado['segundos']}s")
+    return "\n".join(linhas)
@@ -0,0 +1,130 @@
+"""Gráficos agregados primeiro para a visualização do agente de BI.
+
+Escolhe o tipo de gráfico pelo volume de dados: dispersão só para poucos
+pontos, densidade 2D (histograma bidimensional) para muitos pontos e LTTB
+(Largest-Triangle-Three-Buckets) para séries ordenadas. Histogramas e
+contagens são calculados de forma vetorizada; o desenho recebe apenas os
+dados já agregados e devolve a figura em PNG, pronta para cache.
+"""
+import io
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+from matplotlib.figure import Figure
+
+
+def escolher_grafico(colunas_numericas: List[str], primeira_coluna: str, total_linhas: int,
+                     x_ordenado: bool = False, limite_pontos: int = 20000, bins: int = 10,
+                     grade: int = 60, pontos_saida: int = 2000) -> Dict:
+    """Especificação do gráfico (tipo, colunas e parâmetros) a partir do perfil dos dados"""
+    if len(colunas_numericas) >= 2:
+        x, y = colunas_numericas[0], colunas_numericas[1]
+        if total_linhas <= limite_pontos:
+            return {"tipo": "dispersao", "x": x, "y": y}
+        if x_ordenado:
+            return {"tipo": "linha_lttb", "x": x, "y": y, "pontos": pontos_saida}
+        return {"tipo": "densidade", "x": x, "y": y, "grade": grade}
+    if len(colunas_numericas) == 1:
+        return {"tipo": "histograma", "x": colunas_numericas[0], "bins": bins}
+    return {"tipo": "barras", "x": primeira_coluna, "top": 8}
+
+
+def colunas_do_grafico(spec: Dict) -> List[str]:
+    """Colunas necessárias para o gráfico (para leitura com projeção de colunas)"""
+    return [spec[c] for c in ("x", "y") if c in spec]
+
+
+def lttb(x: np.ndarray, y: np.ndarray, pontos_saida: int):
+    """Reduz uma série ordenada para pontos_saida pontos preservando o formato visual"""
+    n = len(x)
+    if pontos_saida >= n or pontos_saida < 3:
+        return x, y
+
+    tamanho_balde = (n - 2) / (pontos_saida - 2)
+    indices = np.empty(pontos_saida, dtype=np.int64)
+    indices[0] = 0
+    anterior = 0
+    for i in range(pontos_saida - 2):
+        inicio = int(i * tamanho_balde) + 1
+        fim = int((i + 1) * tamanho_balde) + 1
+        fim_proximo = min(int((i + 2) * tamanho_balde) + 1, n)
+        media_x = x[fim:fim_proximo].mean()
+        media_y = y[fim:fim_proximo].mean()
+        areas = np.abs(
+            (x[anterior] - media_x) * (y[inicio:fim] - y[anterior])
+            - (x[anterior] - x[inicio:fim]) * (media_y - y[anterior])
+        )
+        anterior = inicio + int(np.argmax(areas))
+        indices[i + 1] = anterior
+    indices[-1] = n - 1
+    return x[indices], y[indices]
+
+
+def preparar_dados(df: pd.DataFrame, spec: Dict) -> Dict:
+    """Agrega os dados do DataFrame conforme a especificação (tudo vetorizado)"""
+    tipo = spec["tipo"]
+    if tipo == "barras":
+        contagem = df[spec["x"]].value_counts().head(spec["top"])
+        return {"rotulos": [str(r) for r in contagem.index], "valores": contagem.to_numpy()}
+
+    if tipo == "histograma":
+        valores = df[spec["x"]].dropna().to_numpy(dtype=np.float64)
+        contagens, bordas = np.histogram(valores, bins=spec["bins"])
+        return {"contagens": contagens, "bordas": bordas}
+
+    pares = df[[spec["x"], spec["y"]]].dropna()
+    x = pares[spec["x"]].to_numpy(dtype=np.float64)
+    y = pares[spec["y"]].to_numpy(dtype=np.float64)
+    if tipo == "densidade":
+        contagens, bordas_x, bordas_y = np.histogram2d(x, y, bins=spec["grade"])
+        return {"contagens": contagens, "bordas_x": bordas_x, "bordas_y": bordas_y, "pontos": len(x)}
+    if tipo == "linha_lttb":
+        x_red, y_red = lttb(x, y, spec["pontos"])
+        return {"x": x_red, "y": y_red, "pontos": len(x)}
+    return {"x": x, "y": y}
+
+
+def desenhar_png(spec: Dict, dados: Dict) -> bytes:
+    """Desenha o gráfico a partir dos dados agregados e devolve o PNG"""
+    # Figure sem pyplot: sem estado global, seguro entre sessões do Streamlit
+    fig = Figure(figsize=(8, 4))
+    ax = fig.subplots()
+    tipo = spec["tipo"]
+
+    if tipo == "dispersao":
+        ax.scatter(dados["x"], dados["y"])
+        ax.set_xlabel(spec["x"])
+        ax.set_ylabel(spec["y"])
+        ax.set_title(f'{spec["x"]} vs {spec["y"]}')
+
+    elif tipo == "linha_lttb":
+        ax.plot(dados["x"], dados["y"], linewidth=1)
+        ax.set_xlabel(spec["x"])
+        ax.set_ylabel(spec["y"])
+        ax.set_title(f'{spec["x"]} vs {spec["y"]} ({len(dados["x"])} de {dados["pontos"]} pontos, LTTB)')
+
+    elif tipo == "densidade":
+        contagens = np.ma.masked_equal(dados["contagens"].T, 0)
+        malha = ax.pcolormesh(dados["bordas_x"], dados["bordas_y"], contagens, cmap="viridis")
+        fig.colorbar(malha, ax=ax, label="Contagem")
+        ax.set_xlabel(spec["x"])
+        ax.set_ylabel(spec["y"])
+        ax.set_title(f'Densidade {spec["x"]} vs {spec["y"]} ({dados["pontos"]} pontos)')
+
+    elif tipo == "histograma":
+        ax.stairs(dados["contagens"], dados["bordas"], fill=True)
+        ax.set_xlabel(spec["x"])
+        ax.set_ylabel('Frequência')
+        ax.set_title(f'Distribuição de {spec["x"]}')
+
+    else:
+        ax.bar(dados["rotulos"], dados["valores"])
+        ax.set_xlabel(spec["x"])
+        ax.set_ylabel('Contagem')
+        ax.set_title(f'Top - {spec["x"]}')
+        ax.tick_params(axis="x", labelrotation=45)
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", bbox_inches="tight")
+    return buffer.getvalue()
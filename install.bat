@@ -25,7 +25,7 @@ ollama pull llama3.1:8b
 @REM cd ..
 
 echo 🔹 Etapa 5/5: Instalando dependencias Python...
-pip install pandas sqlalchemy psycopg2-binary matplotlib streamlit ollama
+pip install pandas sqlalchemy psycopg2-binary matplotlib streamlit ollama httpx pyarrow
 
 echo.
 echo ✅ Instalacao concluida! 
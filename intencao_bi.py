@@ -0,0 +1,132 @@
+"""Classificador local de intenção (sem LLM) para o agente de BI.
+
+Naive Bayes multinomial sobre palavras e bigramas, treinado com a tabela de
+palavras-chave do fallback e com os exemplos rotulados de dados_intencao/.
+Responde em microssegundos; o agente só consulta o LLM quando a confiança
+fica abaixo do limiar configurado.
+"""
+import json
+import math
+import os
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, List, Tuple
+
+PASTA_DADOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dados_intencao")
+
+# Tabela de palavras-chave (ordem importa: a primeira categoria encontrada vence)
+PALAVRAS_CHAVE_INTENCAO = [
+    ("analise_exploratoria", ['coluna', 'estrutura', 'amostra', 'analise', 'exploratória'], 0.8, "Análise exploratória detectada"),
+    ("criar_dw", ['dw', 'data warehouse', 'modelo', 'etl', 'carregar'], 0.9, "Criação de DW detectada"),
+    ("consultas_sql", ['select', 'query', 'consultar', 'filtrar', 'agrupar'], 0.85, "Consulta SQL detectada"),
+    ("ddl_operations", ['create', 'alter', 'drop', 'tabela', 'índice'], 0.9, "Operação DDL detectada"),
+    ("dml_operations", ['insert', 'update', 'delete', 'atualizar', 'incluir'], 0.9, "Operação DML detectada"),
+    ("visualizacao", ['gráfico', 'grafico', 'visualizar', 'dashboard', 'chart'], 0.8, "Visualização detectada"),
+    ("relatorios", ['relatório', 'relatorio', 'report', 'análise', 'analise'], 0.8, "Relatório detectado"),
+]
+
+DETALHES_INTENCAO = {acao: detalhes for acao, _, _, detalhes in PALAVRAS_CHAVE_INTENCAO}
+DETALHES_INTENCAO["processo_padrao"] = "Intenção não clara, usando processo padrão"
+
+# Peso de cada palavra-chave da tabela no treino (equivale a N exemplos)
+_PESO_PALAVRA_CHAVE = 3
+
+_MODELO = None
+
+
+def classificar_por_palavras_chave(pergunta: str) -> Dict:
+    """Classificação por palavras-chave (comportamento original do fallback)"""
+    pergunta = pergunta.lower()
+    for acao, palavras, confianca, detalhes in PALAVRAS_CHAVE_INTENCAO:
+        if any(palavra in pergunta for palavra in palavras):
+            return {"acao_principal": acao, "confianca": confianca, "detalhes": detalhes}
+    return {"acao_principal": "processo_padrao", "confianca": 0.6, "detalhes": DETALHES_INTENCAO["processo_padrao"]}
+
+
+def _normalizar(texto: str) -> str:
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+
+def extrair_termos(texto: str) -> List[str]:
+    """Palavras e bigramas normalizados (minúsculas, sem acentos)"""
+    palavras = re.findall(r"\w+", _normalizar(texto))
+    return palavras + [f"{a}_{b}" for a, b in zip(palavras, palavras[1:])]
+
+
+def carregar_exemplos(nome_arquivo: str) -> List[Tuple[str, str]]:
+    """Lê um arquivo JSONL com {"pergunta": ..., "acao": ...} por linha"""
+    exemplos = []
+    with open(os.path.join(PASTA_DADOS, nome_arquivo), encoding="utf-8") as arquivo:
+        for linha in arquivo:
+            if linha.strip():
+                registro = json.loads(linha)
+                exemplos.append((registro["pergunta"], registro["acao"]))
+    return exemplos
+
+
+def treinar_classificador(exemplos: List[Tuple[str, str]]) -> Dict:
+    """Treina o Naive Bayes a partir dos exemplos e da tabela de palavras-chave"""
+    contagens = defaultdict(Counter)
+    documentos = Counter()
+
+    for acao, palavras, _, _ in PALAVRAS_CHAVE_INTENCAO:
+        for palavra in palavras:
+            for termo in extrair_termos(palavra):
+                contagens[acao][termo] += _PESO_PALAVRA_CHAVE
+        documentos[acao] += 1
+
+    for pergunta, acao in exemplos:
+        contagens[acao].update(extrair_termos(pergunta))
+        documentos[acao] += 1
+
+    vocabulario = set()
+    for termos in contagens.values():
+        vocabulario.update(termos)
+
+    total_documentos = sum(documentos.values())
+    modelo = {"vocabulario": vocabulario, "classes": {}}
+    for acao, termos in contagens.items():
+        total_termos = sum(termos.values())
+        denominador = total_termos + len(vocabulario)
+        modelo["classes"][acao] = {
+            "log_prior": math.log(documentos[acao] / total_documentos),
+            "log_prob": {termo: math.log((n + 1) / denominador) for termo, n in termos.items()},
+            "log_prob_ausente": math.log(1 / denominador),
+        }
+    return modelo
+
+
+def obter_classificador() -> Dict:
+    """Modelo treinado uma única vez por processo"""
+    global _MODELO
+    if _MODELO is None:
+        _MODELO = treinar_classificador(carregar_exemplos("treino.jsonl"))
+    return _MODELO
+
+
+def classificar_intencao_local(pergunta: str, modelo: Dict = None) -> Dict:
+    """Classifica a intenção sem LLM; confiança é a probabilidade a posteriori"""
+    modelo = modelo or obter_classificador()
+    termos = [t for t in extrair_termos(pergunta) if t in modelo["vocabulario"]]
+    if not termos:
+        return {"acao_principal": "processo_padrao", "confianca": 0.0,
+                "detalhes": "Nenhum termo conhecido na pergunta", "origem": "local"}
+
+    pontuacoes = {}
+    for acao, classe in modelo["classes"].items():
+        log_prob = classe["log_prob"]
+        ausente = classe["log_prob_ausente"]
+        pontuacoes[acao] = classe["log_prior"] + sum(log_prob.get(t, ausente) for t in termos)
+
+    maximo = max(pontuacoes.values())
+    exponenciais = {acao: math.exp(p - maximo) for acao, p in pontuacoes.items()}
+    soma = sum(exponenciais.values())
+    acao = max(exponenciais, key=exponenciais.get)
+    return {
+        "acao_principal": acao,
+        "confianca": round(exponenciais[acao] / soma, 3),
+        "detalhes": DETALHES_INTENCAO.get(acao, acao),
+        "origem": "local",
+    }
@@ -0,0 +1,375 @@
+"""Fila de análises em segundo plano, fora do processo do Streamlit.
+
+submeter_analise grava o job em SQLite e o põe na fila de um pool fixo de
+processos (spawn); cada worker roda orquestrar_acao e grava o progresso (um
+evento por etapa terminada, vindo dos spans de rastreio_bi) e o resultado no
+mesmo SQLite. A interface só consulta o SQLite, então um rerun ou uma
+reconexão do navegador reencontra o job pelo id.
+
+Semáforos entre processos limitam as chamadas simultâneas ao Ollama ("llm")
+e as conexões ao PostgreSQL ("banco") somando todos os workers; agent_bi os
+usa via limite_recurso, que fora de um worker não limita nada. Cancelar um job
+na fila o descarta; em andamento, a próxima chamada ao LLM ou ao banco levanta
+JobCancelado e, passado o prazo de espera, o worker é encerrado à força e
+substituído (as vagas que ele segurava nos semáforos são devolvidas).
+"""
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing, contextmanager
+from typing import Dict, Iterator, List
+
+from uploads_bi import dados_upload, eh_upload, registrar_upload
+
+_CONFIG = {
+    "workers": 2,
+    "limites": {"llm": 2, "banco": 4},
+    "arquivo": ".cache_bi/jobs.sqlite",
+    "cancelamento_espera_s": 10,
+    "retencao_horas": 72,
+}
+_LOCK = threading.Lock()
+_FILA = {"fila": None, "workers": [], "eventos_cancelar": [], "retidos": [], "semaforos": {}, "monitor": None,
+         "configurada": False}
+
+# Estado do lado do worker (vazio no processo do Streamlit)
+_LIMITES = {"semaforos": {}, "retidos": None, "cancelar": None, "ordem": []}
+_LIMITES_LOCAL = threading.local()
+_LIMITES_LOCK = threading.Lock()
+
+# Etapas que viram evento de progresso (os spans "sql" são um por comando: ficam só no rastreio)
+_SPANS_PROGRESSO = ("contexto_csv", "intencao", "acao:", "perfil_csv", "carga_csv", "llm", "grafico")
+
+
+class JobCancelado(BaseException):
+    """Cancelamento pedido pela interface; BaseException (como asyncio.CancelledError) para atravessar
+    os `except Exception` que transformam falhas em mensagens de erro"""
+
+
+# --- Persistência (SQLite) ---
+def _conexao() -> sqlite3.Connection:
+    caminho = _CONFIG["arquivo"]
+    os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+    conn = sqlite3.connect(caminho, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            pergunta TEXT,
+            arquivos TEXT,
+            modelo TEXT,
+            estado TEXT,
+            dono INTEGER,
+            worker INTEGER,
+            criado_em REAL,
+            iniciado_em REAL,
+            cancelado_em REAL,
+            concluido_em REAL,
+            resultado TEXT,
+            erro TEXT
+        )
+    """)
+    conn.execute("CREATE TABLE IF NOT EXISTS eventos (job TEXT, instante REAL, etapa TEXT, mensagem TEXT)")
+    conn.execute("CREATE INDEX IF NOT EXISTS eventos_job ON eventos (job, instante)")
+    return conn
+
+
+def _registrar_evento(job_id: str, etapa: str, mensagem: str):
+    try:
+        with closing(_conexao()) as conn, conn:
+            conn.execute("INSERT INTO eventos VALUES (?, ?, ?, ?)", (job_id, time.time(), etapa, mensagem))
+    except sqlite3.Error:
+        pass  # progresso é informativo: não derruba a análise
+
+
+def _processo_vivo(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _limpar_antigos(conn: sqlite3.Connection):
+    """Apaga jobs vencidos e marca como interrompidos os de um processo do Streamlit que já terminou"""
+    limite = time.time() - _CONFIG["retencao_horas"] * 3600
+    conn.execute("DELETE FROM eventos WHERE job IN (SELECT id FROM jobs WHERE criado_em < ?)", (limite,))
+    conn.execute("DELETE FROM jobs WHERE criado_em < ?", (limite,))
+    donos = [d for (d,) in conn.execute(
+        "SELECT DISTINCT dono FROM jobs WHERE estado IN ('na fila', 'em andamento', 'cancelando')")]
+    for dono in donos:
+        if dono != os.getpid() and not _processo_vivo(dono):
+            conn.execute("UPDATE jobs SET estado = 'interrompido', concluido_em = ? WHERE dono = ? "
+                         "AND estado IN ('na fila', 'em andamento', 'cancelando')", (time.time(), dono))
+
+
+# --- Limites por recurso (usados por agent_bi dentro dos workers) ---
+@contextmanager
+def limite_recurso(nome: str) -> Iterator[None]:
+    """Ocupa uma vaga do recurso no pool inteiro; reentrante na mesma thread e sem efeito fora de um worker"""
+    cancelar = _LIMITES["cancelar"]
+    if cancelar is not None and cancelar.is_set():
+        raise JobCancelado()
+    semaforo = _LIMITES["semaforos"].get(nome)
+    profundidade = getattr(_LIMITES_LOCAL, nome, 0)
+    if semaforo is None or profundidade:
+        setattr(_LIMITES_LOCAL, nome, profundidade + 1)
+        try:
+            yield
+        finally:
+            setattr(_LIMITES_LOCAL, nome, profundidade)
+        return
+
+    indice = _LIMITES["ordem"].index(nome)
+    while not semaforo.acquire(timeout=0.5):
+        if cancelar.is_set():
+            raise JobCancelado()
+    with _LIMITES_LOCK:
+        _LIMITES["retidos"][indice] += 1
+    setattr(_LIMITES_LOCAL, nome, 1)
+    try:
+        yield
+    finally:
+        setattr(_LIMITES_LOCAL, nome, 0)
+        with _LIMITES_LOCK:
+            _LIMITES["retidos"][indice] -= 1
+        semaforo.release()
+
+
+# --- Worker ---
+def _observador_progresso(job_id: str):
+    def observar(registro: Dict):
+        nome = registro["nome"]
+        if not nome.startswith(_SPANS_PROGRESSO):
+            return
+        atributos = registro["atributos"]
+        detalhe = f" ({atributos['modelo']})" if nome == "llm" and atributos.get("modelo") else ""
+        estado = f"falhou: {registro['erro']}" if "erro" in registro else "concluída"
+        _registrar_evento(job_id, nome, f"{nome}{detalhe} {estado} em {registro['ms']:.0f} ms")
+    return observar
+
+
+def _executar_job(job: Dict, indice: int):
+    from agent_bi import orquestrar_acao
+    from rastreio_bi import registrar_observador, remover_observador
+    from roteador_bi import preferencia_modelo
+
+    _LIMITES["cancelar"].clear()
+    with closing(_conexao()) as conn, conn:
+        iniciado = conn.execute(
+            "UPDATE jobs SET estado = 'em andamento', worker = ?, iniciado_em = ? WHERE id = ? AND estado = 'na fila'",
+            (indice, time.time(), job["id"])).rowcount
+    if not iniciado:
+        return  # cancelado enquanto esperava na fila
+
+    _registrar_evento(job["id"], "inicio", f"▶️ Iniciado no worker {indice}")
+    observar = registrar_observador(_observador_progresso(job["id"]))
+    resultado, erro = None, None
+    try:
+        caminhos = [registrar_upload(dados, os.path.basename(caminho)) if dados is not None else caminho
+                    for caminho, dados in job["fontes"]]
+        with preferencia_modelo(job["modelo"]):
+            resultado = orquestrar_acao(job["pergunta"], caminhos)
+    except JobCancelado:
+        pass
+    except Exception as e:
+        erro = f"{type(e).__name__}: {e}"
+    finally:
+        remover_observador(observar)
+
+    with closing(_conexao()) as conn, conn:
+        conn.execute("""
+            UPDATE jobs SET
+                estado = CASE WHEN estado = 'cancelando' THEN 'cancelado'
+                              WHEN ? IS NULL THEN 'concluído' ELSE 'erro' END,
+                resultado = CASE WHEN estado = 'cancelando' THEN NULL ELSE ? END,
+                erro = ?, concluido_em = ?
+            WHERE id = ?
+        """, (erro, resultado, erro, time.time(), job["id"]))
+    _registrar_evento(job["id"], "fim", "⏹️ Encerrado")
+
+
+def _laco_worker(indice: int, fila, config: Dict, semaforos: Dict, retidos, cancelar):
+    _CONFIG.update(config)
+    _LIMITES.update({"semaforos": semaforos, "retidos": retidos, "cancelar": cancelar, "ordem": list(semaforos)})
+    while True:
+        job = fila.get()
+        if job is None:
+            return
+        try:
+            _executar_job(job, indice)
+        except Exception:
+            pass  # falha ao gravar no SQLite: o worker continua atendendo a fila
+
+
+# --- Pool (processo do Streamlit) ---
+def _iniciar_worker(indice: int):
+    contexto = multiprocessing.get_context("spawn")
+    processo = contexto.Process(
+        target=_laco_worker, name=f"job-bi-{indice}", daemon=True,
+        args=(indice, _FILA["fila"], dict(_CONFIG), _FILA["semaforos"], _FILA["retidos"][indice],
+              _FILA["eventos_cancelar"][indice]),
+    )
+    processo.start()
+    _FILA["workers"][indice] = processo
+
+
+def _devolver_vagas(indice: int):
+    """Devolve as vagas dos semáforos que um worker encerrado à força ainda segurava"""
+    retidos = _FILA["retidos"][indice]
+    for posicao, semaforo in enumerate(_FILA["semaforos"].values()):
+        for _ in range(retidos[posicao]):
+            semaforo.release()
+        retidos[posicao] = 0
+
+
+def _monitorar():
+    """Repõe workers mortos e encerra à força os que não atenderam ao cancelamento a tempo"""
+    while True:
+        time.sleep(0.5)
+        with _LOCK:
+            try:
+                with closing(_conexao()) as conn, conn:
+                    vencidos = {worker for (worker,) in conn.execute(
+                        "SELECT worker FROM jobs WHERE dono = ? AND estado = 'cancelando' AND cancelado_em < ?",
+                        (os.getpid(), time.time() - _CONFIG["cancelamento_espera_s"]))}
+                    for indice, processo in enumerate(_FILA["workers"]):
+                        if indice in vencidos and processo.is_alive():
+                            processo.terminate()
+                            processo.join(5)
+                        if processo.is_alive():
+                            continue
+                        conn.execute("""
+                            UPDATE jobs SET concluido_em = ?,
+                                estado = CASE WHEN estado = 'cancelando' THEN 'cancelado' ELSE 'erro' END,
+                                erro = CASE WHEN estado = 'cancelando' THEN NULL
+                                            ELSE 'worker encerrado inesperadamente' END
+                            WHERE dono = ? AND worker = ? AND estado IN ('em andamento', 'cancelando')
+                        """, (time.time(), os.getpid(), indice))
+                        _devolver_vagas(indice)
+                        _iniciar_worker(indice)
+            except sqlite3.Error:
+                pass
+
+
+def configurar_fila(config: Dict):
+    """Aplica a configuração e, na primeira vez no processo, limpa os jobs vencidos ou órfãos"""
+    with _LOCK:
+        _CONFIG.update(config)
+        if _FILA["configurada"]:
+            return
+        _FILA["configurada"] = True
+        try:
+            with closing(_conexao()) as conn, conn:
+                _limpar_antigos(conn)
+        except sqlite3.Error:
+            pass
+
+
+def iniciar_fila() -> bool:
+    """Cria o pool de workers, uma única vez por processo (False se já iniciado)"""
+    with _LOCK:
+        if _FILA["fila"] is not None:
+            return False
+        contexto = multiprocessing.get_context("spawn")
+        workers = max(1, _CONFIG["workers"])
+        _FILA.update({
+            "fila": contexto.Queue(),
+            "semaforos": {nome: contexto.BoundedSemaphore(n) for nome, n in _CONFIG["limites"].items()},
+            "workers": [None] * workers,
+            "eventos_cancelar": [contexto.Event() for _ in range(workers)],
+        })
+        _FILA["retidos"] = [contexto.Array("i", len(_FILA["semaforos"])) for _ in range(workers)]
+        for indice in range(workers):
+            _iniciar_worker(indice)
+        if _FILA["monitor"] is None:
+            _FILA["monitor"] = threading.Thread(target=_monitorar, name="monitor-jobs-bi", daemon=True)
+            _FILA["monitor"].start()
+        return True
+
+
+def submeter_analise(pergunta: str, caminhos_csv: List[str], modelo: str = None) -> str:
+    """Põe a análise na fila e devolve o id do job (uploads em memória vão junto, sem passar pelo disco)"""
+    iniciar_fila()
+    job_id = uuid.uuid4().hex[:16]
+    fontes = [(caminho, dados_upload(caminho) if eh_upload(caminho) else None) for caminho in caminhos_csv]
+    with closing(_conexao()) as conn, conn:
+        conn.execute(
+            "INSERT INTO jobs (id, pergunta, arquivos, modelo, estado, dono, criado_em) "
+            "VALUES (?, ?, ?, ?, 'na fila', ?, ?)",
+            (job_id, pergunta, json.dumps([os.path.basename(c) for c in caminhos_csv]), modelo,
+             os.getpid(), time.time()))
+    _registrar_evento(job_id, "fila", "🕒 Na fila")
+    _FILA["fila"].put({"id": job_id, "pergunta": pergunta, "fontes": fontes, "modelo": modelo})
+    return job_id
+
+
+def cancelar_job(job_id: str) -> bool:
+    """Cancela o job na fila ou em andamento (False se já tinha terminado)"""
+    agora = time.time()
+    with closing(_conexao()) as conn, conn:
+        if conn.execute("UPDATE jobs SET estado = 'cancelado', cancelado_em = ?, concluido_em = ? "
+                        "WHERE id = ? AND estado = 'na fila'", (agora, agora, job_id)).rowcount:
+            return True
+        linha = conn.execute("SELECT worker, dono FROM jobs WHERE id = ? AND estado = 'em andamento'",
+                             (job_id,)).fetchone()
+        if linha is None:
+            return False
+        conn.execute("UPDATE jobs SET estado = 'cancelando', cancelado_em = ? WHERE id = ?", (agora, job_id))
+    worker, dono = linha
+    if dono == os.getpid() and _FILA["eventos_cancelar"]:
+        _FILA["eventos_cancelar"][worker].set()
+    _registrar_evento(job_id, "cancelamento", "🛑 Cancelamento pedido")
+    return True
+
+
+def _job_dict(linha: sqlite3.Row) -> Dict:
+    job = dict(linha)
+    job["arquivos"] = json.loads(job["arquivos"] or "[]")
+    fim = job["concluido_em"] or time.time()
+    job["duracao_s"] = round(fim - job["iniciado_em"], 1) if job["iniciado_em"] else None
+    return job
+
+
+def consultar_job(job_id: str) -> Dict:
+    """Estado, eventos de progresso e resultado do job ({"erro": ...} se não existir)"""
+    with closing(_conexao()) as conn:
+        conn.row_factory = sqlite3.Row
+        linha = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if linha is None:
+            return {"id": job_id, "erro": "job não encontrado"}
+        eventos = conn.execute("SELECT instante, etapa, mensagem FROM eventos WHERE job = ? ORDER BY instante",
+                               (job_id,)).fetchall()
+    return {**_job_dict(linha), "eventos": [dict(e) for e in eventos]}
+
+
+def listar_jobs(limite: int = 20) -> List[Dict]:
+    """Jobs mais recentes (sem os eventos), para reencontrar uma análise depois de reconectar"""
+    with closing(_conexao()) as conn:
+        conn.row_factory = sqlite3.Row
+        linhas = conn.execute("SELECT * FROM jobs ORDER BY criado_em DESC LIMIT ?", (limite,)).fetchall()
+    return [_job_dict(linha) for linha in linhas]
+
+
+def job_terminado(job: Dict) -> bool:
+    return job.get("estado") in ("concluído", "erro", "cancelado", "interrompido") or "estado" not in job
+
+
+def encerrar_fila():
+    """Encerra os workers (a fila é recriada no próximo submeter_analise)"""
+    with _LOCK:
+        if _FILA["fila"] is None:
+            return
+        for _ in _FILA["workers"]:
+            _FILA["fila"].put(None)
+        for processo in _FILA["workers"]:
+            processo.join(5)
+            if processo.is_alive():
+                processo.terminate()
+        _FILA.update({"fila": None, "workers": [], "eventos_cancelar": [], "retidos": [], "semaforos": {}})
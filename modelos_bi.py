@@ -0,0 +1,135 @@
+"""Ciclo de vida dos modelos no Ollama: aquecimento, keep_alive e residência.
+
+Na subida do app os modelos configurados são carregados em segundo plano
+(generate com prompt vazio só carrega os pesos). Cada chamada envia o
+keep_alive do modelo: os aquecidos ficam fixados na memória; os que o
+roteador usou na janela ficam residentes só pelo tamanho da janela (saem
+sozinhos quando deixam de ser usados); os demais saem no prazo normal. O tempo
+de carga (load_duration) devolvido pelo Ollama é contabilizado separado do
+tempo de inferência, e ollama.ps() mostra o que está residente e quanto ocupa.
+"""
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List
+
+import ollama
+
+# Uma carga acima disso indica que o modelo não estava residente (carga fria)
+CARGA_FRIA_MS = 500
+
+_LOCK = threading.Lock()
+_AQUECIMENTO = {"estado": "não iniciado", "resultados": [], "thread": None}
+_USO: Dict[str, Dict] = {}
+
+
+def modelos_para_aquecer(config: Dict) -> List[str]:
+    """Modelos configurados para carga na subida (padrão: rápido e completo, sem repetir)"""
+    modelos = config.get("aquecer_modelos") or [config["modelo_rapido"], config["modelo_completo"]]
+    return list(dict.fromkeys(modelos))
+
+
+def keep_alive_modelo(modelo: str, config: Dict, em_uso: Iterable[str] = ()):
+    """keep_alive a enviar nas chamadas do modelo
+
+    Aquecidos: keep_alive_fixado. Usados pelo roteador na janela: a própria janela, renovada a cada
+    chamada; um modelo testado uma vez sai da memória quando a janela passa, sem ficar fixado.
+    """
+    if modelo in modelos_para_aquecer(config):
+        return config.get("keep_alive_fixado", "24h")
+    if modelo in em_uso:
+        return f"{int(config.get('roteamento_janela_s', 600))}s"
+    por_modelo = config.get("keep_alive", {})
+    return por_modelo.get(modelo, por_modelo.get("padrao", "5m"))
+
+
+def registrar_uso_modelo(modelo: str, metricas: Dict):
+    """Separa o tempo de carga do tempo de inferência (métricas de rastreio_bi.metricas_ollama)"""
+    if not metricas:
+        return
+    carga_ms = metricas.get("carga_modelo_ms") or 0.0
+    inferencia_ms = (metricas.get("prefill_ms") or 0.0) + (metricas.get("geracao_ms") or 0.0)
+    with _LOCK:
+        uso = _USO.setdefault(modelo, {"chamadas": 0, "cargas_frias": 0, "carga_ms": 0.0, "inferencia_ms": 0.0})
+        uso["chamadas"] += 1
+        uso["cargas_frias"] += carga_ms > CARGA_FRIA_MS
+        uso["carga_ms"] += carga_ms
+        uso["inferencia_ms"] += inferencia_ms
+
+
+def estatisticas_carga() -> Dict[str, Dict]:
+    """Por modelo: chamadas, cargas frias e tempo total de carga x inferência"""
+    with _LOCK:
+        return {
+            modelo: {
+                **{chave: round(valor, 1) if isinstance(valor, float) else valor for chave, valor in uso.items()},
+                "fracao_carga": round(uso["carga_ms"] / (uso["carga_ms"] + uso["inferencia_ms"]), 3)
+                if uso["carga_ms"] + uso["inferencia_ms"] else 0.0,
+            }
+            for modelo, uso in _USO.items()
+        }
+
+
+def modelos_residentes(cliente=None, timeout_s: float = 2.0) -> List[Dict]:
+    """Modelos carregados no servidor Ollama agora (tamanho total, na VRAM e quando expiram)
+
+    Sem cliente, usa um com timeout curto: a barra lateral chama isto a cada rerun do Streamlit.
+    """
+    try:
+        resposta = (cliente or ollama.Client(timeout=timeout_s)).ps()
+    except Exception as e:
+        return [{"erro": str(e)}]
+    residentes = []
+    agora = datetime.now(timezone.utc)
+    for modelo in resposta["models"]:
+        expira = modelo.get("expires_at")
+        residentes.append({
+            "modelo": modelo.get("model") or modelo.get("name"),
+            "tamanho_mb": round((modelo.get("size") or 0) / 1024 / 1024, 1),
+            "vram_mb": round((modelo.get("size_vram") or 0) / 1024 / 1024, 1),
+            "expira_em_min": round((expira - agora).total_seconds() / 60, 1) if isinstance(expira, datetime) else None,
+        })
+    return residentes
+
+
+def aquecer_modelos(modelos: List[str], config: Dict, cliente=None) -> List[Dict]:
+    """Carrega cada modelo (prompt vazio) com o keep_alive configurado; um por vez, para não disputar memória"""
+    cliente = cliente or ollama
+    residentes = {r.get("modelo") for r in modelos_residentes(cliente)}
+    resultados = []
+    for modelo in modelos:
+        inicio = time.perf_counter()
+        try:
+            resposta = cliente.generate(model=modelo, prompt="", keep_alive=keep_alive_modelo(modelo, config, modelos))
+            carga_ns = resposta.get("load_duration") or 0
+            resultados.append({
+                "modelo": modelo,
+                "ja_residente": modelo in residentes,
+                "carga_s": round(carga_ns / 1e9, 3),
+                "total_s": round(time.perf_counter() - inicio, 3),
+            })
+        except Exception as e:
+            resultados.append({"modelo": modelo, "erro": str(e)})
+    return resultados
+
+
+def iniciar_aquecimento(config: Dict) -> bool:
+    """Aquece os modelos em uma thread de fundo, uma única vez por processo (False se já iniciado)"""
+    with _LOCK:
+        if _AQUECIMENTO["thread"] is not None or not config.get("aquecer_na_subida", True):
+            return False
+
+        def aquecer():
+            resultados = aquecer_modelos(modelos_para_aquecer(config), config)
+            with _LOCK:
+                _AQUECIMENTO.update({"estado": "concluído", "resultados": resultados})
+
+        _AQUECIMENTO["estado"] = "em andamento"
+        _AQUECIMENTO["thread"] = threading.Thread(target=aquecer, name="aquecimento-modelos", daemon=True)
+        _AQUECIMENTO["thread"].start()
+        return True
+
+
+def estado_aquecimento() -> Dict:
+    with _LOCK:
+        return {"estado": _AQUECIMENTO["estado"], "resultados": list(_AQUECIMENTO["resultados"])}
@@ -0,0 +1,217 @@
+"""Motor SQL embutido para consultas ad-hoc sobre os CSVs enviados.
+
+Responde SELECTs direto dos arquivos, sem carregá-los no PostgreSQL. Usa o
+DuckDB quando instalado (varre o CSV sob demanda, lendo só as colunas que a
+consulta usa) e, senão, SQLite em memória (biblioteca padrão), carregando
+apenas as tabelas e colunas citadas na consulta. Arquivos que já têm cópia
+colunar no workspace (workspace_bi) são lidos do Parquet: o DuckDB aplica os
+filtros da consulta nos grupos de linhas e o SQLite lê o cabeçalho sem
+abrir o CSV.
+"""
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import closing
+from typing import Callable, Dict, Iterator, List
+
+import pandas as pd
+
+from uploads_bi import digest_upload, eh_upload, fonte_csv
+from workspace_bi import colunas_colunar
+
+# Leitor de colunas: (caminho, colunas ou None para todas) -> DataFrame
+LeitorColunas = Callable[[str, List[str]], pd.DataFrame]
+
+_REGEX_IDENTIFICADOR = re.compile(r'"((?:[^"]|"")+)"|([^\W\d]\w*)')
+_REGEX_TODAS_COLUNAS = re.compile(r"select\s+(distinct\s+)?\*|\.\*", re.IGNORECASE)
+
+
+def motor_disponivel(preferido: str = "auto") -> str:
+    """Motor embutido a usar: duckdb (se instalado) ou sqlite"""
+    if preferido in ("auto", "duckdb"):
+        try:
+            import duckdb  # noqa: F401
+            return "duckdb"
+        except ImportError:
+            pass
+    return "sqlite"
+
+
+def _identificadores(sql: str) -> set:
+    """Identificadores citados no SQL (minúsculos; aspas duplas preservam o nome)"""
+    nomes = set()
+    for entre_aspas, simples in _REGEX_IDENTIFICADOR.findall(sql):
+        nomes.add((entre_aspas.replace('""', '"') if entre_aspas else simples).lower())
+    return nomes
+
+
+def _ler_csv(caminho: str, colunas: List[str] = None) -> pd.DataFrame:
+    return pd.read_csv(fonte_csv(caminho), usecols=colunas)
+
+
+def colunas_usadas(sql: str, colunas: List[str]) -> List[str]:
+    """Colunas do arquivo citadas na consulta (todas, se houver SELECT *)"""
+    if _REGEX_TODAS_COLUNAS.search(sql):
+        return list(colunas)
+    identificadores = _identificadores(sql)
+    usadas = [c for c in colunas if str(c).lower() in identificadores]
+    # COUNT(*) sem colunas citadas: uma coluna basta para contar as linhas
+    return usadas or list(colunas[:1])
+
+
+def _lotes_cursor(cursor, tamanho_lote: int) -> Iterator[pd.DataFrame]:
+    colunas = [d[0] for d in cursor.description]
+    vazio = True
+    while True:
+        linhas = cursor.fetchmany(tamanho_lote)
+        if not linhas:
+            break
+        vazio = False
+        yield pd.DataFrame.from_records(linhas, columns=colunas)
+    if vazio:
+        yield pd.DataFrame(columns=colunas)
+
+
+# SQLite em memória compartilhado no processo: cada CSV é carregado uma vez
+# (com as colunas já pedidas) e reaproveitado pelas próximas perguntas
+_SQLITE = {"conn": None, "tabelas": OrderedDict(), "sequencia": 0}
+_SQLITE_LOCK = threading.Lock()
+
+
+def _tipo_sqlite(dtype) -> str:
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(dtype):
+        return "REAL"
+    return "TEXT"
+
+
+def _inserir_sqlite(conn: sqlite3.Connection, nome: str, df: pd.DataFrame):
+    """Cria a tabela e insere o DataFrame (executemany sobre listas nativas, mais rápido que to_sql)"""
+    colunas = ", ".join(f"{_aspas(c)} {_tipo_sqlite(t)}" for c, t in df.dtypes.items())
+    conn.execute(f"CREATE TABLE {_aspas(nome)} ({colunas})")
+    marcadores = ", ".join("?" * len(df.columns))
+    valores = [df[c].astype(str).tolist() if pd.api.types.is_datetime64_any_dtype(df[c]) else df[c].tolist()
+               for c in df.columns]
+    conn.executemany(f"INSERT INTO {_aspas(nome)} VALUES ({marcadores})", zip(*valores))
+
+
+def _aspas(nome: str) -> str:
+    return '"' + str(nome).replace('"', '""') + '"'
+
+
+def _chave_arquivo(caminho: str) -> tuple:
+    """Identifica a versão do arquivo: hash para uploads em memória, tamanho e mtime em disco"""
+    if eh_upload(caminho):
+        return ("upload", digest_upload(caminho))
+    stat = os.stat(caminho)
+    return (os.path.abspath(caminho), stat.st_size, stat.st_mtime_ns)
+
+
+def _tabela_sqlite(conn: sqlite3.Connection, caminho: str, colunas: List[str], ler_colunas: LeitorColunas,
+                   max_tabelas: int) -> str:
+    """Tabela interna com (pelo menos) as colunas pedidas do CSV, carregando só se preciso"""
+    chave = _chave_arquivo(caminho)
+    tabelas = _SQLITE["tabelas"]
+    if chave in tabelas:
+        nome, carregadas = tabelas[chave]
+        tabelas.move_to_end(chave)
+        if set(colunas) <= carregadas:
+            return nome
+        colunas = [c for c in pd.read_csv(fonte_csv(caminho), nrows=0).columns if c in carregadas or c in colunas]
+        conn.execute(f"DROP TABLE {_aspas(nome)}")
+        del tabelas[chave]
+
+    _SQLITE["sequencia"] += 1
+    nome = f"_csv_{_SQLITE['sequencia']}"
+    try:
+        _inserir_sqlite(conn, nome, ler_colunas(caminho, colunas))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        conn.execute(f"DROP TABLE IF EXISTS {_aspas(nome)}")
+        raise
+    tabelas[chave] = (nome, set(colunas))
+    while len(tabelas) > max_tabelas:
+        _, (antiga, _) = tabelas.popitem(last=False)
+        conn.execute(f"DROP TABLE {_aspas(antiga)}")
+    return nome
+
+
+def _cabecalho(caminho: str, colunares: Dict[str, str]) -> List[str]:
+    if caminho in colunares:
+        return colunas_colunar(colunares[caminho])
+    return list(pd.read_csv(fonte_csv(caminho), nrows=0).columns)
+
+
+def _lotes_sqlite(sql: str, arquivos: Dict[str, str], tamanho_lote: int, ler_colunas: LeitorColunas,
+                  max_tabelas: int, colunares: Dict[str, str]) -> Iterator[pd.DataFrame]:
+    identificadores = _identificadores(sql)
+    with _SQLITE_LOCK:
+        if _SQLITE["conn"] is None:
+            _SQLITE["conn"] = sqlite3.connect(":memory:", check_same_thread=False)
+        conn = _SQLITE["conn"]
+        visoes = []
+        try:
+            for tabela, caminho in arquivos.items():
+                if tabela.lower() not in identificadores:
+                    continue  # tabela não citada: não lê o arquivo
+                cabecalho = _cabecalho(caminho, colunares)
+                interna = _tabela_sqlite(conn, caminho, colunas_usadas(sql, cabecalho), ler_colunas, max_tabelas)
+                # A consulta enxerga o nome da tabela de consulta, que aponta para a tabela interna
+                conn.execute(f"DROP VIEW IF EXISTS temp.{_aspas(tabela)}")
+                conn.execute(f"CREATE TEMP VIEW {_aspas(tabela)} AS SELECT * FROM {_aspas(interna)}")
+                visoes.append(tabela)
+            with closing(conn.cursor()) as cursor:
+                cursor.execute(sql)
+                yield from _lotes_cursor(cursor, tamanho_lote)
+        finally:
+            for tabela in visoes:
+                conn.execute(f"DROP VIEW IF EXISTS temp.{_aspas(tabela)}")
+
+
+def limpar_motor_embutido():
+    """Descarta as tabelas carregadas no SQLite em memória"""
+    with _SQLITE_LOCK:
+        if _SQLITE["conn"] is not None:
+            _SQLITE["conn"].close()
+        _SQLITE.update({"conn": None, "tabelas": OrderedDict(), "sequencia": 0})
+
+
+def _lotes_duckdb(sql: str, arquivos: Dict[str, str], tamanho_lote: int,
+                  colunares: Dict[str, str]) -> Iterator[pd.DataFrame]:
+    import duckdb
+
+    conn = duckdb.connect()
+    try:
+        for tabela, caminho in arquivos.items():
+            if caminho in colunares:
+                # Parquet do workspace: projeção de colunas e filtros pelas estatísticas dos grupos de linhas
+                arquivo = "'" + colunares[caminho].replace("'", "''") + "'"
+                conn.execute(f"CREATE VIEW {_aspas(tabela)} AS SELECT * FROM read_parquet({arquivo})")
+                continue
+            if eh_upload(caminho):
+                # Upload em memória: o DuckDB lê o DataFrame registrado, sem arquivo em disco
+                conn.register(tabela, pd.read_csv(fonte_csv(caminho)))
+                continue
+            # View sobre o arquivo: a varredura acontece só na consulta, com projeção de colunas
+            arquivo = "'" + caminho.replace("'", "''") + "'"
+            conn.execute(f"CREATE VIEW {_aspas(tabela)} AS SELECT * FROM read_csv_auto({arquivo})")
+        cursor = conn.execute(sql)
+        yield from _lotes_cursor(cursor, tamanho_lote)
+    finally:
+        conn.close()
+
+
+def lotes_embutidos(sql: str, arquivos: Dict[str, str], tamanho_lote: int, motor: str = "auto",
+                    ler_colunas: LeitorColunas = None, max_tabelas: int = 8,
+                    colunares: Dict[str, str] = None) -> Iterator[pd.DataFrame]:
+    """Executa o SELECT sobre os CSVs ({tabela: caminho}) e devolve o resultado em lotes
+
+    colunares: {caminho do CSV: Parquet do workspace} para os arquivos já convertidos.
+    """
+    if motor_disponivel(motor) == "duckdb":
+        return _lotes_duckdb(sql, arquivos, tamanho_lote, colunares or {})
+    return _lotes_sqlite(sql, arquivos, tamanho_lote, ler_colunas or _ler_csv, max_tabelas, colunares or {})
@@ -0,0 +1,188 @@
+"""Perfil de CSV em uma única passada, com memória fixa.
+
+Lê o arquivo em blocos e acumula, por coluna: contagem exata de linhas e
+nulos, tipo inferido entre blocos, min/max/média/desvio (Welford/Chan),
+distintos aproximados (HyperLogLog) e quantis aproximados (amostra de
+reservatório de tamanho fixo).
+"""
+import math
+import os
+from typing import Dict, Iterable, List
+
+import numpy as np
+import pandas as pd
+
+# HyperLogLog com 2^14 registradores: erro padrão ~0,8%
+_HLL_BITS = 14
+_HLL_REGISTRADORES = 1 << _HLL_BITS
+
+_NOMES_TIPOS = {"b": "bool", "i": "int64", "f": "float64", "M": "datetime64[ns]", "O": "object"}
+
+
+def _tipo_bloco(serie: pd.Series) -> str:
+    """Tipo do bloco: b (bool), i (int), f (float), M (data) ou O (texto/misto)"""
+    if pd.api.types.is_bool_dtype(serie):
+        return "b"
+    if pd.api.types.is_integer_dtype(serie):
+        return "i"
+    if pd.api.types.is_float_dtype(serie):
+        return "f"
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return "M"
+    return "O"
+
+
+def _combinar_tipos(atual: str, novo: str) -> str:
+    if atual is None or atual == novo:
+        return novo
+    if {atual, novo} == {"i", "f"}:
+        return "f"
+    return "O"
+
+
+def _rho(hashes: np.ndarray) -> np.ndarray:
+    """Posição do primeiro bit 1 nos bits restantes do hash (1 = bit mais alto)"""
+    w = hashes << np.uint64(_HLL_BITS)
+    alto = (w >> np.uint64(32)).astype(np.float64)
+    baixo = (w & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    with np.errstate(divide="ignore"):
+        zeros_alto = 31 - np.floor(np.log2(alto))
+        zeros_baixo = 31 - np.floor(np.log2(baixo))
+    zeros = np.where(alto > 0, zeros_alto, np.where(baixo > 0, 32 + zeros_baixo, 64))
+    return np.minimum(zeros + 1, 64 - _HLL_BITS + 1).astype(np.uint8)
+
+
+def _atualizar_hll(registradores: np.ndarray, serie: pd.Series):
+    hashes = pd.util.hash_pandas_object(serie, index=False).to_numpy(dtype=np.uint64)
+    if len(hashes):
+        indices = (hashes >> np.uint64(64 - _HLL_BITS)).astype(np.int64)
+        np.maximum.at(registradores, indices, _rho(hashes))
+
+
+def estimar_distintos(registradores: np.ndarray) -> int:
+    """Estimativa HyperLogLog (com correção de linear counting para cardinalidades pequenas)"""
+    m = _HLL_REGISTRADORES
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimativa = alpha * m * m / np.sum(np.power(2.0, -registradores.astype(np.float64)))
+    vazios = int(np.count_nonzero(registradores == 0))
+    if estimativa <= 2.5 * m and vazios:
+        estimativa = m * math.log(m / vazios)
+    return int(round(estimativa))
+
+
+def _novo_acumulador() -> Dict:
+    return {
+        "tipo": None, "nulos": 0, "n": 0, "media": 0.0, "m2": 0.0, "min": None, "max": None,
+        "ordenada": True, "ultimo": None,
+        "hll": np.zeros(_HLL_REGISTRADORES, dtype=np.uint8),
+        "amostra": np.empty(0), "chaves": np.empty(0),
+    }
+
+
+def _acumular_numericos(acc: Dict, valores: np.ndarray, tamanho_amostra: int, rng):
+    n_b = len(valores)
+    if not n_b:
+        return
+    media_b = float(valores.mean())
+    m2_b = float(((valores - media_b) ** 2).sum())
+    n = acc["n"] + n_b
+    delta = media_b - acc["media"]
+    acc["media"] += delta * n_b / n
+    acc["m2"] += m2_b + delta * delta * acc["n"] * n_b / n
+    acc["n"] = n
+    # Ordenada = não decrescente ao longo de todo o arquivo (ex.: tempo, id)
+    if acc["ordenada"]:
+        crescente = bool(np.all(np.diff(valores) >= 0))
+        acc["ordenada"] = crescente and (acc["ultimo"] is None or valores[0] >= acc["ultimo"])
+    acc["ultimo"] = float(valores[-1])
+    minimo, maximo = float(valores.min()), float(valores.max())
+    acc["min"] = minimo if acc["min"] is None else min(acc["min"], minimo)
+    acc["max"] = maximo if acc["max"] is None else max(acc["max"], maximo)
+
+    # Reservatório: mantém os valores com as menores chaves aleatórias (amostra uniforme)
+    amostra = np.concatenate([acc["amostra"], valores])
+    chaves = np.concatenate([acc["chaves"], rng.random(n_b)])
+    if len(amostra) > tamanho_amostra:
+        manter = np.argpartition(chaves, tamanho_amostra)[:tamanho_amostra]
+        amostra, chaves = amostra[manter], chaves[manter]
+    acc["amostra"], acc["chaves"] = amostra, chaves
+
+
+def _zerar_numericos(acc: Dict):
+    acc.update({"n": 0, "media": 0.0, "m2": 0.0, "min": None, "max": None, "ordenada": False,
+                "amostra": np.empty(0), "chaves": np.empty(0)})
+
+
+def perfilar_csv(caminho: str, linhas_bloco: int = 100_000, tamanho_amostra: int = 10_000,
+                 linhas_exemplo: int = 3) -> Dict:
+    """Perfil completo do CSV (caminho ou buffer) em uma passada; formato compatível com a análise exploratória"""
+    perfil = perfilar_blocos(pd.read_csv(caminho, chunksize=linhas_bloco), tamanho_amostra, linhas_exemplo)
+    if not perfil["colunas"]:
+        if hasattr(caminho, "seek"):
+            caminho.seek(0)
+        perfil = perfilar_blocos([], tamanho_amostra, linhas_exemplo, list(pd.read_csv(caminho, nrows=0).columns))
+    perfil["arquivo"] = os.path.basename(caminho) if isinstance(caminho, str) else getattr(caminho, "name", None)
+    return perfil
+
+
+def perfilar_blocos(blocos: Iterable[pd.DataFrame], tamanho_amostra: int = 10_000, linhas_exemplo: int = 3,
+                    colunas: List[str] = None) -> Dict:
+    """Perfil a partir de blocos de DataFrame de qualquer origem (colunas: as do arquivo, se vier sem blocos)"""
+    rng = np.random.default_rng(0)
+    acumuladores = {}
+    total_linhas = 0
+    amostra_dados = None
+
+    for bloco in blocos:
+        if amostra_dados is None:
+            amostra_dados = bloco.head(linhas_exemplo).to_dict('records')
+        total_linhas += len(bloco)
+
+        for coluna in bloco.columns:
+            acc = acumuladores.setdefault(coluna, _novo_acumulador())
+            serie = bloco[coluna]
+            nulos = serie.isna()
+            acc["nulos"] += int(nulos.sum())
+            validos = serie[~nulos]
+            if validos.empty:
+                continue  # bloco só com nulos não diz nada sobre o tipo
+
+            tipo_anterior = acc["tipo"]
+            acc["tipo"] = _combinar_tipos(tipo_anterior, _tipo_bloco(serie))
+            if acc["tipo"] in ("i", "f"):
+                _acumular_numericos(acc, validos.to_numpy(dtype=np.float64), tamanho_amostra, rng)
+            elif tipo_anterior in ("i", "f"):
+                _zerar_numericos(acc)
+            _atualizar_hll(acc["hll"], validos)
+
+    if amostra_dados is None:
+        acumuladores = {coluna: _novo_acumulador() for coluna in colunas or []}
+        amostra_dados = []
+
+    estatisticas = {}
+    for coluna, acc in acumuladores.items():
+        info = {"distintos_aprox": estimar_distintos(acc["hll"])}
+        if acc["tipo"] in ("i", "f") and acc["n"]:
+            quantis = np.quantile(acc["amostra"], [0.25, 0.5, 0.75])
+            info.update({
+                "min": acc["min"],
+                "max": acc["max"],
+                "media": acc["media"],
+                "desvio": math.sqrt(acc["m2"] / (acc["n"] - 1)) if acc["n"] > 1 else 0.0,
+                "p25": float(quantis[0]),
+                "p50": float(quantis[1]),
+                "p75": float(quantis[2]),
+                "ordenada": acc["ordenada"],
+            })
+        estatisticas[coluna] = info
+
+    return {
+        "arquivo": None,
+        "colunas": list(acumuladores),
+        "tipos_dados": {c: _NOMES_TIPOS.get(acc["tipo"], "object") for c, acc in acumuladores.items()},
+        "total_linhas": total_linhas,
+        "total_colunas": len(acumuladores),
+        "valores_nulos": {c: acc["nulos"] for c, acc in acumuladores.items()},
+        "amostra_dados": amostra_dados,
+        "estatisticas": estatisticas,
+    }
@@ -0,0 +1,187 @@
+"""Rastreio por etapa do agente de BI.
+
+Cada pergunta vira um rastreio com spans cronometrados (contexto dos CSVs,
+intenção, chamadas ao LLM, SQL, cargas). O span corrente é guardado em
+contextvars, então tarefas asyncio e asyncio.to_thread herdam o pai. Spans
+terminados vão para os observadores registrados; ao fim do rastreio, todos são
+gravados em um arquivo JSONL (uma linha por span) e resumidos em memória para
+a interface.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List
+
+_RASTREIO_ATUAL = contextvars.ContextVar("rastreio_bi", default=None)
+_SPAN_ATUAL = contextvars.ContextVar("span_bi", default=None)
+_OBSERVADORES: List[Callable[[Dict], None]] = []
+_RESUMOS = deque(maxlen=20)
+_ARQUIVO_LOCK = threading.Lock()
+_CONFIG = {"ativo": True, "arquivo": ".cache_bi/rastreio.jsonl"}
+
+
+def configurar_rastreio(ativo: bool = True, arquivo: str = None, max_resumos: int = 20):
+    """Liga/desliga o rastreio e define o arquivo JSONL (None = não grava em disco)"""
+    global _RESUMOS
+    _CONFIG.update({"ativo": ativo, "arquivo": arquivo})
+    if max_resumos != _RESUMOS.maxlen:
+        _RESUMOS = deque(_RESUMOS, maxlen=max_resumos)
+
+
+def registrar_observador(funcao: Callable[[Dict], None]) -> Callable[[Dict], None]:
+    """Registra uma função chamada com cada span terminado (pode ser usada como decorador)"""
+    _OBSERVADORES.append(funcao)
+    return funcao
+
+
+def remover_observador(funcao: Callable[[Dict], None]):
+    if funcao in _OBSERVADORES:
+        _OBSERVADORES.remove(funcao)
+
+
+def _notificar(registro: Dict):
+    for funcao in list(_OBSERVADORES):
+        try:
+            funcao(registro)
+        except Exception:
+            pass  # um observador com defeito não pode derrubar a análise
+
+
+@contextmanager
+def span(nome: str, **atributos) -> Iterator[Dict]:
+    """Cronometra uma etapa; o dicionário devolvido recebe atributos extras (linhas, tokens...)"""
+    if not _CONFIG["ativo"]:
+        yield atributos
+        return
+    rastreio = _RASTREIO_ATUAL.get()
+    registro = {
+        "rastreio": rastreio["id"] if rastreio else None,
+        "span": uuid.uuid4().hex[:12],
+        "pai": _SPAN_ATUAL.get(),
+        "nome": nome,
+        "inicio": time.time(),
+        "atributos": atributos,
+    }
+    token = _SPAN_ATUAL.set(registro["span"])
+    inicio = time.perf_counter()
+    try:
+        yield atributos
+    except Exception as e:
+        registro["erro"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        registro["ms"] = round((time.perf_counter() - inicio) * 1000, 2)
+        try:
+            _SPAN_ATUAL.reset(token)
+        except ValueError:
+            _SPAN_ATUAL.set(registro["pai"])  # gerador retomado em outro contexto
+        if rastreio is not None:
+            rastreio["spans"].append(registro)
+        _notificar(registro)
+
+
+@contextmanager
+def rastreio(nome: str, **atributos) -> Iterator[Dict]:
+    """Abre um rastreio (uma pergunta); dentro de outro rastreio vira apenas um span"""
+    if not _CONFIG["ativo"] or _RASTREIO_ATUAL.get() is not None:
+        with span(nome, **atributos) as attrs:
+            yield attrs
+        return
+    atual = {"id": uuid.uuid4().hex[:16], "spans": []}
+    token = _RASTREIO_ATUAL.set(atual)
+    try:
+        with span(nome, **atributos) as attrs:
+            yield attrs
+    finally:
+        _RASTREIO_ATUAL.reset(token)
+        _RESUMOS.append(resumir_rastreio(atual["spans"]))
+        _gravar_jsonl(atual["spans"])
+
+
+def contexto_atual() -> contextvars.Context:
+    """Cópia do contexto para repassar o rastreio a threads de um ThreadPoolExecutor"""
+    return contextvars.copy_context()
+
+
+def _gravar_jsonl(spans: List[Dict]):
+    arquivo = _CONFIG["arquivo"]
+    if not arquivo or not spans:
+        return
+    try:
+        os.makedirs(os.path.dirname(arquivo) or ".", exist_ok=True)
+        linhas = "".join(json.dumps(s, ensure_ascii=False, default=str) + "\n" for s in spans)
+        with _ARQUIVO_LOCK, open(arquivo, "a", encoding="utf-8") as f:
+            f.write(linhas)
+    except OSError:
+        pass  # rastreio é diagnóstico: falha de disco não interrompe a resposta
+
+
+def metricas_ollama(resposta) -> Dict:
+    """Tokens e tempos da resposta do Ollama (durações em ns) → prefill, geração e tokens/s"""
+    def campo(nome):
+        try:
+            return resposta.get(nome)
+        except AttributeError:
+            return getattr(resposta, nome, None)
+
+    metricas = {}
+    if campo("prompt_eval_count") is not None:
+        metricas["tokens_prompt"] = campo("prompt_eval_count")
+    if campo("eval_count") is not None:
+        metricas["tokens_gerados"] = campo("eval_count")
+    for nome, chave in (("prompt_eval_duration", "prefill_ms"), ("eval_duration", "geracao_ms"),
+                        ("load_duration", "carga_modelo_ms"), ("total_duration", "total_ms")):
+        if campo(nome):
+            metricas[chave] = round(campo(nome) / 1e6, 2)
+    if metricas.get("geracao_ms") and metricas.get("tokens_gerados"):
+        metricas["tokens_por_s"] = round(metricas["tokens_gerados"] / (metricas["geracao_ms"] / 1000), 1)
+    if metricas.get("prefill_ms") and metricas.get("tokens_prompt"):
+        metricas["prefill_tokens_por_s"] = round(metricas["tokens_prompt"] / (metricas["prefill_ms"] / 1000), 1)
+    return metricas
+
+
+def resumir_rastreio(spans: List[Dict]) -> Dict:
+    """Tempo total, tempo por etapa e totais de LLM e SQL de um rastreio"""
+    raiz = next((s for s in spans if s["pai"] is None), None)
+    etapas = {}
+    llm = {"chamadas": 0, "ms": 0.0, "tokens_prompt": 0, "tokens_gerados": 0, "geracao_ms": 0.0, "prefill_ms": 0.0}
+    sql = {"comandos": 0, "ms": 0.0, "linhas": 0, "erros": 0}
+    for s in spans:
+        if raiz is not None and s["pai"] == raiz["span"]:
+            etapas[s["nome"]] = round(etapas.get(s["nome"], 0.0) + s["ms"], 2)
+        atributos = s["atributos"]
+        if s["nome"] == "llm":
+            llm["chamadas"] += 1
+            llm["ms"] += s["ms"]
+            for chave in ("tokens_prompt", "tokens_gerados", "geracao_ms", "prefill_ms"):
+                llm[chave] += atributos.get(chave) or 0
+        elif s["nome"] == "sql":
+            sql["comandos"] += 1
+            sql["ms"] += s["ms"]
+            sql["linhas"] += atributos.get("linhas") or 0
+            sql["erros"] += 1 if ("erro" in s or "erro" in atributos) else 0
+    if llm["geracao_ms"]:
+        llm["tokens_por_s"] = round(llm["tokens_gerados"] / (llm["geracao_ms"] / 1000), 1)
+    llm["ms"] = round(llm["ms"], 2)
+    sql["ms"] = round(sql["ms"], 2)
+    return {
+        "rastreio": raiz["rastreio"] if raiz else None,
+        "inicio": raiz["inicio"] if raiz else None,
+        "pergunta": raiz["atributos"].get("pergunta") if raiz else None,
+        "acao": raiz["atributos"].get("acao") if raiz else None,
+        "total_ms": raiz["ms"] if raiz else None,
+        "etapas_ms": etapas,
+        "llm": llm,
+        "sql": sql,
+        "spans": len(spans),
+    }
+
+
+def ultimos_rastreios() -> List[Dict]:
+    """Resumos dos rastreios mais recentes deste processo (mais recente primeiro)"""
+    return list(reversed(_RESUMOS))
@@ -0,0 +1,166 @@
+"""Roteamento de modelos do Ollama por tarefa, com prazos e latência medida.
+
+Tarefas leves (intenção, SQL curto, DDL/DML, resumo de um arquivo) vão para o
+modelo rápido; as pesadas (modelagem de DW, relatórios) para o modelo
+completo, ou para o modelo escolhido na interface. Cada chamada tem um prazo.
+A latência de cada modelo fica em um histograma e em uma janela recente por
+tarefa: o roteador desvia para o modelo rápido quando o modelo escolhido está
+estourando o prazo da tarefa (p90 ou timeouts recentes) ou já tem chamadas
+demais em andamento. Amostras antigas saem da janela, então o modelo volta a
+ser tentado depois de um tempo.
+"""
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+# Limites superiores (s) das faixas do histograma; a última faixa é "acima de 128 s"
+FAIXAS_HISTOGRAMA_S = (0.5, 1, 2, 4, 8, 16, 32, 64, 128)
+
+# Nível de modelo por tarefa: "rapido", "completo" ou "padrao"
+TAREFAS_PADRAO = {
+    "intencao": "rapido",
+    "consulta_sql": "rapido",
+    "ddl": "rapido",
+    "dml": "rapido",
+    "resumo_arquivo": "rapido",
+    "dw": "completo",
+    "relatorio": "completo",
+    "padrao": "padrao",
+}
+
+_PREFERIDO = contextvars.ContextVar("modelo_preferido", default=None)
+_LOCK = threading.Lock()
+_ESTATISTICAS: Dict[str, Dict] = {}
+_JANELAS: Dict[Tuple[str, str], deque] = {}
+_EM_ANDAMENTO: Dict[str, int] = {}
+
+
+@contextmanager
+def preferencia_modelo(modelo: str = None) -> Iterator[None]:
+    """Modelo escolhido pelo usuário para as tarefas que não são leves (None = automático)"""
+    token = _PREFERIDO.set(modelo)
+    try:
+        yield
+    finally:
+        _PREFERIDO.reset(token)
+
+
+def modelo_preferido() -> str:
+    return _PREFERIDO.get()
+
+
+def prazo_tarefa(tarefa: str, config: Dict) -> float:
+    """Prazo (s) de uma chamada da tarefa; sem prazo próprio, vale o timeout geral"""
+    return config.get("prazos_s", {}).get(tarefa, config.get("timeout", 120))
+
+
+def _percentil(valores: List[float], q: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(q * len(ordenados)))]
+
+
+def _chamadas_recentes(modelo: str, tarefa: str, janela_s: float) -> List[Tuple[float, bool]]:
+    """(segundos, estourou o prazo) das chamadas da tarefa dentro da janela"""
+    limite = time.time() - janela_s
+    return [(segundos, timeout) for instante, segundos, timeout in _JANELAS.get((modelo, tarefa), ())
+            if instante >= limite]
+
+
+def escolher_modelo(tarefa: str, config: Dict) -> Tuple[str, str]:
+    """(modelo, motivo) para a tarefa, considerando a preferência e a latência medida"""
+    nivel = config.get("tarefas_modelo", {}).get(tarefa) or TAREFAS_PADRAO.get(tarefa, "padrao")
+    rapido = config["modelo_rapido"]
+    preferido = _PREFERIDO.get()
+    if nivel == "rapido":
+        return rapido, "tarefa leve"
+    if preferido:
+        modelo, motivo = preferido, "escolhido na interface"
+    else:
+        modelo = config["modelo_completo"] if nivel == "completo" else config["modelo_padrao"]
+        motivo = f"tarefa {nivel}"
+    if modelo == rapido or not config.get("roteamento_adaptativo", True):
+        return modelo, motivo
+
+    prazo = prazo_tarefa(tarefa, config)
+    with _LOCK:
+        em_andamento = _EM_ANDAMENTO.get(modelo, 0)
+        recentes = _chamadas_recentes(modelo, tarefa, config.get("roteamento_janela_s", 600))
+    if em_andamento >= config.get("concorrencia_max", 2):
+        return rapido, f"{modelo} ocupado ({em_andamento} chamadas em andamento)"
+    timeouts = sum(timeout for _, timeout in recentes)
+    if timeouts >= config.get("roteamento_timeouts_max", 2):
+        return rapido, f"{modelo} estourou o prazo {timeouts} vezes recentemente"
+    latencias = [segundos for segundos, timeout in recentes if not timeout]
+    if len(latencias) >= 5 and _percentil(latencias, 0.9) > 0.8 * prazo:
+        return rapido, f"p90 de {modelo} ({_percentil(latencias, 0.9):.1f}s) perto do prazo de {prazo:g}s"
+    return modelo, motivo
+
+
+@contextmanager
+def chamada_em_andamento(modelo: str) -> Iterator[None]:
+    """Conta a chamada como em andamento (usado para detectar sobrecarga do modelo)"""
+    with _LOCK:
+        _EM_ANDAMENTO[modelo] = _EM_ANDAMENTO.get(modelo, 0) + 1
+    try:
+        yield
+    finally:
+        with _LOCK:
+            _EM_ANDAMENTO[modelo] -= 1
+
+
+def registrar_latencia(modelo: str, tarefa: str, segundos: float, status: str = "ok"):
+    """Registra uma chamada (status "ok", "timeout" ou "erro") no histograma e na janela da tarefa"""
+    with _LOCK:
+        estat = _ESTATISTICAS.setdefault(modelo, {
+            "chamadas": 0, "timeouts": 0, "erros": 0, "segundos_total": 0.0,
+            "histograma": [0] * (len(FAIXAS_HISTOGRAMA_S) + 1), "recentes": deque(maxlen=200),
+        })
+        estat["chamadas"] += 1
+        estat["timeouts"] += status == "timeout"
+        estat["erros"] += status == "erro"
+        if status == "erro":
+            return  # falha imediata (ex.: modelo inexistente) não diz nada sobre a latência
+        estat["segundos_total"] += segundos
+        faixa = next((i for i, limite in enumerate(FAIXAS_HISTOGRAMA_S) if segundos <= limite),
+                     len(FAIXAS_HISTOGRAMA_S))
+        estat["histograma"][faixa] += 1
+        estat["recentes"].append(segundos)
+        _JANELAS.setdefault((modelo, tarefa), deque(maxlen=50)).append((time.time(), segundos, status == "timeout"))
+
+
+def estatisticas_modelos() -> Dict[str, Dict]:
+    """Chamadas, timeouts, percentis recentes e histograma de latência por modelo"""
+    rotulos = [f"≤{limite:g}s" for limite in FAIXAS_HISTOGRAMA_S] + [f">{FAIXAS_HISTOGRAMA_S[-1]:g}s"]
+    with _LOCK:
+        resultado = {}
+        for modelo, estat in _ESTATISTICAS.items():
+            recentes = list(estat["recentes"])
+            medidas = estat["chamadas"] - estat["erros"]
+            resultado[modelo] = {
+                "chamadas": estat["chamadas"],
+                "timeouts": estat["timeouts"],
+                "erros": estat["erros"],
+                "em_andamento": _EM_ANDAMENTO.get(modelo, 0),
+                "media_s": round(estat["segundos_total"] / medidas, 3) if medidas else None,
+                "p50_s": round(_percentil(recentes, 0.5), 3) if recentes else None,
+                "p90_s": round(_percentil(recentes, 0.9), 3) if recentes else None,
+                "histograma": {r: n for r, n in zip(rotulos, estat["histograma"]) if n},
+            }
+        return resultado
+
+
+def modelos_em_uso(janela_s: float = 600) -> List[str]:
+    """Modelos com chamadas registradas dentro da janela (candidatos a ficar fixados na memória)"""
+    limite = time.time() - janela_s
+    with _LOCK:
+        return list(dict.fromkeys(modelo for (modelo, _), janela in _JANELAS.items()
+                                  if janela and janela[-1][0] >= limite))
+
+
+def limpar_estatisticas_modelos():
+    with _LOCK:
+        _ESTATISTICAS.clear()
+        _JANELAS.clear()
@@ -0,0 +1,22 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from perfil_bi import perfilar_csv
+from workspace_bi import converter_csv, ler_colunar, perfilar_colunar
+
+CSV = "cidade,valor,codigo\nSP,10,a\n,3,b\nRJ,,NA\nNULL,4,\nBH,5,c\n"
+
+
+def test_nulos_iguais_com_e_sem_workspace(tmp_path):
+    """Células vazias e marcadores de nulo (NA, NULL) viram nulos no Parquet, como no pandas.read_csv"""
+    caminho = tmp_path / "t.csv"
+    caminho.write_text(CSV)
+    destino = str(tmp_path / "t.parquet")
+    converter_csv(str(caminho), destino)
+
+    direto = pd.read_csv(caminho)
+    colunar = ler_colunar(destino)
+    assert colunar.isna().sum().to_dict() == direto.isna().sum().to_dict()
+    assert perfilar_colunar(destino)["valores_nulos"] == perfilar_csv(str(caminho))["valores_nulos"]
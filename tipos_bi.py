@@ -0,0 +1,168 @@
+"""Tipos compactos para os CSVs: inferência na amostra, confirmação no arquivo inteiro.
+
+A amostra decide o tipo de cada coluna (inteiro, decimal, booleano, data,
+categoria ou texto). O perfil do arquivo inteiro (perfil_bi, uma passada em
+blocos) confirma o tipo e dá o intervalo real dos inteiros, usado para
+escolher SMALLINT/INTEGER/BIGINT nas tabelas de staging. Na leitura completa,
+inteiros são reduzidos ao menor tipo exato, decimais viram float32 só quando
+isso não altera nenhum valor, textos de baixa cardinalidade viram categoria,
+os demais textos usam strings do Arrow (se o pyarrow estiver instalado) e as
+datas (só no formato ISO, para não trocar dia e mês) são convertidas uma única vez.
+"""
+import re
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+try:
+    import pyarrow  # noqa: F401
+    TIPO_TEXTO = "string[pyarrow]"
+except ImportError:
+    TIPO_TEXTO = None  # sem pyarrow: textos continuam como object
+
+_REGEX_DATA_ISO = re.compile(r"^\d{4}-\d{2}-\d{2}([ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?$")
+
+# (limite inferior, limite superior, tipo no PostgreSQL)
+_INTEIROS_POSTGRES = ((-2 ** 15, 2 ** 15 - 1, "SMALLINT"), (-2 ** 31, 2 ** 31 - 1, "INTEGER"),
+                      (-2 ** 63, 2 ** 63 - 1, "BIGINT"))
+
+
+def _eh_texto(serie: pd.Series) -> bool:
+    return (pd.api.types.is_object_dtype(serie) or pd.api.types.is_string_dtype(serie)
+            or isinstance(serie.dtype, pd.CategoricalDtype))
+
+
+def _tipo_data(validos: pd.Series):
+    """"data"/"data_hora" se todos os valores da amostra são datas ISO (None caso contrário)
+
+    Só o formato ISO (aaaa-mm-dd) é aceito: em 01/02/2023 o pandas assumiria mês primeiro e trocaria
+    dia e mês das datas brasileiras sem avisar.
+    """
+    if pd.api.types.is_datetime64_any_dtype(validos):
+        datas = validos
+    else:
+        textos = validos.astype(str)
+        if not textos.str.match(_REGEX_DATA_ISO).all():
+            return None
+        datas = pd.to_datetime(textos, format="ISO8601", errors="coerce")
+        if datas.isna().any():
+            return None
+    return "data" if (datas == datas.dt.normalize()).all() else "data_hora"
+
+
+def _inteiro_postgres(minimo, maximo) -> str:
+    return next(tipo for inferior, superior, tipo in _INTEIROS_POSTGRES if inferior <= minimo and maximo <= superior)
+
+
+def inferir_tipos(amostra: pd.DataFrame, perfil: Dict = None, fracao_categoria: float = 0.5) -> Dict[str, Dict]:
+    """Tipo de cada coluna: {"tipo": inteiro/decimal/booleano/data/data_hora/categoria/texto, "postgres": ...}
+
+    perfil (de perfil_bi, arquivo inteiro) confirma os tipos da amostra; sem ele os inteiros ficam BIGINT,
+    porque a amostra não garante o intervalo do arquivo todo.
+    """
+    tipos_perfil = (perfil or {}).get("tipos_dados", {})
+    estatisticas = (perfil or {}).get("estatisticas", {})
+    tipos = {}
+    for coluna in amostra.columns:
+        serie = amostra[coluna]
+        validos = serie.dropna()
+        no_arquivo = tipos_perfil.get(coluna)
+        if no_arquivo == "object" and not _eh_texto(serie):
+            serie = validos = validos.astype(str)  # a amostra parecia numérica, o arquivo inteiro não é
+
+        if pd.api.types.is_bool_dtype(serie):
+            tipos[coluna] = {"tipo": "booleano", "postgres": "BOOLEAN"}
+        elif pd.api.types.is_integer_dtype(serie) and no_arquivo in (None, "int64"):
+            info = estatisticas.get(coluna, {})
+            postgres = _inteiro_postgres(info["min"], info["max"]) if "min" in info else "BIGINT"
+            tipos[coluna] = {"tipo": "inteiro", "postgres": postgres}
+        elif pd.api.types.is_numeric_dtype(serie):
+            tipos[coluna] = {"tipo": "decimal", "postgres": "DOUBLE PRECISION"}
+        else:
+            tipos[coluna] = _tipo_textual(validos, fracao_categoria)
+    return tipos
+
+
+def _tipo_textual(validos: pd.Series, fracao_categoria: float) -> Dict:
+    """Data, categoria (poucos valores distintos) ou texto livre"""
+    data = _tipo_data(validos) if not validos.empty else None
+    if data is not None:
+        return {"tipo": data, "postgres": "DATE" if data == "data" else "TIMESTAMP"}
+    if not validos.empty and validos.nunique() <= fracao_categoria * len(validos):
+        return {"tipo": "categoria", "postgres": "TEXT"}
+    return {"tipo": "texto", "postgres": "TEXT"}
+
+
+def _converter_datas(serie: pd.Series) -> pd.Series:
+    """Datas ISO que chegaram como texto; qualquer valor fora do formato mantém a coluna como veio"""
+    try:
+        return pd.to_datetime(serie, format="ISO8601")
+    except (ValueError, TypeError):
+        return serie
+
+
+def _float32_exato(serie: pd.Series) -> pd.Series:
+    reduzida = serie.astype(np.float32)
+    iguais = (reduzida.astype(np.float64) == serie) | serie.isna()
+    return reduzida if iguais.all() else serie
+
+
+def aplicar_tipos(df: pd.DataFrame, tipos: Dict[str, Dict]) -> pd.DataFrame:
+    """Converte as colunas para os tipos compactos; coluna que contradiz a inferência fica como veio"""
+    convertidas = {}
+    for coluna in df.columns:
+        serie, tipo = df[coluna], tipos.get(coluna, {}).get("tipo")
+        if tipo == "inteiro" and pd.api.types.is_integer_dtype(serie):
+            serie = pd.to_numeric(serie, downcast="integer")
+        elif tipo == "decimal" and pd.api.types.is_float_dtype(serie):
+            serie = _float32_exato(serie)
+        elif tipo == "categoria" and not isinstance(serie.dtype, pd.CategoricalDtype):
+            serie = serie.astype("category")
+        elif tipo == "texto" and TIPO_TEXTO and pd.api.types.is_object_dtype(serie):
+            serie = serie.astype(TIPO_TEXTO)
+        elif tipo in ("data", "data_hora") and not pd.api.types.is_datetime64_any_dtype(serie):
+            serie = _converter_datas(serie)
+        convertidas[coluna] = serie
+    return pd.DataFrame(convertidas, index=df.index)
+
+
+def _concatenar(blocos: List[pd.DataFrame]) -> pd.DataFrame:
+    """Junta os blocos unindo as categorias (pd.concat voltaria categorias diferentes para object)"""
+    if len(blocos) == 1:
+        return blocos[0]
+    colunas = {}
+    for coluna in blocos[0].columns:
+        partes = [bloco[coluna] for bloco in blocos]
+        if all(isinstance(parte.dtype, pd.CategoricalDtype) for parte in partes):
+            colunas[coluna] = pd.Series(union_categoricals(partes, ignore_order=True), name=coluna)
+        else:
+            colunas[coluna] = pd.concat(partes, ignore_index=True)
+    return pd.DataFrame(colunas)
+
+
+def ler_csv_compacto(fonte, tipos: Dict[str, Dict], linhas_bloco: int = 100_000) -> pd.DataFrame:
+    """Lê o CSV inteiro em blocos, já nos tipos compactos
+
+    As datas são convertidas uma vez, na coluna inteira e só no formato ISO: parse_dates interpretaria um
+    01/02/2023 do meio do arquivo como mês primeiro; assim, um valor fora do formato mantém a coluna como texto.
+    """
+    datas = [c for c, t in tipos.items() if t["tipo"] in ("data", "data_hora")]
+    sem_datas = {c: t for c, t in tipos.items() if c not in datas}
+    categorias = {c: "category" for c, t in tipos.items() if t["tipo"] == "categoria"}
+    blocos = [aplicar_tipos(bloco, sem_datas)
+              for bloco in pd.read_csv(fonte, chunksize=linhas_bloco, dtype=categorias)]
+    if not blocos:
+        if hasattr(fonte, "seek"):
+            fonte.seek(0)
+        return pd.read_csv(fonte, nrows=0)
+    df = _concatenar(blocos)
+    for coluna in datas:
+        if coluna in df.columns:
+            df[coluna] = _converter_datas(df[coluna])
+    return df
+
+
+def memoria_bytes(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(deep=True, index=False).sum())
@@ -0,0 +1,104 @@
+"""Uploads em memória: o agente aceita buffers, não só caminhos de arquivo.
+
+Cada buffer (bytes, memoryview, BytesIO ou o arquivo do st.file_uploader) é
+registrado uma vez sob um caminho virtual "mem://<hash>/<nome>". O hash é o
+mesmo de agent_bi.hash_arquivo (blake2b do conteúdo) e vai no próprio
+caminho, então os caches de datasets, perfis e gráficos e o registro de
+staging reconhecem o upload sem ler nada de novo. As leituras usam BytesIO
+sobre os bytes registrados: o CPython compartilha o buffer em vez de copiá-lo.
+"""
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict
+
+PREFIXO = "mem://"
+
+_LOCK = threading.Lock()
+_UPLOADS = OrderedDict()  # hash -> bytes (LRU limitado em bytes)
+_ESTATISTICAS = {"registros": 0, "reaproveitados": 0, "despejos": 0, "bytes": 0}
+
+
+def eh_upload(caminho) -> bool:
+    return isinstance(caminho, str) and caminho.startswith(PREFIXO)
+
+
+def _bytes(dados) -> bytes:
+    """Bytes do buffer sem cópia quando possível (bytes e BytesIO não modificado são compartilhados)"""
+    if isinstance(dados, bytes):
+        return dados
+    if isinstance(dados, memoryview):
+        if isinstance(dados.obj, bytes) and dados.nbytes == len(dados.obj):
+            return dados.obj
+        return dados.tobytes()
+    if isinstance(dados, bytearray):
+        return bytes(dados)
+    if hasattr(dados, "getvalue"):
+        return dados.getvalue()
+    return dados.read()
+
+
+def registrar_upload(dados, nome: str = None, limite_mb: float = 1024) -> str:
+    """Registra o buffer e devolve o caminho virtual a usar no lugar do caminho do arquivo"""
+    nome = os.path.basename(nome or getattr(dados, "name", None) or "upload.csv")
+    conteudo = _bytes(dados)
+    digest = hashlib.blake2b(conteudo, digest_size=16).hexdigest()
+    limite = int(limite_mb * 1024 * 1024)
+    with _LOCK:
+        if digest in _UPLOADS:
+            _UPLOADS.move_to_end(digest)
+            _ESTATISTICAS["reaproveitados"] += 1
+        else:
+            while _UPLOADS and _ESTATISTICAS["bytes"] + len(conteudo) > limite:
+                _, antigo = _UPLOADS.popitem(last=False)
+                _ESTATISTICAS["bytes"] -= len(antigo)
+                _ESTATISTICAS["despejos"] += 1
+            _UPLOADS[digest] = conteudo
+            _ESTATISTICAS["bytes"] += len(conteudo)
+            _ESTATISTICAS["registros"] += 1
+    return f"{PREFIXO}{digest}/{nome}"
+
+
+def digest_upload(caminho: str) -> str:
+    """Hash do conteúdo, tirado do próprio caminho virtual (sem ler os dados)"""
+    return caminho[len(PREFIXO):].split("/", 1)[0]
+
+
+def upload_registrado(caminho: str) -> bool:
+    """False se o buffer saiu do registro (despejado pelo limite de memória)"""
+    with _LOCK:
+        return digest_upload(caminho) in _UPLOADS
+
+
+def dados_upload(caminho: str) -> bytes:
+    with _LOCK:
+        dados = _UPLOADS.get(digest_upload(caminho))
+    if dados is None:
+        raise FileNotFoundError(f"Upload não está mais em memória: {os.path.basename(caminho)}")
+    return dados
+
+
+def fonte_csv(caminho: str):
+    """O que passar ao pandas: o caminho em disco ou um BytesIO sobre o upload"""
+    return io.BytesIO(dados_upload(caminho)) if eh_upload(caminho) else caminho
+
+
+def abrir_binario(caminho: str):
+    """Arquivo binário para leitura (COPY, hash de prefixo), do disco ou da memória"""
+    return io.BytesIO(dados_upload(caminho)) if eh_upload(caminho) else open(caminho, "rb")
+
+
+def tamanho_fonte(caminho: str) -> int:
+    return len(dados_upload(caminho)) if eh_upload(caminho) else os.path.getsize(caminho)
+
+
+def estatisticas_uploads() -> Dict:
+    """Buffers registrados, reaproveitamentos entre execuções e memória ocupada"""
+    with _LOCK:
+        return {
+            **{chave: valor for chave, valor in _ESTATISTICAS.items() if chave != "bytes"},
+            "entradas": len(_UPLOADS),
+            "memoria_mb": round(_ESTATISTICAS["bytes"] / 1024 / 1024, 2),
+        }
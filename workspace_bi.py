@@ -0,0 +1,234 @@
+"""Workspace colunar: cada CSV convertido uma única vez para Parquet, pelo hash do conteúdo.
+
+A conversão usa o leitor de CSV do pyarrow em fluxo (um grupo de linhas por
+bloco, memória limitada) e grava em um arquivo temporário renomeado no fim,
+então processos e threads concorrentes nunca veem um Parquet pela metade. As
+leituras seguintes abrem o arquivo com memory map e leem só as colunas
+pedidas; filtros (formato do pyarrow, ex.: [("ano", ">=", 2024)]) descartam
+grupos de linhas inteiros pelas estatísticas de mínimo/máximo. Arquivos sem
+acesso há mais de max_idade_horas saem primeiro; depois, os de acesso mais
+antigo, até o total caber em max_mb. Sem pyarrow, nada é convertido e os
+chamadores continuam lendo o CSV.
+"""
+import io
+import os
+import threading
+import time
+import uuid
+from typing import Dict, Iterator, List, Optional
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow é opcional
+    pa = None
+
+_LOCK = threading.Lock()
+_CONVERSOES: Dict[str, threading.Lock] = {}
+_FALHAS = set()  # hashes que o pyarrow não conseguiu converter (tipos inconsistentes entre blocos)
+_ESTATISTICAS = {"conversoes": 0, "falhas": 0, "leituras": 0, "despejos": 0}
+
+# Valores lidos como nulos, os mesmos do pandas.read_csv: sem isso o pyarrow guarda células de texto
+# vazias como '' e o Parquet passa a dar resultados diferentes do CSV (IS NULL, contagem de nulos)
+VALORES_NULOS = ["", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+                 "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"]
+_VERSAO_CONVERSAO = "v2"  # v2: nulos como no pandas.read_csv
+
+
+def workspace_disponivel() -> bool:
+    return pa is not None
+
+
+def caminho_colunar(pasta: str, digest: str) -> str:
+    # O sufixo muda quando a conversão muda; arquivos de versões anteriores saem pelo despejo por idade
+    return os.path.join(pasta, f"{digest}.{_VERSAO_CONVERSAO}.parquet")
+
+
+def converter_csv(fonte, destino: str, linhas_grupo: int = 100_000) -> Dict:
+    """Converte o CSV (caminho ou bytes) para Parquet em fluxo; devolve linhas, tamanho e tempo"""
+    inicio = time.perf_counter()
+    entrada = pa.BufferReader(fonte) if isinstance(fonte, (bytes, memoryview)) else fonte
+    temporario = f"{destino}.{uuid.uuid4().hex[:8]}.tmp"
+    os.makedirs(os.path.dirname(destino) or ".", exist_ok=True)
+    leitor = pa_csv.open_csv(entrada, read_options=pa_csv.ReadOptions(block_size=16 * 1024 * 1024),
+                             convert_options=pa_csv.ConvertOptions(strings_can_be_null=True,
+                                                                   null_values=VALORES_NULOS))
+    linhas = 0
+    try:
+        with pq.ParquetWriter(temporario, leitor.schema) as escritor:
+            # Lotes do leitor juntados até um grupo de linhas: grupos pequenos demais enfraquecem os filtros
+            pendentes, linhas_pendentes = [], 0
+            for lote in leitor:
+                pendentes.append(lote)
+                linhas_pendentes += lote.num_rows
+                if linhas_pendentes >= linhas_grupo:
+                    escritor.write_table(pa.Table.from_batches(pendentes), row_group_size=linhas_grupo)
+                    linhas += linhas_pendentes
+                    pendentes, linhas_pendentes = [], 0
+            if pendentes or not linhas:
+                escritor.write_table(pa.Table.from_batches(pendentes, schema=leitor.schema),
+                                     row_group_size=linhas_grupo)
+                linhas += linhas_pendentes
+        os.replace(temporario, destino)
+    except BaseException:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+    return {"linhas": linhas, "bytes": os.path.getsize(destino), "segundos": round(time.perf_counter() - inicio, 3)}
+
+
+def conversao_falhou(digest: str) -> bool:
+    return digest in _FALHAS
+
+
+def registrar_conversao(digest: str, convertido: bool):
+    """Contabiliza uma conversão feita em outro processo (pool de perfis)"""
+    with _LOCK:
+        if convertido:
+            _ESTATISTICAS["conversoes"] += 1
+        else:
+            _FALHAS.add(digest)
+            _ESTATISTICAS["falhas"] += 1
+
+
+def obter_colunar(pasta: str, digest: str, fonte, linhas_grupo: int = 100_000,
+                  converter: bool = True) -> Optional[str]:
+    """Caminho do Parquet do conteúdo, convertendo na primeira vez (None sem pyarrow ou se a conversão falhar)
+
+    fonte: caminho do CSV ou função sem argumentos que devolve os bytes (chamada só se for converter).
+    """
+    if pa is None or digest in _FALHAS:
+        return None
+    destino = caminho_colunar(pasta, digest)
+    if not os.path.exists(destino):
+        if not converter:
+            return None
+        with _LOCK:
+            trava = _CONVERSOES.setdefault(digest, threading.Lock())
+        with trava:
+            if not os.path.exists(destino):
+                dados = fonte() if callable(fonte) else fonte
+                try:
+                    converter_csv(dados, destino, linhas_grupo)
+                except (pa.ArrowInvalid, OSError):
+                    with _LOCK:
+                        _FALHAS.add(digest)
+                        _ESTATISTICAS["falhas"] += 1
+                    return None
+                with _LOCK:
+                    _ESTATISTICAS["conversoes"] += 1
+    try:
+        os.utime(destino)  # o mtime marca o último acesso (atime costuma estar desligado)
+    except OSError:
+        return None  # despejado entre a checagem e o acesso
+    with _LOCK:
+        _ESTATISTICAS["leituras"] += 1
+    return destino
+
+
+def _para_pandas(tabela) -> pd.DataFrame:
+    return tabela.to_pandas(date_as_object=False)
+
+
+def ler_colunar(caminho: str, colunas: List[str] = None, filtros: List = None,
+                categorias: List[str] = None) -> pd.DataFrame:
+    """Lê o Parquet com memory map, só as colunas pedidas e só os grupos de linhas que passam nos filtros"""
+    tabela = pq.read_table(caminho, columns=colunas, filters=filtros, memory_map=True,
+                           read_dictionary=[c for c in categorias or [] if colunas is None or c in colunas] or None)
+    return _para_pandas(tabela)
+
+
+def amostra_colunar(caminho: str, linhas: int, colunas: List[str] = None) -> pd.DataFrame:
+    """Primeiras linhas (lê só o primeiro lote do primeiro grupo de linhas)"""
+    arquivo = pq.ParquetFile(caminho, memory_map=True)
+    for lote in arquivo.iter_batches(batch_size=max(1, linhas), columns=colunas):
+        return _para_pandas(pa.Table.from_batches([lote]))
+    return _para_pandas(arquivo.schema_arrow.empty_table())
+
+
+def blocos_colunar(caminho: str, linhas_bloco: int, colunas: List[str] = None) -> Iterator[pd.DataFrame]:
+    """DataFrames de até linhas_bloco linhas, na ordem do arquivo"""
+    arquivo = pq.ParquetFile(caminho, memory_map=True)
+    for lote in arquivo.iter_batches(batch_size=linhas_bloco, columns=colunas):
+        yield _para_pandas(pa.Table.from_batches([lote]))
+
+
+def colunas_colunar(caminho: str) -> List[str]:
+    return pq.read_schema(caminho, memory_map=True).names
+
+
+def perfilar_colunar(caminho: str, linhas_bloco: int = 100_000, tamanho_amostra: int = 10_000,
+                     linhas_exemplo: int = 3) -> Dict:
+    """Perfil (perfil_bi) lendo os blocos do Parquet em vez de reinterpretar o texto do CSV"""
+    from perfil_bi import perfilar_blocos
+    return perfilar_blocos(blocos_colunar(caminho, linhas_bloco), tamanho_amostra, linhas_exemplo,
+                           colunas_colunar(caminho))
+
+
+def perfilar_convertendo(fonte, destino: str, linhas_grupo: int = 100_000, linhas_bloco: int = 100_000,
+                         tamanho_amostra: int = 10_000, linhas_exemplo: int = 3) -> Dict:
+    """Converte o CSV (caminho ou bytes) e perfila o Parquet no mesmo processo, para rodar no pool
+
+    Devolve {"perfil", "convertido"}; se o pyarrow não conseguir converter, perfila o próprio CSV.
+    """
+    from perfil_bi import perfilar_csv
+    try:
+        if not os.path.exists(destino):
+            converter_csv(fonte, destino, linhas_grupo)
+        convertido = True
+    except (pa.ArrowInvalid, OSError):
+        convertido = False
+    if convertido:
+        perfil = perfilar_colunar(destino, linhas_bloco, tamanho_amostra, linhas_exemplo)
+    else:
+        perfil = perfilar_csv(io.BytesIO(fonte) if isinstance(fonte, (bytes, memoryview)) else fonte,
+                              linhas_bloco, tamanho_amostra, linhas_exemplo)
+    return {"perfil": perfil, "convertido": convertido}
+
+
+def despejar_workspace(pasta: str, max_mb: float, max_idade_horas: float, manter: str = None) -> int:
+    """Remove os arquivos vencidos e, depois, os de acesso mais antigo até caber no limite; devolve quantos saíram
+
+    manter: arquivo que acabou de ser convertido e vai ser lido em seguida (nunca é removido).
+    """
+    try:
+        arquivos = [(entrada.path, entrada.stat()) for entrada in os.scandir(pasta)
+                    if entrada.name.endswith(".parquet")]
+    except FileNotFoundError:
+        return 0
+    arquivos.sort(key=lambda item: item[1].st_mtime)
+    limite_idade = time.time() - max_idade_horas * 3600
+    total = sum(stat.st_size for _, stat in arquivos)
+    removidos = 0
+    for caminho, stat in arquivos:
+        if stat.st_mtime >= limite_idade and total <= max_mb * 1024 * 1024:
+            break
+        if manter and os.path.samefile(caminho, manter):
+            continue
+        try:
+            os.remove(caminho)
+        except OSError:
+            continue
+        total -= stat.st_size
+        removidos += 1
+    with _LOCK:
+        _ESTATISTICAS["despejos"] += removidos
+    return removidos
+
+
+def estatisticas_workspace(pasta: str) -> Dict:
+    """Conversões, leituras, despejos e ocupação do workspace em disco"""
+    try:
+        tamanhos = [entrada.stat().st_size for entrada in os.scandir(pasta) if entrada.name.endswith(".parquet")]
+    except FileNotFoundError:
+        tamanhos = []
+    with _LOCK:
+        return {
+            **_ESTATISTICAS,
+            "disponivel": workspace_disponivel(),
+            "arquivos": len(tamanhos),
+            "tamanho_mb": round(sum(tamanhos) / 1024 / 1024, 2),
+        }